@@ -41,12 +41,13 @@ except ImportError:
 
 import osc.conf
 import osc.core
-from osc.util.cpio import CpioRead
 
 import urllib2
 import rpm
 from collections import namedtuple
+from osclib import cpio
 from osclib.pkgcache import PkgCache
+from osclib.pkgcache import get_binary_file
 from osclib.comments import CommentAPI
 
 from abichecker_common import CACHEDIR
@@ -180,6 +181,7 @@ class ABIChecker(ReviewBot.ReviewBot):
         self.ts.setVSFlags(rpm._RPMVSF_NOSIGNATURES)
 
         self.pkgcache = PkgCache(BINCACHE)
+        self.pkgcache.maintenance()
 
         # reports of source submission
         self.reports = []
@@ -698,42 +700,19 @@ class ABIChecker(ReviewBot.ReviewBot):
             downloaded = self.download_files(project, package, repo, arch, fetchlist, mtimes)
 
             # extract binary rpms
-            tmpfile = os.path.join(CACHEDIR, "cpio")
+            dst = os.path.join(UNPACKDIR, project, package, repo, arch)
             for fn in fetchlist:
                 self.logger.debug("extract %s"%fn)
-                with open(tmpfile, 'wb') as tmpfd:
-                    if not fn in downloaded:
-                        raise FetchError("%s was not downloaded!"%fn)
-                    self.logger.debug(downloaded[fn])
-                    r = subprocess.call(['rpm2cpio', downloaded[fn]], stdout=tmpfd, close_fds=True)
-                    if r != 0:
-                        raise FetchError("failed to extract %s!"%fn)
-                    tmpfd.close()
-                    cpio = CpioRead(tmpfile)
-                    cpio.read()
-                    for ch in cpio:
-                        fn = ch.filename
-                        if fn.startswith('./'): # rpm payload is relative
-                            fn = fn[1:]
-                        self.logger.debug("cpio fn %s", fn)
-                        if not fn in liblist and not fn in debugfiles:
-                            continue
-                        dst = os.path.join(UNPACKDIR, project, package, repo, arch)
-                        dst += fn
-                        if not os.path.exists(os.path.dirname(dst)):
-                            os.makedirs(os.path.dirname(dst))
-                        self.logger.debug("dst %s", dst)
-                        # the filehandle in the cpio archive is private so
-                        # open it again
-                        with open(tmpfile, 'rb') as cpiofh:
-                            cpiofh.seek(ch.dataoff, os.SEEK_SET)
-                            with open(dst, 'wb') as fh:
-                                while True:
-                                    buf = cpiofh.read(4096)
-                                    if buf is None or buf == '':
-                                        break
-                                    fh.write(buf)
-            os.unlink(tmpfile)
+                if not fn in downloaded:
+                    raise FetchError("%s was not downloaded!"%fn)
+                self.logger.debug(downloaded[fn])
+                try:
+                    with cpio.rpm_payload(downloaded[fn]) as payload:
+                        extracted = cpio.extract(payload, dst,
+                                                 lambda name: name in liblist or name in debugfiles)
+                except Exception, e:
+                    raise FetchError("failed to extract %s: %s"%(fn, e))
+                self.logger.debug("extracted %s", pformat(extracted))
 
             return liblist
 
@@ -760,12 +739,16 @@ class ABIChecker(ReviewBot.ReviewBot):
                 os.unlink(target)
             except:
                 pass
-            self.pkgcache.linkto(key, target)
-        else:
-            osc.core.get_binary_file(self.apiurl, project, repository, arch,
-                            filename, package=package,
-                            target_filename=target)
-            self.pkgcache[key] = target
+            try:
+                self.pkgcache.linkto(key, target)
+                return
+            except KeyError:
+                # Evicted by another process after the lookup.
+                pass
+        md5 = get_binary_file(self.apiurl, project, repository, arch,
+                              filename, package=package,
+                              target_filename=target)
+        self.pkgcache.add(key, target, md5)
 
     def readRpmHeaderFD(self, fd):
         h = None
@@ -792,21 +775,18 @@ class ABIChecker(ReviewBot.ReviewBot):
         for chunk in r:
             tmpfile.write(chunk)
         tmpfile.close()
-        cpio = CpioRead(tmpfile.name)
-        cpio.read()
         rpm_re = re.compile('(.+\.rpm)-[0-9A-Fa-f]{32}$')
-        for ch in cpio:
-            # ignore errors
-            if ch.filename == '.errors':
-                continue
-            # the filehandle in the cpio archive is private so
-            # open it again
-            with open(tmpfile.name, 'rb') as fh:
-                fh.seek(ch.dataoff, os.SEEK_SET)
+        with cpio.Cpio.open(tmpfile.name) as archive, open(tmpfile.name, 'rb') as fh:
+            for ch in archive:
+                # ignore errors
+                if ch.name == '.errors':
+                    continue
+                # rpm reads the header from a file descriptor
+                fh.seek(ch.payloadstart, os.SEEK_SET)
                 h = self.readRpmHeaderFD(fh)
                 if h is None:
-                    raise FetchError("failed to read rpm header for %s"%ch.filename)
-                m = rpm_re.match(ch.filename)
+                    raise FetchError("failed to read rpm header for %s"%ch.name)
+                m = rpm_re.match(ch.name)
                 if m:
                     yield m.group(1), h
         os.unlink(tmpfile.name)
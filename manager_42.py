@@ -106,7 +106,7 @@ class Manager42(object):
         self._put_lookup_file(self.config.from_prj, data)
         self.lookup_changes = 0
 
-    @memoize()
+    @memoize(compress='zlib')
     def _cached_GET(self, url):
         return self.retried_GET(url).read()
 
@@ -0,0 +1,61 @@
+#!/usr/bin/python
+
+import argparse
+import glob
+import os
+import sqlite3
+import sys
+
+import osclib.memoize
+
+
+def caches(cachedir):
+    """Return the name and file of every persistent @memoize cache."""
+    for filename in sorted(glob.glob(os.path.join(cachedir, '*.sqlite'))):
+        yield os.path.basename(filename)[:-len('.sqlite')], filename
+
+
+def do_list(args):
+    print('%-32s %8s %12s %10s %10s %10s %6s' % ('function', 'entries', 'bytes', 'hits', 'misses', 'evictions', 'ratio'))
+    for name, filename in caches(args.cachedir):
+        db = sqlite3.connect(filename, timeout=60)
+        try:
+            stats = osclib.memoize.stats(db)
+        finally:
+            db.close()
+        print('%-32s %8d %12d %10d %10d %10d %6.1f' % (name, stats['entries'], stats['bytes'],
+                                                       stats.get('hit', 0), stats.get('miss', 0),
+                                                       stats.get('eviction', 0), stats.get('ratio', 1)))
+
+
+def do_prune(args):
+    for name, filename in caches(args.cachedir):
+        if args.function and name not in args.function:
+            continue
+        ttl = 0 if args.all else args.max_age
+        removed = osclib.memoize.prune(filename, ttl)
+        if removed:
+            print('%s: removed %d entries' % (name, removed))
+
+
+def main(args):
+    args.func(args)
+
+
+if __name__ == '__main__':
+    description = 'List and prune the persistent caches of @memoize functions.'
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--cachedir', default=osclib.memoize.CACHEDIR, metavar='DIR', help='cache directory')
+    subparsers = parser.add_subparsers()
+
+    parser_list = subparsers.add_parser('list', help='print size and statistics of every cache')
+    parser_list.set_defaults(func=do_list)
+
+    parser_prune = subparsers.add_parser('prune', help='remove expired entries (by default using the TTL of the function)')
+    parser_prune.add_argument('-a', '--all', action='store_true', help='remove all the entries')
+    parser_prune.add_argument('--max-age', type=int, metavar='SECONDS', help='remove entries older than SECONDS')
+    parser_prune.add_argument('function', nargs='*', help='only prune the caches of these functions')
+    parser_prune.set_defaults(func=do_prune)
+    args = parser.parse_args()
+
+    sys.exit(main(args))
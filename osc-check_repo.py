@@ -464,6 +464,8 @@ def _print_request_and_specs(self, request_and_specs):
 @cmdln.option('-c', '--skipcycle', action='store_true', help='skip cycle check')
 @cmdln.option('-n', '--dry', action='store_true', help='dry run, don\'t change review state')
 @cmdln.option('-v', '--verbose', action='store_true', help='verbose output')
+@cmdln.option('--headers-only', action='store_true',
+              help='download only the headers of the RPMs, enough for the repo checker')
 def do_check_repo(self, subcmd, opts, *args):
     """${cmd_name}: Checker review of submit requests.
 
@@ -487,7 +489,8 @@ def do_check_repo(self, subcmd, opts, *args):
     self.checkrepo = CheckRepo(self.get_api_url(),
                                'openSUSE:%s' % opts.project,
                                readonly=opts.dry,
-                               debug=opts.verbose)
+                               debug=opts.verbose,
+                               headers_only=opts.headers_only)
 
     prjs_or_pkg = [arg for arg in args if not arg.isdigit()]
     ids = [arg for arg in args if arg.isdigit()]
@@ -24,6 +24,7 @@ import warnings
 import yaml
 
 from osc import cmdln
+from osc import conf
 from osc import oscerr
 
 # Expand sys.path to search modules inside the pluging directory
@@ -99,6 +100,8 @@ def _full_project_name(self, project):
               help='do not update bootstrap-copy when freezing')
 @cmdln.option('--wipe-cache', dest='wipe_cache', action='store_true', default=False,
               help='wipe GET request cache before executing')
+@cmdln.option('--stale', metavar='SECONDS', type='int', default=0,
+              help='serve cached GET requests expired for up to SECONDS while they are refreshed (check and list only)')
 @cmdln.option('-m', '--message', help='message used by ignore command')
 @cmdln.option('--filter-by', action='append', help='xpath by which to filter requests')
 @cmdln.option('--group-by', action='append', help='xpath by which to group requests')
@@ -185,13 +188,13 @@ def do_staging(self, subcmd, opts, *args):
 
     Usage:
         osc staging accept [--force] [LETTER...]
-        osc staging check [--old] REPO
+        osc staging check [--old] [--stale SECONDS] REPO
         osc staging cleanup_rings
         osc staging freeze [--no-boostrap] PROJECT...
         osc staging frozenage PROJECT...
         osc staging ignore [-m MESSAGE] REQUEST...
         osc staging unignore REQUEST...|all
-        osc staging list [--supersede]
+        osc staging list [--supersede | --stale SECONDS]
         osc staging select [--no-freeze] [--move [--from PROJECT] STAGING REQUEST...
         osc staging select [--no-freeze] [[--interactive] [--filter-by...] [--group-by...]] [STAGING...] [REQUEST...]
         osc staging unselect REQUEST...
@@ -226,6 +229,9 @@ def do_staging(self, subcmd, opts, *args):
         raise oscerr.WrongArgs('Too few arguments.')
     if max_args is not None and len(args) - 1 > max_args:
         raise oscerr.WrongArgs('Too many arguments.')
+    # Outdated data is only acceptable when nothing is changed based on it.
+    if opts.stale and (cmd not in ('check', 'list') or opts.supersede):
+        raise oscerr.WrongArgs('--stale is only supported by check and list without --supersede.')
 
     # Init the OBS access and configuration
     opts.project = self._full_project_name(opts.project)
@@ -238,6 +244,8 @@ def do_staging(self, subcmd, opts, *args):
 
     with OBSLock(opts.apiurl, opts.project):
         api = StagingAPI(opts.apiurl, opts.project)
+        if opts.stale:
+            Cache.init(stale=opts.stale)
 
         # call the respective command and parse args by need
         if cmd == 'check':
@@ -400,3 +408,6 @@ def do_staging(self, subcmd, opts, *args):
             AdiCommand(api).perform(args[1:], move=opts.move, by_dp=opts.by_develproject, split=opts.split)
         elif cmd == 'repair':
             RepairCommand(api).perform(args[1:])
+
+    if conf.config['debug']:
+        print('CACHE_STATS', Cache.stats, file=sys.stderr)
@@ -0,0 +1,110 @@
+# Copyright (C) 2016 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Streaming parser of the _builddepinfo documents of OBS.
+
+The packages are read one by one with iterparse, and their elements
+cleared and dropped from the root as soon as they are read, so the whole
+tree of a big project is never in memory.  To look up single packages,
+use the index of a depsnapshot.Snapshot.
+
+"""
+
+from collections import namedtuple
+from cStringIO import StringIO
+from xml.etree import cElementTree as ET
+
+
+# A <package/> element: the name, the source package, and the names of
+# the dependencies and of the subpackages.
+Package = namedtuple('Package', ('name', 'source', 'deps', 'subs'))
+
+
+def _open(source):
+    """Accept a document as a string as well as a file object."""
+    return StringIO(source) if isinstance(source, basestring) else source
+
+
+def iterparse(source, cycles=None):
+    """Iterate over the packages of the _builddepinfo 'source'.
+
+    If 'cycles' is a list, the cycles of the document are appended to it
+    as frozensets of package names.
+
+    """
+    context = ET.iterparse(_open(source), events=('start', 'end'))
+    _, root = next(context)
+    for event, element in context:
+        if event != 'end':
+            continue
+        if element.tag == 'package' and element.get('name'):
+            yield Package(element.get('name'),
+                          element.findtext('source'),
+                          [intern(e.text) for e in element.findall('pkgdep')],
+                          [intern(e.text) for e in element.findall('subpkg')])
+        elif element.tag == 'cycle':
+            if cycles is not None:
+                cycles.append(frozenset(e.text for e in element.findall('package')))
+        else:
+            continue
+        # The cleared elements are still children of the root.
+        element.clear()
+        root.clear()
+
+
+class BuildDepInfo(object):
+    """All the packages of a _builddepinfo, read in a single pass.
+
+    packages:  dict of package name: Package, in document order.
+    subpkgs:   dict of subpackage: name of the package.  If several
+               packages provide the same subpackage the first one is
+               kept.
+    cycles:    list of the cycles of the project.
+
+    """
+
+    def __init__(self, source, ignore=None, cycles=None):
+        """Read 'source', skipping the packages for which 'ignore', a
+        function of the package name, is true.
+
+        'source' can also be an iterable of Package, already read, with
+        the list of 'cycles'.
+
+        """
+        self.names = []
+        self.packages = {}
+        self.subpkgs = {}
+        if cycles is None:
+            self.cycles = []
+            source = iterparse(source, self.cycles)
+        else:
+            self.cycles = list(cycles)
+        for package in source:
+            if ignore and ignore(package.name):
+                continue
+            self.names.append(package.name)
+            self.packages[package.name] = package
+            for subpkg in package.subs:
+                self.subpkgs.setdefault(subpkg, package.name)
+
+    def __contains__(self, name):
+        return name in self.packages
+
+    def __getitem__(self, name):
+        return self.packages[name]
+
+    def __iter__(self):
+        return (self.packages[name] for name in self.names)
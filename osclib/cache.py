@@ -1,16 +1,23 @@
 from __future__ import print_function
 
 import datetime
+import fcntl
 import hashlib
+import json
 import os
 import osc.core
 import re
 import shutil
+import sqlite3
 import sys
+import tempfile
+import threading
+import urllib2
 import urlparse
+from collections import OrderedDict
+from contextlib import contextmanager
 from StringIO import StringIO
 from osc import conf
-from osc.core import urlopen
 from time import time
 
 try:
@@ -28,18 +35,285 @@ def http_request(method, url, headers={}, data=None, file=None):
         ret = Cache.get(url)
         if ret:
             return ret
-    else:
-        # Logically, seems to make more sense after real call, but practically
-        # it should not matter and makes the apitests happy when dealing with
-        # request acceptance which causes a GET to determine target project.
-        Cache.delete(url)
 
-    ret = osc.core._http_request(method, url, headers, data, file)
+        ret = Cache.stale(url)
+        if ret:
+            Cache.refresh(url, headers)
+            return ret
 
-    if method == 'GET':
-        ret = Cache.put(url, ret)
+        with Cache.flight(url):
+            # Another caller may have fetched the url while waiting.
+            ret = Cache.get(url)
+            if ret:
+                return ret
+
+            return Cache.fetch(url, headers, data, file)
+
+    # Logically, seems to make more sense after real call, but practically
+    # it should not matter and makes the apitests happy when dealing with
+    # request acceptance which causes a GET to determine target project.
+    Cache.delete(url)
+
+    return osc.core._http_request(method, url, headers, data, file)
+
+
+def _write_atomic(path, text):
+    """
+    Write a file through a temporary file of the writer renamed into place,
+    so that concurrent writers and readers never see a partial file.
+    """
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp',
+                               dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.rename(tmp, path)
+    except:
+        os.unlink(tmp)
+        raise
+
+
+class FileStore(object):
+    """
+    Store each cached response in a separate file named after the sha1 of the
+    url within a directory per host and project.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def close(self):
+        pass
 
-    return ret
+    def path(self, url, project, include_file=False, makedirs=False):
+        parts = [self.directory]
+
+        o = urlparse.urlsplit(url)
+        parts.append(o.hostname)
+
+        if project:
+            parts.append(project)
+
+        directory = os.path.join(*parts)
+        if not os.path.exists(directory) and makedirs:
+            os.makedirs(directory)
+
+        if include_file:
+            parts.append(hashlib.sha1(url).hexdigest())
+            return os.path.join(*parts)
+
+        return directory
+
+    def get(self, url, project):
+        path = self.path(url, project, include_file=True)
+        try:
+            mtime = os.path.getmtime(path)
+            with open(path) as f:
+                text = f.read()
+        except (IOError, OSError):
+            return None
+
+        # Validators are kept in a sidecar file next to the body.
+        validators = (None, None)
+        try:
+            with open(path + '.validators') as f:
+                validators = tuple(line.rstrip('\n') or None for line in f)
+        except (IOError, OSError):
+            pass
+
+        return (mtime, text, validators)
+
+    def write(self, path, text):
+        # Background refreshes of other processes may write the same entry.
+        _write_atomic(path, text)
+
+    def put(self, url, project, ttl, text, validators=(None, None)):
+        path = self.path(url, project, include_file=True, makedirs=True)
+        self.write(path, text)
+
+        if any(validators):
+            self.write(path + '.validators', '\n'.join(v or '' for v in validators) + '\n')
+        elif os.path.exists(path + '.validators'):
+            os.remove(path + '.validators')
+
+    def touch(self, url, project):
+        # Like put(), refresh the directory mtime as well to keep the
+        # project_mtime() semantics of SQLiteStore.
+        now = time()
+        try:
+            os.utime(self.path(url, project, include_file=True), (now, now))
+            os.utime(self.path(url, project), (now, now))
+        except OSError:
+            pass
+        return now
+
+    def delete(self, url, project):
+        path = self.path(url, project, include_file=True)
+        if os.path.exists(path + '.validators'):
+            os.remove(path + '.validators')
+        if os.path.exists(path):
+            os.remove(path)
+            return True
+        return False
+
+    def delete_project(self, apiurl, project):
+        path = self.path(apiurl, project)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+            return True
+        return False
+
+    def project_mtime(self, apiurl, project):
+        # The directory mtime reflects the last time an entry was added or
+        # removed for the project.
+        path = self.path(apiurl, project)
+        if os.path.exists(path):
+            return os.path.getmtime(path)
+        return None
+
+
+class SQLiteStore(object):
+    """
+    Store all cached responses in a single SQLite database keyed by url.
+
+    Entries carry their host and project so that a project can be invalidated
+    by a single indexed delete instead of walking thousands of small files.
+    """
+
+    FILENAME = 'cache.sqlite'
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(directory, self.FILENAME),
+                                  timeout=60, check_same_thread=False)
+        self.db.text_factory = str
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS cache ('
+                            'url TEXT PRIMARY KEY, '
+                            'host TEXT NOT NULL, '
+                            'project TEXT, '
+                            'ttl INTEGER NOT NULL, '
+                            'mtime REAL NOT NULL, '
+                            'etag TEXT, '
+                            'last_modified TEXT, '
+                            'data BLOB NOT NULL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS cache_project ON cache (host, project)')
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def execute(self, sql, parameters=()):
+        with self.lock, self.db:
+            return self.db.execute(sql, parameters).fetchall()
+
+    def get(self, url, project):
+        rows = self.execute('SELECT mtime, data, etag, last_modified FROM cache WHERE url = ?', (url,))
+        if rows:
+            mtime, data, etag, last_modified = rows[0]
+            return (mtime, str(data), (etag, last_modified))
+        return None
+
+    def put(self, url, project, ttl, text, validators=(None, None)):
+        self.execute('INSERT OR REPLACE INTO cache (url, host, project, ttl, mtime, etag, last_modified, data) '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                     (url, urlparse.urlsplit(url).hostname, project, ttl, time(),
+                      validators[0], validators[1], sqlite3.Binary(text)))
+
+    def touch(self, url, project):
+        now = time()
+        self.execute('UPDATE cache SET mtime = ? WHERE url = ?', (now, url))
+        return now
+
+    def delete(self, url, project):
+        with self.lock, self.db:
+            return self.db.execute('DELETE FROM cache WHERE url = ?', (url,)).rowcount > 0
+
+    def delete_project(self, apiurl, project):
+        with self.lock, self.db:
+            return self.db.execute('DELETE FROM cache WHERE host = ? AND project IS ?',
+                                   (urlparse.urlsplit(apiurl).hostname, project)).rowcount > 0
+
+    def project_mtime(self, apiurl, project):
+        # Mirror the directory mtime semantics of FileStore.
+        rows = self.execute('SELECT MAX(mtime) FROM cache WHERE host = ? AND project IS ?',
+                            (urlparse.urlsplit(apiurl).hostname, project))
+        return rows[0][0]
+
+
+class MemoryStore(object):
+    """
+    Bounded least recently used store kept in front of the disk store.
+
+    Holds the same (mtime, text, validators) entries as the disk store so that
+    the ttl and project invalidation rules apply unchanged.
+    """
+
+    def __init__(self, entries, size):
+        self.entries = entries
+        self.size = size
+        self.used = 0
+        self.lock = threading.Lock()
+        self.data = OrderedDict()
+
+    def _remove(self, url):
+        item = self.data.pop(url, None)
+        if item:
+            self.used -= len(item[2][1])
+        return item
+
+    def get(self, url):
+        with self.lock:
+            item = self.data.pop(url, None)
+            if item:
+                # Re-insert to mark as most recently used.
+                self.data[url] = item
+                return item[2]
+        return None
+
+    def put(self, url, apiurl, project, entry):
+        with self.lock:
+            self._remove(url)
+            if len(entry[1]) > self.size:
+                return
+
+            self.data[url] = (apiurl, project, entry)
+            self.used += len(entry[1])
+            self._evict()
+
+    def _evict(self):
+        while len(self.data) > self.entries or self.used > self.size:
+            _, item = self.data.popitem(last=False)
+            self.used -= len(item[2][1])
+
+    def resize(self, entries, size):
+        """Change the limits, keeping the entries that still fit."""
+        with self.lock:
+            if (entries, size) != (self.entries, self.size):
+                self.entries = entries
+                self.size = size
+                self._evict()
+
+    def delete(self, url):
+        with self.lock:
+            return self._remove(url) is not None
+
+    def delete_project(self, apiurl, project):
+        with self.lock:
+            for url, item in self.data.items():
+                if item[:2] == (apiurl, project):
+                    self._remove(url)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.used = 0
 
 
 class Cache(object):
@@ -61,9 +335,30 @@ class Cache(object):
 
     Any paths without a project context will be cleared when updated using this
     cache, but obviously not for other contributors.
+
+    Entries are kept either in one file per url (file backend) or in a single
+    SQLite database (sqlite backend) which avoids the inode and stat overhead
+    of the former on large caches. Recently used entries are also kept in
+    memory to avoid going to disk for urls requested repeatedly in one run.
     """
 
     CACHE_DIR = os.path.expanduser('~/.cache/osc-plugin-factory')
+    BACKEND = 'file'
+    BACKENDS = {
+        'file': FileStore,
+        'sqlite': SQLiteStore,
+    }
+    # The latest_updated statistics are fetched in growing chunks until they
+    # overlap with the previously stored history.
+    LATEST_UPDATED_STEP = 100
+    LATEST_UPDATED_LIMIT = 5000
+    # Expired entries may be served for up to STALE seconds while they are
+    # refreshed in the background. Disabled by default and only enabled by
+    # read-only commands.
+    STALE = 0
+    MEMORY_ENTRIES = 512
+    MEMORY_SIZE = 64 * 1024 * 1024
+    memory = MemoryStore(MEMORY_ENTRIES, MEMORY_SIZE)
     TTL_LONG = 12 * 60 * 60
     TTL_SHORT = 5 * 60
     TTL_DUPLICATE = 3
@@ -92,9 +387,38 @@ class Cache(object):
     }
 
     last_updated = {}
+    _store = None
+
+    # Incremented whenever entries are invalidated so that background
+    # refreshes started before can discard their result.
+    generation = 0
+    lock = threading.Lock()
+    refreshing = set()
+    flights = {}
+
+    # Counters of cacheable GET requests: served from the cache, revalidated
+    # by a 304 response (and the bytes that did not need to be transferred),
+    # served expired while being refreshed, and fully downloaded.
+    stats = {
+        'hit': 0,
+        'revalidate': 0,
+        'revalidate_bytes': 0,
+        'stale': 0,
+        'miss': 0,
+    }
 
     @staticmethod
-    def init():
+    def init(backend=None, stale=None):
+        if backend:
+            if backend not in Cache.BACKENDS:
+                raise Exception('Unknown cache backend {}'.format(backend))
+            Cache.BACKEND = backend
+        if stale is not None:
+            Cache.STALE = int(stale)
+
+        # Every StagingAPI calls init(), so keep the entries of the run.
+        Cache.memory.resize(Cache.MEMORY_ENTRIES, Cache.MEMORY_SIZE)
+
         Cache.patterns = []
         for pattern in Cache.PATTERNS:
             Cache.patterns.append(re.compile(pattern))
@@ -105,11 +429,39 @@ class Cache(object):
             osc.core._http_request = osc.core.http_request
             osc.core.http_request = http_request
 
+    @staticmethod
+    def store():
+        store = Cache._store
+        if (store is None or store.directory != Cache.CACHE_DIR or
+                not isinstance(store, Cache.BACKENDS[Cache.BACKEND])):
+            if store:
+                store.close()
+            Cache.memory.clear()
+            Cache._store = Cache.BACKENDS[Cache.BACKEND](Cache.CACHE_DIR)
+        return Cache._store
+
+    @staticmethod
+    def entry(url, project, ttl):
+        """
+        Lookup an entry in the memory store falling back to the disk store.
+
+        An expired memory entry is dropped in favor of the disk store since
+        another process may have refreshed the entry in the meantime.
+        """
+        entry = Cache.memory.get(url)
+        if entry is not None and time() - entry[0] > ttl:
+            Cache.memory.delete(url)
+            entry = None
+        if entry is None:
+            entry = Cache.store().get(url, project)
+            if entry:
+                Cache.memory.put(url, Cache.spliturl(url)[0], project, entry)
+        return entry
+
     @staticmethod
     def get(url):
         match, project = Cache.match(url)
         if match:
-            path = Cache.path(url, project, include_file=True)
             ttl = Cache.PATTERNS[match]
 
             if project:
@@ -130,13 +482,6 @@ class Cache(object):
                 unchanged_since = datetime.datetime.strptime(unchanged_since, '%Y-%m-%dT%H:%M:%SZ')
                 history_span = now - unchanged_since
 
-                # Treat non-existant cache as brand new for the sake of history
-                # span check since it behaves as desired.
-                age = 0
-                directory = Cache.path(url, project)
-                if os.path.exists(directory):
-                    age = time() - os.path.getmtime(directory)
-
                 # If history span is shorter than allowed cache life and the age
                 # of the current cache is older than history span with no
                 # changes the cache cannot be guaranteed. For example:
@@ -145,57 +490,237 @@ class Cache(object):
                 #   age = 0.75
                 # Cannot be guaranteed.
                 ttl_delta = datetime.timedelta(seconds=ttl)
-                age_delta = datetime.timedelta(seconds=age)
-                if history_span < ttl_delta and age_delta > history_span:
-                    Cache.delete_project(apiurl, project)
-
-            if os.path.exists(path) and time() - os.path.getmtime(path) <= ttl:
+                if history_span < ttl_delta:
+                    # Treat non-existant cache as brand new for the sake of
+                    # history span check since it behaves as desired.
+                    age = 0
+                    mtime = Cache.store().project_mtime(apiurl, project)
+                    if mtime:
+                        age = time() - mtime
+
+                    age_delta = datetime.timedelta(seconds=age)
+                    if age_delta > history_span:
+                        Cache.delete_project(apiurl, project)
+
+            entry = Cache.entry(url, project, ttl)
+            if entry and time() - entry[0] <= ttl:
                 if conf.config['debug']: print('CACHE_GET', url, file=sys.stderr)
-                return urlopen('file://' + path)
+                Cache.stats['hit'] += 1
+                return StringIO(entry[1])
             else:
-                reason = '(' + ('expired' if os.path.exists(path) else 'does not exist') + ')'
+                reason = '(' + ('expired' if entry else 'does not exist') + ')'
                 if conf.config['debug']: print('CACHE_MISS', url, reason, file=sys.stderr)
 
         return None
 
     @staticmethod
-    def put(url, data):
+    def stale(url):
+        """
+        Return an expired entry that may be served while being refreshed.
+        """
+        if not Cache.STALE:
+            return None
+
         match, project = Cache.match(url)
-        if match:
-            path = Cache.path(url, project, include_file=True, makedirs=True)
+        # Duplicate ttl paths only guard against rapid repeated requests and
+        # must always reflect the latest state, as must the latest_updated
+        # statistics which are used to expire the other entries.
+        if (match and Cache.PATTERNS[match] != Cache.TTL_DUPLICATE and
+                not match.startswith('/statistics/latest_updated')):
+            entry = Cache.entry(url, project, Cache.PATTERNS[match])
+            if entry and time() - entry[0] <= Cache.PATTERNS[match] + Cache.STALE:
+                if conf.config['debug']: print('CACHE_STALE', url, file=sys.stderr)
+                Cache.stats['stale'] += 1
+                return StringIO(entry[1])
+        return None
+
+    @staticmethod
+    def refresh(url, headers={}):
+        """
+        Refresh an entry in a background thread.
+        """
+        with Cache.lock:
+            if url in Cache.refreshing:
+                return
+            Cache.refreshing.add(url)
+            generation = Cache.generation
+
+        def run():
+            try:
+                Cache.fetch(url, headers, generation=generation)
+            except Exception as e:
+                if conf.config['debug']: print('CACHE_REFRESH_FAILED', url, e, file=sys.stderr)
+            finally:
+                with Cache.lock:
+                    Cache.refreshing.discard(url)
+
+        # Do not hold up the exit of short runs for pending refreshes.
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    @staticmethod
+    @contextmanager
+    def flight(url):
+        """
+        Allow only one caller at a time to fetch a given url.
+
+        Threads wait on a lock per url while other processes wait on a lock
+        file which is removed by its holder once done.
+        """
+        match, _ = Cache.match(url)
+        if not match:
+            yield
+            return
+
+        with Cache.lock:
+            flight = Cache.flights.setdefault(url, [threading.Lock(), 0])
+            flight[1] += 1
+
+        try:
+            with flight[0]:
+                directory = os.path.join(Cache.CACHE_DIR, urlparse.urlsplit(url).hostname)
+                if not os.path.exists(directory):
+                    os.makedirs(directory)
+                path = os.path.join(directory, hashlib.sha1(url).hexdigest() + '.lck')
+
+                while True:
+                    lckfile = open(path, 'a')
+                    fcntl.flock(lckfile.fileno(), fcntl.LOCK_EX)
+                    # Retry if the holder before removed the lock file while
+                    # this process was waiting on it.
+                    try:
+                        if os.stat(path).st_ino == os.fstat(lckfile.fileno()).st_ino:
+                            break
+                    except OSError:
+                        pass
+                    lckfile.close()
+
+                try:
+                    yield
+                finally:
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+                    fcntl.flock(lckfile.fileno(), fcntl.LOCK_UN)
+                    lckfile.close()
+        finally:
+            with Cache.lock:
+                flight[1] -= 1
+                if not flight[1]:
+                    del Cache.flights[url]
 
+    @staticmethod
+    def fetch(url, headers={}, data=None, file=None, generation=None):
+        """
+        Request url from the server and cache the response.
+
+        An expired entry with validators is revalidated with a conditional
+        request instead of downloading the body again.
+        """
+        validators = Cache.validators(url)
+        if validators:
+            conditional = dict(headers)
+            conditional.update(validators)
+            try:
+                ret = osc.core._http_request('GET', url, conditional, data, file)
+                return Cache.put(url, ret, generation)
+            except urllib2.HTTPError as e:
+                if e.code != 304:
+                    raise
+                ret = Cache.revalidated(url, generation)
+                if ret:
+                    return ret
+
+        ret = osc.core._http_request('GET', url, headers, data, file)
+        return Cache.put(url, ret, generation)
+
+    @staticmethod
+    def put(url, data, generation=None):
+        match, project = Cache.match(url)
+        if match:
             # Since urlopen does not return a seekable stream it cannot be reset
-            # after writing to cache. As such a wrapper must be used. This could
-            # be replaced with urlopen('file://...') to be consistent, but until
-            # the need arrises StringIO has less overhead.
+            # after writing to cache. As such a wrapper must be used.
+            validators = (None, None)
+            if hasattr(data, 'info'):
+                info = data.info()
+                validators = (info.getheader('ETag'), info.getheader('Last-Modified'))
+
             text = data.read()
             data = StringIO(text)
 
-            if conf.config['debug']: print('CACHE_PUT', url, project, file=sys.stderr)
-            f = open(path,'w')
-            f.write(text)
-            f.close()
+            Cache.stats['miss'] += 1
+            with Cache.lock:
+                if generation is not None and generation != Cache.generation:
+                    # Invalidated while the request was in flight.
+                    return data
+
+                if conf.config['debug']: print('CACHE_PUT', url, project, file=sys.stderr)
+                now = time()
+                Cache.store().put(url, project, Cache.PATTERNS[match], text, validators)
+                Cache.memory.put(url, Cache.spliturl(url)[0], project, (now, text, validators))
 
         return data
 
     @staticmethod
-    def delete(url):
+    def validators(url):
+        """
+        Return the conditional request headers for an expired entry, if any.
+        """
+        match, project = Cache.match(url)
+        if match:
+            entry = Cache.entry(url, project, Cache.PATTERNS[match])
+            if entry:
+                etag, last_modified = entry[2]
+                headers = {}
+                if etag:
+                    headers['If-None-Match'] = etag
+                if last_modified:
+                    headers['If-Modified-Since'] = last_modified
+                return headers
+        return {}
+
+    @staticmethod
+    def revalidated(url, generation=None):
+        """
+        Refresh the timestamp of an entry confirmed unchanged by the server.
+        """
         match, project = Cache.match(url)
         if match:
-            path = Cache.path(url, project, include_file=True)
+            with Cache.lock:
+                if generation is not None and generation != Cache.generation:
+                    return None
+
+                entry = Cache.entry(url, project, Cache.PATTERNS[match])
+                if entry:
+                    if conf.config['debug']: print('CACHE_REVALIDATE', url, file=sys.stderr)
+                    mtime = Cache.store().touch(url, project)
+                    Cache.memory.put(url, Cache.spliturl(url)[0], project, (mtime,) + entry[1:])
+                    Cache.stats['revalidate'] += 1
+                    Cache.stats['revalidate_bytes'] += len(entry[1])
+                    return StringIO(entry[1])
+        return None
 
+    @staticmethod
+    def delete(url):
+        match, project = Cache.match(url)
+        if match:
             # Rather then wait for last updated statistics to expire, remove the
             # project cache if applicable.
             if project:
                 apiurl, _ = Cache.spliturl(url)
+                target = project
                 if project.isdigit():
                     # Clear target project cache upon request acceptance.
-                    project = osc.core.get_request(apiurl, project).actions[0].tgt_project
-                Cache.delete_project(apiurl, project)
+                    target = osc.core.get_request(apiurl, project).actions[0].tgt_project
+                Cache.delete_project(apiurl, target)
 
-            if os.path.exists(path):
+            with Cache.lock:
+                Cache.generation += 1
+            Cache.memory.delete(url)
+            if Cache.store().delete(url, project):
                 if conf.config['debug']: print('CACHE_DELETE', url, file=sys.stderr)
-                os.remove(path)
 
         # Also delete version without query. This does not handle other
         # variations using different query strings. Handy for PUT with ?force=1.
@@ -206,14 +731,18 @@ class Cache(object):
 
     @staticmethod
     def delete_project(apiurl, project):
-        path = Cache.path(apiurl, project)
-
-        if os.path.exists(path):
+        with Cache.lock:
+            Cache.generation += 1
+        Cache.memory.delete_project(apiurl, project)
+        if Cache.store().delete_project(apiurl, project):
             if conf.config['debug']: print('CACHE_DELETE_PROJECT', apiurl, project, file=sys.stderr)
-            shutil.rmtree(path)
 
     @staticmethod
     def delete_all():
+        Cache.memory.clear()
+        if Cache._store:
+            Cache._store.close()
+            Cache._store = None
         if os.path.exists(Cache.CACHE_DIR):
             shutil.rmtree(Cache.CACHE_DIR)
 
@@ -235,39 +764,83 @@ class Cache(object):
         return (apiurl, path)
 
     @staticmethod
-    def path(url, project, include_file=False, makedirs=False):
-        parts = [Cache.CACHE_DIR]
+    def last_updated_load(apiurl):
+        """
+        Load the project last updated map, merging newer remote entries.
 
-        o = urlparse.urlsplit(url)
-        parts.append(o.hostname)
+        The map is persisted per apiurl so short-lived processes start warm and
+        history is kept when more than LATEST_UPDATED_LIMIT updates happen
+        between two runs.
+        """
+        if apiurl in Cache.last_updated:
+            return
 
-        if project:
-            parts.append(project)
+        path = os.path.join(Cache.CACHE_DIR, urlparse.urlsplit(apiurl).hostname, 'latest_updated.json')
+        try:
+            with open(path) as f:
+                last_updated = dict((str(k), v if k == '__fetched' else str(v))
+                                    for k, v in json.load(f).items())
+        except (IOError, ValueError):
+            last_updated = {}
+
+        fetched = last_updated.pop('__fetched', 0)
+        if time() - fetched > Cache.TTL_SHORT:
+            Cache.last_updated_fetch(apiurl, last_updated)
+            Cache.last_updated_prune(last_updated)
+
+            directory = os.path.dirname(path)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            data = dict(last_updated, __fetched=time())
+            _write_atomic(path, json.dumps(data))
 
-        directory = os.path.join(*parts)
-        if not os.path.exists(directory) and makedirs:
-            os.makedirs(directory)
+        Cache.last_updated[apiurl] = last_updated
 
-        if include_file:
-            parts.append(hashlib.sha1(url).hexdigest())
-            return os.path.join(*parts)
+    @staticmethod
+    def last_updated_fetch(apiurl, last_updated):
+        newest = last_updated.get('__newest')
+        limit = Cache.LATEST_UPDATED_STEP if newest else Cache.LATEST_UPDATED_LIMIT
+        while True:
+            url = osc.core.makeurl(apiurl, ['statistics', 'latest_updated'], {'limit': limit})
+            root = ET.parse(osc.core.http_GET(url)).getroot()
+            # Entities repesent either a project or package.
+            entities = [(entity.attrib['name' if entity.tag == 'project' else 'project'],
+                         entity.attrib['updated']) for entity in root]
 
-        return directory
+            # Stop once the entries overlap the stored history or the server
+            # has no more to offer.
+            if len(entities) < limit or (newest and entities[-1][1] <= newest):
+                break
 
-    @staticmethod
-    def last_updated_load(apiurl):
-        if apiurl in Cache.last_updated:
-            return
+            if limit >= Cache.LATEST_UPDATED_LIMIT:
+                # Too many updates since the last run to connect with the
+                # stored history so start over.
+                last_updated.clear()
+                break
 
-        url = osc.core.makeurl(apiurl, ['statistics', 'latest_updated'], {'limit': 5000})
-        root = ET.parse(osc.core.http_GET(url)).getroot()
-        last_updated = {}
-        for entity in root:
-            # Entities repesent either a project or package.
-            key = 'name' if entity.tag == 'project' else 'project'
-            if entity.attrib[key] not in last_updated:
-                last_updated[entity.attrib[key]] = entity.attrib['updated']
+            limit = min(limit * 10, Cache.LATEST_UPDATED_LIMIT)
+
+        for project, updated in entities:
+            if updated > last_updated.get(project, ''):
+                last_updated[project] = updated
+
+        if entities:
+            last_updated['__newest'] = max(newest or '', entities[0][1])
 
         # Keep track of the last entry to indicate the covered timespan.
-        last_updated['__oldest'] = entity.attrib['updated']
-        Cache.last_updated[apiurl] = last_updated
+        if '__oldest' not in last_updated:
+            if entities:
+                last_updated['__oldest'] = entities[-1][1]
+            else:
+                last_updated['__oldest'] = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    @staticmethod
+    def last_updated_prune(last_updated):
+        # Updates older than the longest ttl can not affect any cache entry, so
+        # drop them and shorten the covered timespan accordingly.
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=max(Cache.PATTERNS.values()))
+        cutoff = cutoff.strftime('%Y-%m-%dT%H:%M:%SZ')
+        for project, updated in last_updated.items():
+            if not project.startswith('__') and updated < cutoff:
+                del last_updated[project]
+        last_updated['__oldest'] = max(last_updated['__oldest'], cutoff)
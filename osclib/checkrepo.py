@@ -14,28 +14,38 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+from multiprocessing.pool import ThreadPool
 import os
 import re
-import subprocess
+import time
 from urllib import quote_plus
 import urllib2
 from xml.etree import cElementTree as ET
 from pprint import pformat
 
-from osc.core import get_binary_file
 from osc.core import http_DELETE
 from osc.core import http_GET
 from osc.core import http_POST
 from osc.core import makeurl
+from osclib import cpio
+from osclib.cycle import CycleDetector
 from osclib.stagingapi import StagingAPI
 from osclib.memoize import memoize
 from osclib.pkgcache import PkgCache
+from osclib.pkgcache import get_binary_file
+from osclib.rpmheader import Package
 
 
 # Directory where download binary packages.
 BINCACHE = os.path.expanduser('~/co')
 DOWNLOADS = os.path.join(BINCACHE, 'downloads')
 
+# Number of binary files downloaded at the same time.
+DOWNLOAD_THREADS = 8
+
+# Name of the entries of view=cpioheaders: the file name and its MD5.
+CPIOHEADER_RE = re.compile(r'(.+\.rpm)-[0-9A-Fa-f]{32}$')
+
 
 class Request(object):
     """Simple request container."""
@@ -138,13 +148,19 @@ class Request(object):
 
 class CheckRepo(object):
 
-    def __init__(self, apiurl, project, readonly=False, force_clean=False, debug=False):
+    # Replace the RPMs with their headers, enough for repo-checker.pl.
+    headers_only = False
+
+    def __init__(self, apiurl, project, readonly=False, force_clean=False, debug=False,
+                 headers_only=False):
         """CheckRepo constructor."""
         self.apiurl = apiurl
+        self.headers_only = headers_only
         self.project = project
         self.staging = StagingAPI(apiurl, self.project)
 
         self.pkgcache = PkgCache(BINCACHE, force_clean=force_clean)
+        self.pkgcache.maintenance()
 
         # grouped = { id: staging, }
         self.grouped = {}
@@ -602,7 +618,10 @@ class CheckRepo(object):
         return True
 
     def _get_binary_file(self, project, repository, arch, package, filename, target, mtime):
-        """Get a binary file from OBS."""
+        """Get a binary file from OBS.  Return True if it was downloaded,
+        False if it was found in the cache.
+
+        """
         # Check if the file is already there.
         key = (project, repository, arch, package, filename, mtime)
         if key in self.pkgcache:
@@ -610,12 +629,61 @@ class CheckRepo(object):
                 os.unlink(target)
             except:
                 pass
-            self.pkgcache.linkto(key, target)
+            try:
+                self.pkgcache.linkto(key, target)
+                return False
+            except KeyError:
+                # Evicted by another process after the lookup.
+                pass
+        md5 = get_binary_file(self.apiurl, project, repository, arch,
+                              filename, package=package,
+                              target_filename=target)
+        self.pkgcache.add(key, target, md5)
+        return True
+
+    def _get_headers(self, project, repository, arch, package):
+        """Get the headers of the RPMs of a package with a single
+        view=cpioheaders request, as a dictionary of file name: header.
+
+        """
+        url = makeurl(self.apiurl, ('build', project, repository, arch, package),
+                      query={'view': 'cpioheaders'})
+        headers = {}
+        try:
+            response = http_GET(url)
+        except urllib2.HTTPError, e:
+            print('ERROR in URL %s [%s]' % (url, e))
+            return headers
+        # Only one header is kept in memory at a time.
+        for entry in cpio.stream(response):
+            result = CPIOHEADER_RE.match(entry.name)
+            if result:
+                headers[result.group(1)] = entry.header()
+        return headers
+
+    def _fetch(self, request, download, headers=None):
+        """Get one of the files of _download() and, for RPM packages, its
+        DISTURL.  Run in the threads of the download pool.
+
+        When the header of the file is in 'headers', a dictionary of
+        (project, repository, arch): _get_headers(), it is written in
+        place of the full RPM.
+
+        """
+        _project, _repo, arch, fn, mt = download
+        t = os.path.join(DOWNLOADS, request.src_package, _project, _repo, fn)
+        header = headers.get((_project, _repo, arch), {}).get(fn) if headers else None
+        if header is not None:
+            # Replace the file, that can be a link into the cache.
+            with open(t + '.part', 'wb') as f:
+                f.write(header)
+            os.rename(t + '.part', t)
+            size = len(header)
         else:
-            get_binary_file(self.apiurl, project, repository, arch,
-                            filename, package=package,
-                            target_filename=target)
-            self.pkgcache[key] = target
+            downloaded = self._get_binary_file(_project, _repo, arch, request.src_package, fn, t, mt)
+            size = os.path.getsize(t) if downloaded else 0
+        disturl = self._md5_disturl(self._disturl(t)) if fn.endswith('.rpm') else None
+        return t, size, disturl
 
     def _download(self, request, todownload):
         """Download the packages referenced in the 'todownload' list."""
@@ -628,50 +696,73 @@ class CheckRepo(object):
         todownload_rpm = [rpm for rpm in todownload if rpm[3].endswith('.rpm')]
         todownload_rest = [rpm for rpm in todownload if not rpm[3].endswith('.rpm')]
 
-        for _project, _repo, arch, fn, mt in todownload_rpm:
-            repodir = os.path.join(DOWNLOADS, request.src_package, _project, _repo)
-            if not os.path.exists(repodir):
-                os.makedirs(repodir)
-            t = os.path.join(repodir, fn)
-            self._get_binary_file(_project, _repo, arch, request.src_package, fn, t, mt)
-
-            # Organize the files into DISTURL directories.
-            disturl = self._md5_disturl(self._disturl(t))
-            disturldir = os.path.join(repodir, disturl)
-            last_disturl, last_disturldir = disturl, disturldir
-            file_in_disturl = os.path.join(disturldir, fn)
-            if not os.path.exists(disturldir):
-                os.makedirs(disturldir)
-            try:
-                os.symlink(t, file_in_disturl)
-            except:
-                pass
-                # print 'Found previous link.'
-
-            request.downloads[(_project, _repo, disturl)].append(file_in_disturl)
-
         # Some subpackage do not have any rpm (e.g. rpmlint)
-        if not last_disturldir:
+        if not todownload_rpm:
             return
 
-        for _project, _repo, arch, fn, mt in todownload_rest:
+        for _project, _repo, arch, fn, mt in todownload:
             repodir = os.path.join(DOWNLOADS, request.src_package, _project, _repo)
             if not os.path.exists(repodir):
                 os.makedirs(repodir)
-            t = os.path.join(repodir, fn)
-            self._get_binary_file(_project, _repo, arch, request.src_package, fn, t, mt)
 
-            file_in_disturl = os.path.join(last_disturldir, fn)
-            if last_disturldir:
+        # In headers only mode the RPMs are replaced by their headers, and
+        # only the other files are downloaded.
+        headers = {}
+        if self.headers_only:
+            for _project, _repo, arch in set(tuple(rpm[:3]) for rpm in todownload_rpm):
+                headers[(_project, _repo, arch)] = self._get_headers(
+                    _project, _repo, arch, request.src_package)
+
+        # The files are downloaded, and the DISTURL read, by a pool of
+        # threads, while the results are organized here in order.
+        start = time.time()
+        size = 0
+        pool = ThreadPool(min(DOWNLOAD_THREADS, len(todownload)))
+        results = pool.imap(lambda download: self._fetch(request, download, headers),
+                            todownload_rpm + todownload_rest)
+        pool.close()
+        try:
+            for _project, _repo, arch, fn, mt in todownload_rpm:
+                repodir = os.path.join(DOWNLOADS, request.src_package, _project, _repo)
+                t, _size, disturl = results.next()
+                size += _size
+
+                # Organize the files into DISTURL directories.
+                disturldir = os.path.join(repodir, disturl)
+                last_disturl, last_disturldir = disturl, disturldir
+                file_in_disturl = os.path.join(disturldir, fn)
+                if not os.path.exists(disturldir):
+                    os.makedirs(disturldir)
                 try:
                     os.symlink(t, file_in_disturl)
                 except:
                     pass
                     # print 'Found previous link.'
-            else:
-                print "I don't know where to put", fn
 
-            request.downloads[(_project, _repo, last_disturl)].append(file_in_disturl)
+                request.downloads[(_project, _repo, disturl)].append(file_in_disturl)
+
+            for _project, _repo, arch, fn, mt in todownload_rest:
+                t, _size, _ = results.next()
+                size += _size
+
+                file_in_disturl = os.path.join(last_disturldir, fn)
+                if last_disturldir:
+                    try:
+                        os.symlink(t, file_in_disturl)
+                    except:
+                        pass
+                        # print 'Found previous link.'
+                else:
+                    print "I don't know where to put", fn
+
+                request.downloads[(_project, _repo, last_disturl)].append(file_in_disturl)
+        finally:
+            pool.terminate()
+
+        if size:
+            elapsed = max(time.time() - start, 0.001)
+            print 'Downloaded %.1f MiB for #%s in %.1fs (%.1f MiB/s)' % (
+                size / 1048576.0, request.request_id, elapsed, size / 1048576.0 / elapsed)
 
     def _toignore(self, request):
         """Return the list of files to ignore during the checkrepo."""
@@ -690,12 +781,8 @@ class CheckRepo(object):
 
     def _disturl(self, filename):
         """Get the DISTURL from a RPM file."""
-        pid = subprocess.Popen(
-            ('rpm', '--nosignature', '--queryformat', '%{DISTURL}', '-qp', filename),
-            stdout=subprocess.PIPE, close_fds=True)
-        os.waitpid(pid.pid, 0)[1]
-        disturl = pid.stdout.readlines()[0]
-        return disturl
+        # Like `rpm -qp`, that prints (none) for a missing tag.
+        return Package.open(filename).disturl or '(none)'
 
     def _md5_disturl(self, disturl):
         """Get the md5 from the DISTURL from a RPM file."""
@@ -933,28 +1020,21 @@ class CheckRepo(object):
 
         """
         deps = set()
-        query = {
-            'package': request.tgt_package,
-            'view': 'revpkgnames',
-        }
         for arch in ('i586', 'x86_64'):
-            url = makeurl(self.apiurl, ('build', request.tgt_project, 'standard', arch, '_builddepinfo'),
-                          query=query)
-            root = ET.parse(http_GET(url)).getroot()
-            deps.update(pkgdep.text for pkgdep in root.findall('.//pkgdep'))
+            snapshot = self._snapshot(request.tgt_project, 'standard', arch)
+            deps.update(snapshot.whatdependson(request.tgt_package))
         return deps
 
+    @memoize(ttl=60, session=True)
+    def _snapshot(self, project, repository, arch):
+        """Get the snapshot of the current _builddepinfo of a repository."""
+        return CycleDetector(self.staging).get_snapshot(project, repository, arch, current=True)
+
     def _builddepinfo(self, project, package):
         """Return the list dependencies for a request."""
         deps = set()
-        query = {
-            'package': package,
-        }
         for arch in ('i586', 'x86_64'):
-            url = makeurl(self.apiurl, ('build', project, 'standard', arch, '_builddepinfo'),
-                          query=query)
-            root = ET.parse(http_GET(url)).getroot()
-            deps.update(pkgdep.text for pkgdep in root.findall('.//pkgdep'))
+            deps.update(self._snapshot(project, 'standard', arch).pkgdeps(package))
         return deps
 
     def _maintainers(self, request):
@@ -3,6 +3,8 @@ from xml.etree import cElementTree as ET
 from osc.core import makeurl
 from osc.core import http_GET
 
+from osclib.cycle import CycleDetector
+
 
 class CleanupRings(object):
     def __init__(self, api):
@@ -60,18 +62,19 @@ class CleanupRings(object):
 
 
     def fill_pkgdeps(self, prj, repo, arch):
-        url = makeurl(self.api.apiurl, ['build', prj, repo, arch, '_builddepinfo'])
-        f = http_GET(url)
-        root = ET.parse(f).getroot()
-
-        for package in root.findall('package'):
-            source = package.find('source').text
-            if package.attrib['name'].startswith('preinstall'):
+        snapshot = CycleDetector(self.api).get_snapshot(prj, repo, arch, current=True)
+
+        # The dependencies can be resolved only when all the binaries
+        # are known, after reading the whole document.
+        pkgdeps = []
+        for package in snapshot:
+            source = package.source
+            pkgdeps.append((source, package.deps))
+            if package.name.startswith('preinstall'):
                 continue
             self.sources.add(source)
 
-            for subpkg in package.findall('subpkg'):
-                subpkg = subpkg.text
+            for subpkg in package.subs:
                 if subpkg in self.bin2src:
                     if self.bin2src[subpkg] == source:
                         # different archs
@@ -79,14 +82,13 @@ class CleanupRings(object):
                     print('Binary {} is defined twice: {}/{}'.format(subpkg, prj, source))
                 self.bin2src[subpkg] = source
 
-        for package in root.findall('package'):
-            source = package.find('source').text
-            for pkg in package.findall('pkgdep'):
-                if pkg.text not in self.bin2src:
-                    if not pkg.text.startswith('texlive-'): # XXX: texlive bullshit packaging
-                        print('Package {} not found in place'.format(pkg.text))
+        for source, deps in pkgdeps:
+            for pkg in deps:
+                if pkg not in self.bin2src:
+                    if not pkg.startswith('texlive-'): # XXX: texlive bullshit packaging
+                        print('Package {} not found in place'.format(pkg))
                     continue
-                b = self.bin2src[pkg.text]
+                b = self.bin2src[pkg]
                 self.pkgdeps[b] = source
 
     def check_depinfo_ring(self, prj, nextprj):
@@ -85,6 +85,11 @@ DEFAULT = {
 # rings = openSUSE:Factory:Rings
 # lock = openSUSE:Factory:Staging
 #
+# The HTTP cache backend can be selected in the same section, either
+# 'file' (default) or 'sqlite':
+#
+# cache-backend = sqlite
+#
 
 
 class Config(object):
@@ -19,12 +19,112 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import bz2
+import mmap
+import os
 import struct
+import subprocess
+import zlib
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from osclib.rpmheader import Package
+
+# Header of an entry in the "new ASCII" (070701) and "CRC" (070702) formats
+HEADER = "6s8s8s8s8s8s8s8s8s8s8s8s8s8s"
+HEADER_SIZE = struct.calcsize(HEADER)
+MAGICS = ("070701", "070702")
+
+# Size of the blocks copied at once (bytes)
+BLOCKSIZE = 1024*1024
+
+# Mode of regular files
+S_IFMT = 0170000
+S_IFREG = 0100000
+
+# Commands used to decompress the payload of a RPM when there is no
+# module for the compressor
+DECOMPRESSORS = {
+    'xz': ['xz', '-dc'],
+    'lzma': ['xz', '--format=lzma', '-dc'],
+    'zstd': ['zstd', '-dc'],
+}
+
+
+def _padding(off):
+    """Number of bytes to align 'off' to 4 bytes."""
+    return (4 - (off & 3)) & 3
+
+
+def _view(buf, start, size):
+    """Return 'size' bytes of 'buf' from 'start' without copying them."""
+    try:
+        return memoryview(buf)[start:start+size]
+    except TypeError:
+        # Python 2 mmap objects only provide the old buffer interface.
+        return buffer(buf, start, size)
+
+
+def _read(fh, size):
+    """Read exactly 'size' bytes, as file objects of HTTP responses may
+    return less.
+
+    """
+    chunks = []
+    while size > 0:
+        chunk = fh.read(size)
+        if not chunk:
+            raise Exception("truncated cpio archive")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
+
 
 class Cpio(object):
+    """Archive in a byte string or in any object supporting the buffer
+    interface, like a mmap.  Use Cpio.open() to map a file.
+
+    """
     def __init__(self, buf):
         self.buf = buf
         self.off = 0
+        self.mmap = None
+
+    @classmethod
+    def open(cls, f):
+        """Map the archive in 'f', a file name or a file object, into
+        memory.  Call close() (or use it in a 'with' block) when done.
+
+        """
+        fh = open(f, 'rb') if isinstance(f, basestring) else f
+        try:
+            buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            if fh is not f:
+                fh.close()
+        cpio = cls(buf)
+        cpio.mmap = buf
+        return cpio
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     def __iter__(self):
         return self
@@ -36,21 +136,151 @@ class Cpio(object):
         self.off = self.off+f.length()
         return f
 
+
+def _headers(fh):
+    """Iterate over the headers of the archive read from 'fh'.  The
+    payload of every entry, and its padding, must be read before the next
+    header.
+
+    """
+    while True:
+        buf = _read(fh, HEADER_SIZE)
+        namesize = int(buf[94:102], 16)
+        buf += _read(fh, namesize + _padding(HEADER_SIZE + namesize))
+        f = CpioFile(0, buf)
+        if f.fin():
+            return
+        yield f
+
+
+def stream(fh):
+    """Iterate over the entries of the archive read from 'fh', that does
+    not need to be seekable (like a HTTP response).  Only one entry is kept
+    in memory at a time.
+
+    """
+    for f in _headers(fh):
+        f.buf += _read(fh, f.c_filesize)
+        yield f
+        # Skip the padding of the payload
+        _read(fh, _padding(f.c_filesize))
+
+
+def _copy(fh, size, target=None):
+    """Copy 'size' bytes from 'fh' to 'target', or skip them."""
+    while size > 0:
+        block = _read(fh, min(size, BLOCKSIZE))
+        if target:
+            target.write(block)
+        size -= len(block)
+
+
+def extract(fh, dest, match=None):
+    """Extract the regular files of the archive read from 'fh' into the
+    directory 'dest'.  Only the files whose name (without the leading './'
+    of RPM payloads) satisfies 'match' are written.  Return the list of
+    names extracted.
+
+    """
+    extracted = []
+    for f in _headers(fh):
+        name = f.name[1:] if f.name.startswith('./') else f.name
+        if (f.c_mode & S_IFMT) == S_IFREG and (match is None or match(name)):
+            target = os.path.join(dest, name.lstrip('/'))
+            if not os.path.exists(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            with open(target, 'wb', BLOCKSIZE) as target:
+                _copy(fh, f.c_filesize, target)
+            extracted.append(name)
+        else:
+            _copy(fh, f.c_filesize)
+        _read(fh, _padding(f.c_filesize))
+    return extracted
+
+
+class Payload(object):
+    """Decompressed payload of a RPM, read as a file object."""
+
+    def __init__(self, fh, compressor):
+        self.fh = fh
+        self.process = None
+        # Decompressed data, of which the bytes before 'pos' are read
+        self.buf = ''
+        self.pos = 0
+
+        if compressor == 'gzip':
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif compressor == 'bzip2':
+            self.decompressor = bz2.BZ2Decompressor()
+        elif compressor in ('xz', 'lzma') and lzma:
+            self.decompressor = lzma.LZMADecompressor()
+        elif compressor == 'zstd' and zstandard:
+            self.decompressor = zstandard.ZstdDecompressor().decompressobj()
+        elif compressor in DECOMPRESSORS:
+            # The command reads the payload from the current offset of the
+            # descriptor, behind the one of the (buffered) file object.
+            self.decompressor = None
+            os.lseek(fh.fileno(), fh.tell(), os.SEEK_SET)
+            self.process = subprocess.Popen(DECOMPRESSORS[compressor], stdin=fh,
+                                            stdout=subprocess.PIPE, close_fds=True)
+        else:
+            raise Exception("unsupported payload compressor %s" % compressor)
+
+    def read(self, size):
+        if self.process:
+            return self.process.stdout.read(size)
+        while len(self.buf) - self.pos < size:
+            block = self.fh.read(BLOCKSIZE)
+            if not block:
+                break
+            # Drop the bytes read only when a block is added, instead of
+            # copying the rest of the buffer on every read.
+            self.buf = self.buf[self.pos:] + self.decompressor.decompress(block)
+            self.pos = 0
+        buf = self.buf[self.pos:self.pos+size]
+        self.pos += len(buf)
+        return buf
+
+    def close(self):
+        if self.process:
+            self.process.stdout.close()
+            if self.process.wait() not in (0, -13):
+                raise Exception("failed to decompress the payload")
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def rpm_payload(filename):
+    """Open the payload of the RPM 'filename' as a cpio archive, that is
+    decompressed while it is read (see stream() and extract()).
+
+    """
+    fh = open(filename, 'rb')
+    try:
+        return Payload(fh, Package.read(fh).payloadcompressor)
+    except:
+        fh.close()
+        raise
+
+
 class CpioFile(object):
     def __init__(self, off, buf):
         self.off = off
         self.buf = buf
-        
+
         if off&3:
             raise Exception("invalid offset %d"% off)
 
-        fmt = "6s8s8s8s8s8s8s8s8s8s8s8s8s8s"
-        off = self.off + struct.calcsize(fmt)
+        fields = struct.unpack_from(HEADER, buf, self.off)
+        off = self.off + HEADER_SIZE
 
-        fields = struct.unpack(fmt, buf[self.off:off])
-
-	if fields[0] != "070701":
-		raise Exception("invalid cpio header %s"%self.c_magic)
+        if fields[0] not in MAGICS:
+            raise Exception("invalid cpio header %s"%fields[0])
 
         names = ("c_ino", "c_mode", "c_uid", "c_gid",
                 "c_nlink", "c_mtime", "c_filesize",
@@ -60,10 +290,9 @@ class CpioFile(object):
             setattr(self, n, int(v, 16))
 
         nlen = self.c_namesize - 1
-        self.name = struct.unpack('%ds'%nlen, buf[off:off+nlen])[0]
+        self.name = struct.unpack_from('%ds'%nlen, buf, off)[0]
         off = off + nlen + 1
-        if off&3:
-            off = off + 4-(off&3) # padding
+        off = off + _padding(off)
         self.payloadstart = off
 
     def fin(self):
@@ -73,13 +302,16 @@ class CpioFile(object):
         return "[%s %d]"%(self.name, self.c_filesize)
 
     def header(self):
+        """Return a copy of the payload."""
         return self.buf[self.payloadstart:self.payloadstart+self.c_filesize]
 
+    def payload(self):
+        """Return the payload as a view of the archive, without copying it."""
+        return _view(self.buf, self.payloadstart, self.c_filesize)
+
     def length(self):
         l = self.payloadstart-self.off + self.c_filesize
-        if self.c_filesize&3:
-            l = l + 4-(self.c_filesize&3)
-        return l
+        return l + _padding(self.c_filesize)
 
 if __name__ == '__main__':
     from optparse import OptionParser
@@ -91,12 +323,11 @@ if __name__ == '__main__':
     (options, args) = parser.parse_args()
 
     for fn in args:
-        fh = open(fn, 'rb')
-        cpio = Cpio(fh.read())
-        for i in cpio:
-            print i
-            ofh = open(i.name, 'wb')
-            ofh.write(i.header())
-            ofh.close()
+        with Cpio.open(fn) as cpio:
+            for i in cpio:
+                print i
+                ofh = open(i.name, 'wb')
+                ofh.write(i.payload())
+                ofh.close()
 
 # vim: sw=4 et
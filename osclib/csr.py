@@ -0,0 +1,206 @@
+# Copyright (C) 2016 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Compact directed graph, with the nodes interned as integers and the
+adjacent lists stored in compressed sparse row (CSR) arrays.
+
+For a node i, its successors are targets[offsets[i]:offsets[i+1]], and
+its predecessors sources[roffsets[i]:roffsets[i+1]], both sorted.
+
+"""
+
+from array import array
+import struct
+
+MAGIC = 'CSRGRAPH1'
+HEADER = '<9sII'
+TYPECODE = 'i'
+
+
+def _csr(n, adj):
+    """Return the offsets and the targets of the adjacent lists 'adj'."""
+    offsets = array(TYPECODE, [0] * (n + 1))
+    targets = array(TYPECODE)
+    for i, succ in enumerate(adj):
+        targets.extend(sorted(succ))
+        offsets[i + 1] = len(targets)
+    return offsets, targets
+
+
+def _reverse(n, offsets, targets):
+    """Return the offsets and the sources of the reverse graph."""
+    roffsets = array(TYPECODE, [0] * (n + 1))
+    for v in targets:
+        roffsets[v + 1] += 1
+    for i in xrange(n):
+        roffsets[i + 1] += roffsets[i]
+    sources = array(TYPECODE, [0] * len(targets))
+    position = roffsets[:-1]
+    # Visiting the nodes in order keeps the sources sorted.
+    for u in xrange(n):
+        for j in xrange(offsets[u], offsets[u + 1]):
+            v = targets[j]
+            sources[position[v]] = u
+            position[v] += 1
+    return roffsets, sources
+
+
+class CSRGraph(object):
+    """Immutable graph.  Use CSRGraph.build() to create one."""
+
+    def __init__(self, names, offsets, targets, roffsets=None, sources=None, index=None):
+        self.names = names
+        if index is None:
+            index = dict((name, i) for i, name in enumerate(names))
+        self.index = index
+        self.offsets = offsets
+        self.targets = targets
+        if roffsets is None:
+            roffsets, sources = _reverse(len(names), offsets, targets)
+        self.roffsets = roffsets
+        self.sources = sources
+
+    @classmethod
+    def build(cls, names, edges, index=None):
+        """Create the graph of the nodes 'names' (a sequence of strings)
+        and 'edges' (an iterable of (u, v) names).
+
+        The 'index' of another graph (a dictionary name: number of the
+        same 'names' list) can be given to share it.
+
+        """
+        if index is None:
+            names = [intern(name) for name in names]
+            index = dict((name, i) for i, name in enumerate(names))
+        adj = [set() for _ in names]
+        for u, v in edges:
+            adj[index[u]].add(index[v])
+        return cls.from_adjacency(names, adj, index)
+
+    @classmethod
+    def from_adjacency(cls, names, adj, index=None):
+        """Create the graph of the nodes 'names' and 'adj', the list of
+        the successors of every node as numbers, without duplicates.
+
+        """
+        offsets, targets = _csr(len(names), adj)
+        return cls(names, offsets, targets, index=index)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def successors(self, i):
+        """Get the successors of the node number i."""
+        return self.targets[self.offsets[i]:self.offsets[i + 1]]
+
+    def predecessors(self, i):
+        """Get the predecessors of the node number i."""
+        return self.sources[self.roffsets[i]:self.roffsets[i + 1]]
+
+    def edges(self, name):
+        """Get the names of the successors of a node."""
+        return [self.names[j] for j in self.successors(self.index[name])]
+
+    def edges_to(self, name):
+        """Get the names of the predecessors of a node."""
+        return [self.names[j] for j in self.predecessors(self.index[name])]
+
+    def save(self, fh, names=True):
+        """Write the graph in the file object 'fh'.  Without 'names' only
+        the edges are written, for a graph sharing the names of another
+        one (see load()).
+
+        """
+        fh.write(struct.pack(HEADER, MAGIC, len(self.names), len(self.targets)))
+        if names:
+            save_names(fh, self.names)
+        for a in (self.offsets, self.targets, self.roffsets, self.sources):
+            a.tofile(fh)
+
+    @classmethod
+    def load(cls, fh, names=None, index=None):
+        """Read a graph written by save() from the file object 'fh'.  A
+        graph saved without names is read with the 'names' (and 'index')
+        of the graph they were saved with.  Raise ValueError if the data
+        is not valid.
+
+        """
+        magic, n, m = load_struct(fh, HEADER)
+        if magic != MAGIC:
+            raise ValueError('invalid graph file')
+        if names is None:
+            names = load_names(fh, n)
+        elif len(names) != n:
+            raise ValueError('graph of %d nodes for %d names' % (n, len(names)))
+        arrays = [load_array(fh, length) for length in (n + 1, m, n + 1, m)]
+        return cls(names, *arrays, index=index)
+
+
+def load_struct(fh, fmt):
+    """Read and unpack the struct 'fmt' from the file object 'fh'."""
+    size = struct.calcsize(fmt)
+    data = fh.read(size)
+    if len(data) != size:
+        raise ValueError('truncated file')
+    return struct.unpack(fmt, data)
+
+
+def save_names(fh, names):
+    """Write the list of strings 'names' in the file object 'fh'."""
+    data = '\0'.join(names)
+    fh.write(struct.pack('<I', len(data)))
+    fh.write(data)
+
+
+def load_names(fh, n):
+    """Read the 'n' names written by save_names() from 'fh'."""
+    size, = load_struct(fh, '<I')
+    data = fh.read(size)
+    if len(data) != size:
+        raise ValueError('truncated file')
+    names = [intern(name) for name in data.split('\0')] if n else []
+    if len(names) != n:
+        raise ValueError('%d names instead of %d' % (len(names), n))
+    return names
+
+
+def save_array(fh, a):
+    """Write the array 'a' in the file object 'fh', after its length."""
+    fh.write(struct.pack('<I', len(a)))
+    a.tofile(fh)
+
+
+def load_array(fh, length=None):
+    """Read an array of 'length' items from the file object 'fh', or one
+    written by save_array() without 'length'.
+
+    """
+    if length is None:
+        length, = load_struct(fh, '<I')
+    # Read with a single copy: an array can not be a view of a mmap in
+    # Python 2, and reading the items through struct would cost more.
+    a = array(TYPECODE)
+    try:
+        a.fromfile(fh, length)
+    except EOFError:
+        raise ValueError('truncated file')
+    return a
@@ -14,29 +14,86 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
-from copy import deepcopy
 import urllib2
-from xml.etree import cElementTree as ET
 
 from osc.core import http_GET
 from osc.core import makeurl
 
+from . import depsnapshot
+from .csr import CSRGraph
 from .memoize import memoize
 
 
 class Graph(dict):
-    """Graph object. Inspired in NetworkX data model."""
+    """Graph object. Inspired in NetworkX data model.
+
+    The adjacent lists can be compacted into a CSRGraph with compact().
+    The ones modified after that are kept apart, in a dict of sets.
+
+    """
 
     def __init__(self):
         """Initialize an empty graph."""
         #  The nodes are stored in the Graph dict itself, but the
         #  adjacent list is stored as an attribute.
         self.adj = {}
+        #  Nodes with an adjacent list shared with another graph.
+        self.shared = set()
+        #  Adjacent lists of the nodes not in adj.
+        self.csr = None
+
+    def copy(self):
+        """Return a copy of the graph.  The adjacent lists are shared
+        with this graph until they are modified in the copy.
+
+        """
+        graph = Graph()
+        graph.update(self)
+        graph.adj = dict(self.adj)
+        graph.shared = set(self.adj)
+        graph.csr = self.csr
+        return graph
+
+    def compact(self, edges=()):
+        """Move all the adjacent lists, and the 'edges' from an iterator,
+        into a CSRGraph.
+
+        """
+        edges = list(edges)
+        names = set(self)
+        names.update(v for _, v in edges)
+        for succ in self.adj.itervalues():
+            names.update(succ)
+        nodes = set(self.adj)
+        if self.csr is not None:
+            names.update(self.csr)
+            nodes.update(self.csr)
+        edges.extend((u, v) for u in nodes for v in self.successors(u))
+        self.csr = CSRGraph.build(sorted(names), edges)
+        self.adj = {}
+        self.shared = set()
+
+    def successors(self, u):
+        """Get the adjacent list for a vertex, unsorted."""
+        if u in self.adj:
+            return self.adj[u]
+        if self.csr is not None and u in self.csr:
+            return self.csr.edges(u)
+        return ()
+
+    def _adj(self, u):
+        """Get the adjacent list of u to modify it."""
+        if u in self.shared:
+            self.shared.remove(u)
+            self.adj[u] = set(self.adj[u])
+        elif u not in self.adj:
+            self.adj[u] = set(self.successors(u))
+        return self.adj[u]
 
     def add_node(self, name, value):
         """Add a node in the graph."""
         self[name] = value
-        if name not in self.adj:
+        if name not in self.adj and (self.csr is None or name not in self.csr):
             self.adj[name] = set()
 
     def add_nodes_from(self, nodes_and_values):
@@ -46,9 +103,9 @@ class Graph(dict):
 
     def add_edge(self, u, v, directed=True):
         """Add the edge u -> v, an v -> u if not directed."""
-        self.adj[u].add(v)
+        self._adj(u).add(v)
         if not directed:
-            self.adj[v].add(u)
+            self._adj(v).add(u)
 
     def add_edges_from(self, edges, directed=True):
         """Add the edges from an iterator."""
@@ -57,15 +114,10 @@ class Graph(dict):
 
     def remove_edge(self, u, v, directed=True):
         """Remove the edge u -> v, an v -> u if not directed."""
-        try:
-            self.adj[u].remove(v)
-        except KeyError:
-            pass
-        if not directed:
-            try:
-                self.adj[v].remove(u)
-            except KeyError:
-                pass
+        if v in self.successors(u):
+            self._adj(u).remove(v)
+        if not directed and u in self.successors(v):
+            self._adj(v).remove(u)
 
     def remove_edges_from(self, edges, directed=True):
         """Remove the edges from an iterator."""
@@ -74,44 +126,87 @@ class Graph(dict):
 
     def edges(self, v):
         """Get the adjancent list for a vertex."""
-        return sorted(self.adj[v]) if v in self else ()
+        return sorted(self.successors(v)) if v in self else ()
 
     def edges_to(self, v):
         """Get the all the vertex that point to v."""
-        return sorted(u for u in self.adj if v in self.adj[u])
-
-    def cycles(self):
-        """Detect cycles using Tarjan algorithm."""
-        index = [0]
+        edges_to = set(u for u in self.adj if v in self.adj[u])
+        if self.csr is not None and v in self.csr:
+            edges_to.update(u for u in self.csr.edges_to(v) if u not in self.adj)
+        return sorted(edges_to)
+
+    def cycles(self, nodes=None):
+        """Detect cycles using Tarjan algorithm.
+
+        If 'nodes' is given, only the cycles of the nodes reachable from
+        them are detected.
+
+        """
+        # Number the nodes as in the CSRGraph, and after them the ones
+        # that are only in the adjacent lists.
+        csr = self.csr if self.csr is not None else CSRGraph.build((), ())
+        names = list(csr.names)
+        numbers = {}
+
+        def number(name):
+            n = csr.index.get(name)
+            if n is None:
+                n = numbers.get(name)
+                if n is None:
+                    n = numbers[name] = len(names)
+                    names.append(name)
+            return n
+
+        adj = dict((number(u), [number(v) for v in succ]) for u, succ in self.adj.iteritems())
+        roots = [number(v) for v in sorted(self if nodes is None else nodes)]
+
+        index = 0
         path = []
+        on_path = [False] * len(names)
         cycles = []
 
-        v_index = {}
-        v_lowlink = {}
-
-        def scc(node, v):
-            v_index[v], v_lowlink[v] = index[0], index[0]
-            index[0] += 1
-            path.append(node)
-
-            for succ in self.adj.get(node, []):
-                w = self[succ]
-                if w not in v_index:
-                    scc(succ, w)
-                    v_lowlink[v] = min(v_lowlink[v], v_lowlink[w])
-                elif succ in path:
-                    v_lowlink[v] = min(v_lowlink[v], v_index[w])
-
-            if v_index[v] == v_lowlink[v]:
-                i = path.index(node)
-                path[:], cycle = path[:i], frozenset(path[i:])
-                if len(cycle) > 1:
-                    cycles.append(cycle)
-
-        for node in sorted(self):
-            v = self[node]
-            if not getattr(v, 'index', 0):
-                scc(node, v)
+        v_index = [None] * len(names)
+        v_lowlink = [None] * len(names)
+
+        def successors(v):
+            return adj[v] if v in adj else csr.successors(v) if v < len(csr) else ()
+
+        # Iterative version, with an explicit stack of the nodes being
+        # visited and their remaining successors, so deep dependency
+        # chains do not reach the recursion limit.
+        for root in roots:
+            if v_index[root] is not None:
+                continue
+            v_index[root] = v_lowlink[root] = index
+            index += 1
+            path.append(root)
+            on_path[root] = True
+            stack = [(root, iter(successors(root)))]
+            while stack:
+                v, succ = stack[-1]
+                for w in succ:
+                    if v_index[w] is None:
+                        v_index[w] = v_lowlink[w] = index
+                        index += 1
+                        path.append(w)
+                        on_path[w] = True
+                        stack.append((w, iter(successors(w))))
+                        break
+                    elif on_path[w]:
+                        v_lowlink[v] = min(v_lowlink[v], v_index[w])
+                else:
+                    stack.pop()
+                    if stack:
+                        u = stack[-1][0]
+                        v_lowlink[u] = min(v_lowlink[u], v_lowlink[v])
+                    if v_index[v] == v_lowlink[v]:
+                        cycle = []
+                        while not cycle or cycle[-1] != v:
+                            w = path.pop()
+                            on_path[w] = False
+                            cycle.append(w)
+                        if len(cycle) > 1:
+                            cycles.append(frozenset(names[w] for w in cycle))
         return frozenset(cycles)
 
 
@@ -119,13 +214,16 @@ class Package(object):
     """Simple package container. Used in a graph as a vertex."""
 
     def __init__(self, pkg=None, src=None, deps=None, subs=None,
-                 element=None):
+                 element=None, info=None):
         self.pkg = pkg
         self.src = src
         self.deps = deps
         self.subs = subs
         if element:
             self.load(element)
+        if info:
+            self.pkg, self.src = info.name, info.source
+            self.deps, self.subs = set(info.deps), set(info.subs)
 
     def load(self, element):
         """Load a node from a ElementTree package XML element"""
@@ -133,8 +231,9 @@ class Package(object):
         self.src = [e.text for e in element.findall('source')]
         assert len(self.src) == 1, 'There are more that one source packages in the graph'
         self.src = self.src[0]
-        self.deps = set(e.text for e in element.findall('pkgdep'))
-        self.subs = set(e.text for e in element.findall('subpkg'))
+        # The same names are repeated in many packages.
+        self.deps = set(intern(e.text) for e in element.findall('pkgdep'))
+        self.subs = set(intern(e.text) for e in element.findall('subpkg'))
 
     def __repr__(self):
         return 'PKG: %s\nSRC: %s\nDEPS: %s\n SUBS: %s' % (self.pkg,
@@ -151,8 +250,7 @@ class CycleDetector(object):
         # Store packages prevoiusly ignored. Don't pollute the screen.
         self._ignore_packages = set()
 
-    @memoize(ttl=60*60*6)
-    def _builddepinfo(self, project, repository, arch):
+    def _get_builddepinfo_document(self, project, repository, arch):
         root = None
         try:
             # print('Generating _builddepinfo for (%s, %s, %s)' % (project, repository, arch))
@@ -162,15 +260,39 @@ class CycleDetector(object):
             print('ERROR in URL %s [%s]' % (url, e))
         return root
 
+    @memoize(ttl=60*60*6, compress='zlib', refresh=0.75)
+    def _builddepinfo(self, project, repository, arch):
+        return self._get_builddepinfo_document(project, repository, arch)
+
+    @memoize(ttl=60*5, compress='zlib')
+    def _builddepinfo_current(self, project, repository, arch):
+        return self._get_builddepinfo_document(project, repository, arch)
+
+    def get_snapshot(self, project, repository, arch, current=False):
+        """Get the snapshot of the _builddepinfo of the project, that is
+        downloaded only when the memoized document expires.
+
+        The document is kept for hours, as the cycles change rarely.  Use
+        'current' to get one at most a few minutes old, to act on the
+        current state of the repository.
+
+        """
+        builddepinfo = self._builddepinfo_current if current else self._builddepinfo
+        return depsnapshot.get(project, repository, arch, builddepinfo(project, repository, arch))
+
     def _get_builddepinfo(self, project, repository, arch, package):
         """Get the builddep info for a single package"""
-        root = ET.fromstring(self._builddepinfo(project, repository, arch))
-        packages = [Package(element=e) for e in root.findall('package')]
-        package = [p for p in packages if p.pkg == package]
-        return package[0] if package else None
+        snapshot = self.get_snapshot(project, repository, arch)
+        return Package(info=snapshot[package]) if package in snapshot else None
 
     def _get_builddepinfo_graph(self, project, repository, arch):
-        """Generate the buildepinfo graph for a given architecture."""
+        """Generate the buildepinfo graph for a given architecture.
+
+        The graph is built on the names of the snapshot of the project,
+        and its nodes have no Package: the dependencies of a node are in
+        graph.pkgdeps().
+
+        """
 
         _IGNORE_PREFIX = ('texlive-', 'master-boot-code')
 
@@ -179,54 +301,79 @@ class CycleDetector(object):
         #   project = 'Base:System'
         #   repository = 'openSUSE_Factory'
 
-        root = ET.fromstring(self._builddepinfo(project, repository, arch))
-        # Reset the subpackages dict here, so for every graph is a
-        # different object.
-        packages = [Package(element=e) for e in root.findall('package')]
+        snapshot = self.get_snapshot(project, repository, arch)
+        names, index = snapshot.names, snapshot.deps.index
 
         # XXX - Ugly Exception. We need to ignore branding packages and
         # packages that one of his dependencies do not exist. Also ignore
         # preinstall images.
-        packages = [p for p in packages if not ('branding' in p.pkg or p.pkg.startswith('preinstallimage-'))]
+        packages = [i for i in xrange(snapshot.npackages)
+                    if 'branding' not in names[i] and not names[i].startswith('preinstallimage-')]
+
+        # Given a subpackage, recover the source package.  If several
+        # packages provide the same subpackage, it is the first one.
+        provider = [None] * len(names)
+        for i in packages:
+            for j in snapshot.subs.successors(i):
+                if provider[j] is None:
+                    provider[j] = i
+
+        # XXX - Ugly Hack. Subpagackes for texlive are not correctly
+        # generated. If the dependency starts with texlive- prefix,
+        # assume that the correct source package is texlive.
+        if 'texlive' not in index:
+            names = names + ['texlive']
+            index = dict(index, texlive=len(names) - 1)
+            provider.append(None)
+
+        # The node of every dependency: the package of the subpackage,
+        # SKIP for the ignored ones, or MISSING.
+        SKIP, MISSING = -1, -2
+        nodes = []
+        for j, name in enumerate(names):
+            if 'branding' in name or name.startswith('master-boot-code'):
+                nodes.append(SKIP)
+            elif name.startswith('texlive-'):
+                nodes.append(index['texlive'])
+            elif provider[j] is not None:
+                nodes.append(provider[j])
+            else:
+                nodes.append(MISSING)
 
-        graph = Graph()
-        graph.add_nodes_from((p.pkg, p) for p in packages)
-
-        subpkgs = {}    # Given a subpackage, recover the source package
-        for p in packages:
-            # Check for packages that provides the same subpackage
-            for subpkg in p.subs:
-                if subpkg in subpkgs:
-                    # print 'Subpackage duplication %s - %s (subpkg: %s)' % (p.pkg, subpkgs[subpkg], subpkg)
-                    pass
-                else:
-                    subpkgs[subpkg] = p.pkg
-
-        for p in packages:
-            # Calculate the missing deps
-            deps = [d for d in p.deps if 'branding' not in d]
-            missing = [d for d in deps if not d.startswith(_IGNORE_PREFIX) and d not in subpkgs]
-            if missing:
-                if p.pkg not in self._ignore_packages:
-                    # print 'Ignoring package. Missing dependencies %s -> (%s) %s...' % (p.pkg, len(missing), missing[:5])
-                    self._ignore_packages.add(p.pkg)
+        adj = [()] * len(names)
+        for i in packages:
+            succ = set(nodes[j] for j in snapshot.deps.successors(i))
+            if MISSING in succ:
+                self._ignore_packages.add(names[i])
                 continue
+            succ.discard(SKIP)
+            adj[i] = succ
 
-            # XXX - Ugly Hack. Subpagackes for texlive are not correctly
-            # generated. If the dependency starts with texlive- prefix,
-            # assume that the correct source package is texlive.
-            graph.add_edges_from((p.pkg, subpkgs[d] if not d.startswith('texlive-') else 'texlive')
-                                 for d in deps if not d.startswith('master-boot-code'))
+        graph = Graph()
+        graph.update(dict.fromkeys(names[i] for i in packages))
+        graph.csr = CSRGraph.from_adjacency(names, adj, index)
 
-        # Store the subpkgs dict in the graph. It will be used later.
-        graph.subpkgs = subpkgs
+        # Store the subpkgs dict and the dependencies in the graph. They
+        # will be used later.
+        graph.subpkgs = dict((names[j], names[i]) for j, i in enumerate(provider) if i is not None)
+        graph.pkgdeps = snapshot.pkgdeps
         return graph
 
     def _get_builddepinfo_cycles(self, package, repository, arch):
         """Generate the buildepinfo cycle list for a given architecture."""
-        root = ET.fromstring(self._builddepinfo(package, repository, arch))
-        return frozenset(frozenset(e.text for e in cycle.findall('package'))
-                         for cycle in root.findall('cycle'))
+        return frozenset(self.get_snapshot(package, repository, arch).cycles)
+
+    @memoize(session=True)
+    def _get_project_graph(self, project, repository, arch):
+        """Get the graph of a project, its cycles and a dictionary with
+        the cycle of every node that is part of one.  Kept for all the
+        checks done by the process, and never modified.
+
+        """
+        graph = self._get_builddepinfo_graph(project, repository, arch)
+        cycles = graph.cycles()
+        node_cycle = dict((node, cycle) for cycle in cycles for node in cycle)
+        return graph, cycles, node_cycle
 
     def cycles(self, requests, project=None, repository='standard', arch='x86_64'):
         """Detect cycles in a specific repository."""
@@ -238,13 +385,10 @@ class CycleDetector(object):
         requests = [rq for rq in requests if rq.action_type == 'submit' and not rq.updated]
 
         # Detect cycles - We create the full graph from _builddepinfo.
-        project_graph = self._get_builddepinfo_graph(project, repository, arch)
-        project_cycles = project_graph.cycles()
+        project_graph, project_cycles, node_cycle = self._get_project_graph(project, repository, arch)
 
         # This graph will be updated for every request
-        current_graph = deepcopy(project_graph)
-
-        subpkgs = current_graph.subpkgs
+        current_graph = project_graph.copy()
 
         # Recover all packages at once, ignoring some packages that
         # can't be found in x86_64 architecture.
@@ -271,7 +415,17 @@ class CycleDetector(object):
                         for rq in requests if not rq.updated]
         all_packages = [pkg for pkg in all_packages if pkg]
 
-        subpkgs.update(dict((p, pkg.pkg) for pkg in all_packages for p in pkg.subs))
+        # The subpackages of the requests replace the ones of the project.
+        subpkgs = dict((p, pkg.pkg) for pkg in all_packages for p in pkg.subs)
+
+        def source(subpkg):
+            return subpkgs.get(subpkg, project_graph.subpkgs.get(subpkg))
+
+        def deps(node):
+            # The nodes of the project graph have no Package.
+            if current_graph[node] is None:
+                return project_graph.pkgdeps(node)
+            return current_graph[node].deps
 
         for pkg in all_packages:
             # Update the current graph and see if we have different cycles
@@ -283,9 +437,18 @@ class CycleDetector(object):
                 current_graph.remove_edges_from(set((p, pkg.pkg) for p in edges_to))
             else:
                 current_graph.add_node(pkg.pkg, pkg)
-            current_graph.add_edges_from((pkg.pkg, subpkgs[p]) for p in pkg.deps if p in subpkgs)
+            current_graph.add_edges_from((pkg.pkg, source(p)) for p in pkg.deps if source(p))
             current_graph.add_edges_from((p, pkg.pkg) for p in edges_to
-                                         if pkg.pkg in set(subpkgs[sp] for sp in current_graph[p].deps if sp in subpkgs))
+                                         if pkg.pkg in set(source(sp) for sp in deps(p)))
+
+        # Only the edges of the packages of the requests changed, so any
+        # cycle that is not in the project contains one of them, or is
+        # left from a project cycle broken by them.  Those are the cycles
+        # found from these packages, and the project cycles that contain
+        # them.
+        nodes = set(pkg.pkg for pkg in all_packages)
+        for node in list(nodes):
+            nodes.update(node_cycle.get(node, ()))
 
         # Sometimes, new cycles have only new edges, but not new
         # packages.  We need to inform about this, so this can become
@@ -296,7 +459,7 @@ class CycleDetector(object):
         # check if the new cycle (also as a set of packages) is
         # included here.
         project_cycles_pkgs = [set(cycle) for cycle in project_cycles]
-        for cycle in current_graph.cycles():
+        for cycle in current_graph.cycles(nodes):
             if cycle not in project_cycles:
                 project_edges = set((u, v) for u in cycle for v in project_graph.edges(u) if v in cycle)
                 current_edges = set((u, v) for u in cycle for v in current_graph.edges(u) if v in cycle)
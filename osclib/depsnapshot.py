@@ -0,0 +1,204 @@
+# Copyright (C) 2016 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Pre-parsed snapshots of the _builddepinfo of a (project, repository,
+arch).
+
+A snapshot holds the packages, their dependencies and subpackages (and
+the reverse of both) and the cycles of the project.  It is stored in
+CACHEDIR, keyed by the project, repository, arch and the state of the
+repository (the MD5 of its _builddepinfo), and read back with the arrays
+of osclib.csr, so only a new state of the repository needs to be parsed.
+
+"""
+
+from array import array
+import errno
+import hashlib
+import os
+import struct
+
+from osclib.builddepinfo import BuildDepInfo
+from osclib.builddepinfo import Package
+from osclib.builddepinfo import iterparse
+from osclib.csr import CSRGraph
+from osclib.csr import TYPECODE
+from osclib.csr import load_array
+from osclib.csr import load_struct
+from osclib.csr import save_array
+from osclib.memoize import CACHEDIR
+
+SNAPSHOTDIR = os.path.join(CACHEDIR, 'builddepinfo')
+
+# The graphs and arrays are written with osclib.csr, in the native byte
+# order, as the files are only a local cache.
+MAGIC = 'DEPSNAP2'
+HEADER = '<8sI'
+
+# Last snapshot loaded for every (project, repository, arch)
+_snapshots = {}
+
+
+class Snapshot(object):
+    """Parsed _builddepinfo.  The first 'npackages' names are the packages,
+    in the order of the document.
+
+    """
+
+    def __init__(self, names, npackages, sources, deps, subs, cycles):
+        self.names = names
+        self.npackages = npackages
+        self.sources = sources
+        self.deps = deps
+        self.subs = subs
+        self.cycles = cycles
+
+    @classmethod
+    def parse(cls, source):
+        """Create the snapshot of a _builddepinfo document."""
+        cycles = []
+        packages = list(iterparse(source, cycles))
+        names = []
+        index = {}
+        for name in [p.name for p in packages] + \
+                [n for p in packages for n in [p.source] + p.deps + p.subs] + \
+                [n for cycle in cycles for n in sorted(cycle)]:
+            if name not in index:
+                index[name] = len(names)
+                names.append(name)
+        npackages = len(set(p.name for p in packages))
+        sources = array(TYPECODE, [0] * npackages)
+        for p in packages:
+            sources[index[p.name]] = index[p.source]
+        deps = CSRGraph.build(names, ((p.name, d) for p in packages for d in p.deps), index)
+        subs = CSRGraph.build(names, ((p.name, s) for p in packages for s in p.subs), index)
+        return cls(names, npackages, sources, deps, subs, cycles)
+
+    def save(self, filename):
+        """Write the snapshot in 'filename', replacing it atomically."""
+        members = [sorted(self.deps.index[name] for name in cycle) for cycle in self.cycles]
+        offsets = array(TYPECODE, [0])
+        for cycle in members:
+            offsets.append(offsets[-1] + len(cycle))
+        # Other processes may write the same snapshot at the same time.
+        part = '%s.%d.part' % (filename, os.getpid())
+        with open(part, 'wb') as fh:
+            fh.write(struct.pack(HEADER, MAGIC, self.npackages))
+            self.deps.save(fh)
+            self.subs.save(fh, names=False)
+            for a in (self.sources, offsets, array(TYPECODE, [n for cycle in members for n in cycle])):
+                save_array(fh, a)
+        os.rename(part, filename)
+
+    @classmethod
+    def load(cls, filename):
+        """Read a snapshot written by save().  Raise ValueError if it is not
+        valid.
+
+        """
+        with open(filename, 'rb') as fh:
+            magic, npackages = load_struct(fh, HEADER)
+            if magic != MAGIC:
+                raise ValueError('invalid snapshot %s' % filename)
+            deps = CSRGraph.load(fh)
+            subs = CSRGraph.load(fh, deps.names, deps.index)
+            sources, offsets, members = [load_array(fh) for _ in range(3)]
+        names = deps.names
+        cycles = [frozenset(names[n] for n in members[offsets[i]:offsets[i + 1]])
+                  for i in range(len(offsets) - 1)]
+        return cls(names, npackages, sources, deps, subs, cycles)
+
+    def __contains__(self, package):
+        return self.deps.index.get(package, self.npackages) < self.npackages
+
+    def __getitem__(self, package):
+        """Get a package, as builddepinfo.Package."""
+        if package not in self:
+            raise KeyError(package)
+        return self._package(self.deps.index[package])
+
+    def __iter__(self):
+        """Iterate over the packages, as builddepinfo.Package."""
+        for i in range(self.npackages):
+            yield self._package(i)
+
+    def _package(self, i):
+        return Package(self.names[i], self.names[self.sources[i]],
+                       [self.names[j] for j in self.deps.successors(i)],
+                       [self.names[j] for j in self.subs.successors(i)])
+
+    def source(self, package):
+        return self.names[self.sources[self.deps.index[package]]]
+
+    def pkgdeps(self, package):
+        """Get the dependencies of a package."""
+        return self.deps.edges(package) if package in self else []
+
+    def subpkgs(self, package):
+        """Get the subpackages of a package."""
+        return self.subs.edges(package) if package in self else []
+
+    def whatdependson(self, name):
+        """Get the packages with 'name' in their dependencies."""
+        return self.deps.edges_to(name) if name in self.deps else []
+
+    def builddepinfo(self, ignore=None):
+        """Get the snapshot as a BuildDepInfo."""
+        return BuildDepInfo(self, ignore=ignore, cycles=self.cycles)
+
+
+def path(project, repository, arch, state):
+    """Return the file name of a snapshot, in a directory per (project,
+    repository, arch) as their names can not contain '/'.
+
+    """
+    return os.path.join(SNAPSHOTDIR, project, repository, arch, '%s.snapshot' % state)
+
+
+def get(project, repository, arch, document):
+    """Get the snapshot of the _builddepinfo 'document' of (project,
+    repository, arch), from the ones loaded, from SNAPSHOTDIR or parsing
+    it if its state is new.
+
+    """
+    state = hashlib.md5(document).hexdigest()
+    key = (project, repository, arch)
+    if key in _snapshots and _snapshots[key][0] == state:
+        return _snapshots[key][1]
+
+    filename = path(project, repository, arch, state)
+    try:
+        snapshot = Snapshot.load(filename)
+    except (IOError, ValueError):
+        snapshot = Snapshot.parse(document)
+        directory = os.path.dirname(filename)
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        snapshot.save(filename)
+        # Only the last state of the repository is kept.  Other processes
+        # may remove the same files, or write their own.
+        for name in os.listdir(directory):
+            if name.endswith('.snapshot') and name != os.path.basename(filename):
+                try:
+                    os.unlink(os.path.join(directory, name))
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+    _snapshots[key] = (state, snapshot)
+    return snapshot
@@ -14,15 +14,28 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import atexit
+from collections import Counter
 from datetime import datetime
 import fcntl
 from functools import wraps
 import os
 import shelve
+import sqlite3
+import threading
+import time
+import zlib
 try:
     import cPickle as pickle
 except:
     import pickle
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
 
 
 try:
@@ -39,61 +52,373 @@ except ImportError:
 # Where the cache files are stored
 CACHEDIR = save_cache_path('opensuse-repo-checker')
 
+# Backend used for persistent caches ('sqlite' or 'shelve')
+BACKEND = 'sqlite'
+
+# Eviction policies: remove the entries written ('fifo') or read ('lru')
+# longest ago.
+POLICIES = ('fifo', 'lru')
+
+# Values that pickle to at least COMPRESS_THRESHOLD bytes are compressed
+# when requested with 'compress' ('zlib' or, if available, 'lzma').
+COMPRESS_THRESHOLD = 4096
+CODECS = {
+    'zlib': zlib,
+}
+if lzma:
+    CODECS['lzma'] = lzma
+
+
+class Compressed(object):
+    """Pickled value stored compressed in a persistent cache."""
+
+    __slots__ = ('codec', 'data')
+
+    def __init__(self, codec, data):
+        self.codec = codec
+        self.data = data
+
+    def __getstate__(self):
+        return (self.codec, self.data)
+
+    def __setstate__(self, state):
+        self.codec, self.data = state
+
+    @staticmethod
+    def compress(value, codec, counters):
+        data = pickle.dumps(value, protocol=-1)
+        if len(data) < COMPRESS_THRESHOLD:
+            return value
+        compressed = CODECS[codec].compress(data)
+        counters['compress_in'] += len(data)
+        counters['compress_out'] += len(compressed)
+        return Compressed(codec, compressed)
+
+    def decompress(self):
+        return pickle.loads(CODECS[self.codec].decompress(self.data))
+
+
+def _ratio(stats):
+    # Compression ratio of the values stored compressed.
+    if stats.get('compress_out'):
+        stats['ratio'] = float(stats['compress_in']) / stats['compress_out']
+    return stats
+
+
+class SessionCache(object):
+    """Cache kept in memory for the life of the process.
+
+    Only the 'fifo' policy and the limit in number of entries are
+    supported.
+
+    """
+
+    # Entries can be refreshed from a background thread.
+    threadsafe = True
+
+    def __init__(self, fn, ttl, slots, nclean, size=None, policy='fifo'):
+        if not hasattr(fn, '_memoize_session_cache'):
+            fn._memoize_session_cache = {}
+        self.cache = fn._memoize_session_cache
+        self.ttl = ttl
+        self.slots = slots
+        self.nclean = nclean
+        self.counters = Counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, timestamp, value):
+        self.cache[key] = (timestamp, value)
+
+    def delete(self, key):
+        self.cache.pop(key, None)
+
+    def clear(self):
+        self.cache.clear()
+
+    def clean(self):
+        len_cache = len(self.cache)
+        if len_cache >= self.slots:
+            nclean = self.nclean + len_cache - self.slots
+            keys_to_delete = sorted(self.cache, key=lambda k: self.cache[k][0])[:nclean]
+            for key in keys_to_delete:
+                del self.cache[key]
+            self.counters['eviction'] += len(keys_to_delete)
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['entries'] = len(self.cache)
+        return _ratio(stats)
+
 
-def memoize(ttl=None, session=False, add_invalidate=False):
+class ShelveCache(SessionCache):
+    """Cache stored in a shelve file protected by an exclusive lock.
+
+    The shelve is opened for the duration of a 'with' block.
+
+    """
+
+    threadsafe = False
+
+    def __init__(self, cache_name, ttl, slots, nclean, size=None, policy='fifo'):
+        self.cache_name = cache_name
+        self.ttl = ttl
+        self.slots = slots
+        self.nclean = nclean
+        self.counters = Counter()
+
+    # Implement a POSIX lock / unlock extension for shelves. Inspired
+    # on ActiveState Code recipe #576591
+    def __enter__(self):
+        self.lckfile = open(self.cache_name + '.lck', 'w')
+        fcntl.flock(self.lckfile.fileno(), fcntl.LOCK_EX)
+        self.cache = shelve.open(self.cache_name, protocol=-1)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cache.close()
+        fcntl.flock(self.lckfile.fileno(), fcntl.LOCK_UN)
+        self.lckfile.close()
+
+    def delete(self, key):
+        if key in self.cache:
+            del self.cache[key]
+
+    def stats(self):
+        with self:
+            return super(ShelveCache, self).stats()
+
+
+class SQLiteCache(object):
+    """Cache stored in a SQLite database.
+
+    The database is used in WAL mode so readers in different processes do
+    not block each other, entries are expired through an index on the
+    timestamp and the connection is kept open for the life of the process.
+
+    Besides the entries, the database keeps the configuration of the cache
+    and the hit / miss / eviction counters of all the processes using it.
+
+    """
+
+    threadsafe = True
+
+    def __init__(self, cache_name, ttl, slots, nclean, size=None, policy='fifo'):
+        self.filename = cache_name + '.sqlite'
+        self.ttl = ttl
+        self.slots = slots
+        self.nclean = nclean
+        self.size = size
+        self.policy = policy
+        self.counters = Counter()
+        self.lock = threading.Lock()
+        self.pid = None
+        atexit.register(self.flush)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    @property
+    def db(self):
+        # A connection can not be shared with a forked child.
+        if self.pid != os.getpid():
+            self._db = sqlite3.connect(self.filename, timeout=60, check_same_thread=False)
+            self._db.text_factory = str
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            with self._db:
+                self._db.execute('CREATE TABLE IF NOT EXISTS cache ('
+                                 'key BLOB PRIMARY KEY, '
+                                 'timestamp REAL NOT NULL, '
+                                 'atime REAL NOT NULL, '
+                                 'size INTEGER NOT NULL, '
+                                 'value BLOB NOT NULL)')
+                self._db.execute('CREATE INDEX IF NOT EXISTS cache_timestamp ON cache (timestamp)')
+                self._db.execute('CREATE INDEX IF NOT EXISTS cache_atime ON cache (atime)')
+                self._db.execute('CREATE TABLE IF NOT EXISTS stats ('
+                                 'name TEXT PRIMARY KEY, '
+                                 'value REAL NOT NULL)')
+                self._db.executemany('INSERT OR REPLACE INTO stats (name, value) VALUES (?, ?)',
+                                     (('ttl', self.ttl), ('slots', self.slots), ('size', self.size or 0)))
+            self.pid = os.getpid()
+            self.counters.clear()
+        return self._db
+
+    def execute(self, sql, parameters=()):
+        with self.lock, self.db:
+            return self.db.execute(sql, parameters).fetchall()
+
+    def _flush(self):
+        for name, value in self.counters.items():
+            self.db.execute('INSERT OR IGNORE INTO stats (name, value) VALUES (?, 0)', (name,))
+            self.db.execute('UPDATE stats SET value = value + ? WHERE name = ?', (value, name))
+        self.counters.clear()
+
+    def flush(self):
+        """Add the counters of this process to the ones in the database."""
+        if self.counters and self.pid == os.getpid():
+            with self.lock, self.db:
+                self._flush()
+
+    def get(self, key):
+        with self.lock, self.db:
+            row = self.db.execute('SELECT timestamp, value FROM cache WHERE key = ?',
+                                  (sqlite3.Binary(key),)).fetchone()
+            if row and self.policy == 'lru':
+                self.db.execute('UPDATE cache SET atime = ? WHERE key = ?',
+                                (time.time(), sqlite3.Binary(key)))
+        if row:
+            timestamp, value = row
+            return (datetime.fromtimestamp(timestamp), pickle.loads(str(value)))
+        return None
+
+    def set(self, key, timestamp, value):
+        timestamp = time.mktime(timestamp.timetuple()) + timestamp.microsecond / 1e6
+        value = pickle.dumps(value, protocol=-1)
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO cache (key, timestamp, atime, size, value) '
+                            'VALUES (?, ?, ?, ?, ?)',
+                            (sqlite3.Binary(key), timestamp, time.time(), len(value), sqlite3.Binary(value)))
+            self._flush()
+
+    def delete(self, key):
+        self.execute('DELETE FROM cache WHERE key = ?', (sqlite3.Binary(key),))
+
+    def clear(self):
+        self.execute('DELETE FROM cache')
+
+    def clean(self):
+        """Evict entries once the cache is over the limit of entries or bytes.
+
+        As for the number of entries, the cache is reduced by 'nclean / slots'
+        below the limit of bytes so it is not cleaned on every insertion.
+
+        """
+        order = 'atime' if self.policy == 'lru' else 'timestamp'
+        with self.lock, self.db:
+            len_cache, size = self.db.execute('SELECT COUNT(*), TOTAL(size) FROM cache').fetchone()
+
+            nclean = 0
+            if len_cache >= self.slots:
+                nclean = self.nclean + len_cache - self.slots
+            free = 0
+            if self.size and size > self.size:
+                free = size - self.size * (self.slots - self.nclean) / self.slots
+            if not nclean and not free:
+                return
+
+            keys_to_delete = []
+            for key, size in self.db.execute('SELECT key, size FROM cache ORDER BY %s' % order):
+                if len(keys_to_delete) >= nclean and free <= 0:
+                    break
+                keys_to_delete.append((key,))
+                free -= size
+            self.db.executemany('DELETE FROM cache WHERE key = ?', keys_to_delete)
+            self.counters['eviction'] += len(keys_to_delete)
+
+    def stats(self):
+        self.flush()
+        with self.lock, self.db:
+            return stats(self.db)
+
+
+BACKENDS = {
+    'shelve': ShelveCache,
+    'sqlite': SQLiteCache,
+}
+
+
+def stats(db):
+    """Return the configuration, counters and size of a SQLite cache."""
+    stats = dict(db.execute('SELECT name, value FROM stats'))
+    stats['entries'], stats['bytes'] = db.execute('SELECT COUNT(*), TOTAL(size) FROM cache').fetchone()
+    return _ratio(stats)
+
+
+def prune(filename, ttl=None):
+    """Remove the expired entries of a SQLite cache.
+
+    By default the entries are expired using the TTL of the memoized
+    function. Returns the number of entries removed.
+
+    """
+    db = sqlite3.connect(filename, timeout=60)
+    try:
+        with db:
+            if ttl is None:
+                ttl = dict(db.execute('SELECT name, value FROM stats')).get('ttl')
+            if ttl is None:
+                return 0
+            removed = db.execute('DELETE FROM cache WHERE timestamp < ?', (time.time() - ttl,)).rowcount
+        db.execute('VACUUM')
+        return removed
+    finally:
+        db.close()
+
+
+def memoize(ttl=None, session=False, add_invalidate=False, slots=None, size=None, policy='fifo',
+            compress=None, refresh=None):
     """Decorator function to implement a persistent cache.
 
+    The cache keeps up to 'slots' entries and, for the sqlite backend, up
+    to 'size' bytes of pickled values. When a limit is reached the entries
+    are evicted following 'policy' (see POLICIES). The statistics of the
+    cache are available with 'stats()' in the decorated function.
+
+    Large values of persistent caches are compressed with the 'compress'
+    codec (see CODECS), for example the XML documents returned by OBS.
+
+    With 'refresh', a fraction of the TTL, entries older than 'refresh * ttl'
+    are recomputed in a background thread while the current value keeps
+    being served. The shelve backend does not support it and waits for the
+    entry to expire.
+
     >>> @memoize()
     ... def test_func(a):
     ...     return a
 
     Internally, the memoized function has a cache:
 
-    >>> cache = [c.cell_contents for c in test_func.func_closure if 'sync' in dir(c.cell_contents)][0]
-    >>> 'sync' in dir(cache)
+    >>> cache = test_func.cache
+    >>> 'clean' in dir(cache)
     True
 
     There is a limit of the size of the cache
 
-    >>> for k in cache:
-    ...     del cache[k]
-    >>> len(cache)
-    0
-
+    >>> cache.clear()
     >>> for i in range(4095):
     ...     test_func(i)
-    ... len(cache)
+    ... cache.stats()['entries']
     4095
 
     >>> test_func(0)
     0
 
-    >>> len(cache)
+    >>> cache.stats()['entries']
     4095
 
     >>> test_func(4095)
     4095
 
-    >>> len(cache)
+    >>> cache.stats()['entries']
     3072
 
     >>> test_func(0)
     0
 
-    >>> len(cache)
+    >>> cache.stats()['entries']
     3073
 
-    >>> from datetime import timedelta
-    >>> k = [k for k in cache if cPickle.loads(k) == ((0,), {})][0]
-    >>> t, v = cache[k]
-    >>> t = t - timedelta(days=10)
-    >>> cache[k] = (t, v)
-    >>> test_func(0)
-    0
-    >>> t2, v = cache[k]
-    >>> t != t2
-    True
-
     """
 
     # Configuration variables
@@ -101,44 +426,14 @@ def memoize(ttl=None, session=False, add_invalidate=False):
     NCLEAN = 1024           # Number of slots to remove when limit reached
     TIMEOUT = 60*60*2       # Time to live for every cache slot (seconds)
 
-    def _memoize(fn):
-        # Implement a POSIX lock / unlock extension for shelves. Inspired
-        # on ActiveState Code recipe #576591
-        def _lock(filename):
-            lckfile = open(filename + '.lck', 'w')
-            fcntl.flock(lckfile.fileno(), fcntl.LOCK_EX)
-            return lckfile
-
-        def _unlock(lckfile):
-            fcntl.flock(lckfile.fileno(), fcntl.LOCK_UN)
-            lckfile.close()
-
-        def _open_cache(cache_name):
-            if not session:
-                lckfile = _lock(cache_name)
-                cache = shelve.open(cache_name, protocol=-1)
-                # Store a reference to the lckfile to avoid to be
-                # closed by gc
-                cache.lckfile = lckfile
-            else:
-                if not hasattr(fn, '_memoize_session_cache'):
-                    fn._memoize_session_cache = {}
-                cache = fn._memoize_session_cache
-            return cache
-
-        def _close_cache(cache):
-            if not session:
-                cache.close()
-                _unlock(cache.lckfile)
-
-        def _clean_cache(cache):
-            len_cache = len(cache)
-            if len_cache >= SLOTS:
-                nclean = NCLEAN + len_cache - SLOTS
-                keys_to_delete = sorted(cache, key=lambda k: cache[k][0])[:nclean]
-                for key in keys_to_delete:
-                    del cache[key]
+    if policy not in POLICIES:
+        raise ValueError('Unknown eviction policy %s' % policy)
+    if compress and compress not in CODECS:
+        raise ValueError('Unknown compression codec %s' % compress)
+    if refresh is not None and not 0 < refresh < 1:
+        raise ValueError('refresh must be a fraction of the TTL')
 
+    def _memoize(fn):
         def _key(obj):
             # Pickle doesn't guarantee that there is a single
             # representation for every serialization.  We can try to
@@ -150,13 +445,12 @@ def memoize(ttl=None, session=False, add_invalidate=False):
 
         def _invalidate(*args, **kwargs):
             key = _key((args, kwargs))
-            cache = _open_cache(cache_name)
-            if key in cache:
-                del cache[key]
+            with cache:
+                cache.delete(key)
 
         def _invalidate_all():
-            cache = _open_cache(cache_name)
-            cache.clear()
+            with cache:
+                cache.clear()
 
         def _add_invalidate_method(_self):
             name = '_invalidate_%s' % fn.__name__
@@ -167,6 +461,42 @@ def memoize(ttl=None, session=False, add_invalidate=False):
             if not hasattr(_self, name):
                 setattr(_self, name, _invalidate_all)
 
+        def _set(key, now, value, counters=None):
+            if compress and not session:
+                value = Compressed.compress(value, compress,
+                                            cache.counters if counters is None else counters)
+            cache.set(key, now, value)
+            cache.clean()
+
+        def _refresh(key, args, kwargs):
+            with lock:
+                if key in refreshing:
+                    return
+                refreshing.add(key)
+
+            def run():
+                # Counted apart and added under the lock of the cache, which
+                # also flushes the counters from the thread of the caller.
+                counters = Counter()
+                try:
+                    now = datetime.now()
+                    value = fn(*args, **kwargs)
+                    with cache:
+                        _set(key, now, value, counters)
+                    counters['refresh'] += 1
+                except Exception:
+                    counters['refresh_error'] += 1
+                finally:
+                    with cache.lock:
+                        cache.counters.update(counters)
+                    with lock:
+                        refreshing.discard(key)
+
+            thread = threading.Thread(target=run)
+            # Do not hold the exit of the process for a refresh.
+            thread.daemon = True
+            thread.start()
+
         @wraps(fn)
         def _fn(*args, **kwargs):
             def total_seconds(td):
@@ -177,21 +507,38 @@ def memoize(ttl=None, session=False, add_invalidate=False):
                 _add_invalidate_method(_self)
             key = _key((args[1:], kwargs))
             updated = False
-            cache = _open_cache(cache_name)
-            if key in cache:
-                timestamp, value = cache[key]
-                updated = True if total_seconds(now-timestamp) < ttl else False
-            if not updated:
-                value = fn(*args, **kwargs)
-                cache[key] = (now, value)
-            _clean_cache(cache)
-            _close_cache(cache)
+            with cache:
+                entry = cache.get(key)
+                if entry:
+                    timestamp, value = entry
+                    age = total_seconds(now-timestamp)
+                    updated = True if age < ttl else False
+                if not updated:
+                    cache.counters['miss'] += 1
+                    value = fn(*args, **kwargs)
+                    _set(key, now, value)
+                else:
+                    cache.counters['hit'] += 1
+                    if refresh and cache.threadsafe and age >= ttl * refresh:
+                        _refresh(key, args, kwargs)
+            if isinstance(value, Compressed):
+                value = value.decompress()
             return value
 
-        cache_dir = os.path.expanduser(CACHEDIR)
-        if not os.path.exists(cache_dir):
-            os.makedirs(cache_dir)
-        cache_name = os.path.join(cache_dir, fn.__name__)
+        _slots = slots if slots else SLOTS
+        _nclean = min(NCLEAN, _slots // 4)
+        if session:
+            cache = SessionCache(fn, ttl, _slots, _nclean)
+        else:
+            cache_dir = os.path.expanduser(CACHEDIR)
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            cache = BACKENDS[BACKEND](os.path.join(cache_dir, fn.__name__),
+                                      ttl, _slots, _nclean, size, policy)
+        lock = threading.Lock()
+        refreshing = set()
+        _fn.cache = cache
+        _fn.stats = cache.stats
         return _fn
 
     ttl = ttl if ttl else TIMEOUT
@@ -14,6 +14,7 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import errno
 import fcntl
 import glob
 import hashlib
@@ -24,14 +25,99 @@ except:
     import pickle
 import shelve
 import shutil
+import sqlite3
 import time
 from UserDict import DictMixin
+from whichdb import whichdb
+
+import osc.core
+
+
+# Size of the blocks read and hashed at once (bytes)
+BLOCKSIZE = 1024*1024
+
+# Digests looked up per query, below the limit of 999 SQLite parameters
+QUERY_DIGESTS = 500
+
+
+def md5sum(filename):
+    """Return the MD5 digest of a file, reading it in blocks."""
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCKSIZE), ''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def get_binary_file(apiurl, project, repository, arch, filename, package=None, target_filename=None):
+    """Download a binary file from OBS, like osc.core.get_binary_file(),
+    and return the MD5 digest of the data computed while it is written.
+
+    """
+    target_filename = target_filename or filename
+
+    where = package or '_repository'
+    url = osc.core.makeurl(apiurl, ['build', project, repository, arch, where, filename])
+    f = osc.core.http_GET(url)
+    md5 = hashlib.md5()
+    tmp_filename = target_filename + '.part'
+    try:
+        with open(tmp_filename, 'wb') as target:
+            for block in iter(lambda: f.read(BLOCKSIZE), ''):
+                md5.update(block)
+                target.write(block)
+        os.rename(tmp_filename, target_filename)
+    except:
+        # Do not leave a partial download behind.
+        if os.path.exists(tmp_filename):
+            os.unlink(tmp_filename)
+        raise
+    return md5.hexdigest()
+
+
+class Index(sqlite3.Connection):
+    """Connection to the index of the cache, holding the lock file."""
+    pass
 
 
 class PkgCache(DictMixin):
-    def __init__(self, basecachedir, force_clean=False):
+    """Container of binary packages indexed by
+    (project, repository, arch, package, filename, mtime).
+
+    The index is a SQLite database with a row per key, and an index on the
+    key without the mtime (the prefix) to find the older versions of a
+    file.  Expired and superseded files are removed by maintenance().
+
+    The content is stored once per MD5 digest, in a blob named after it,
+    with the number of keys referencing it kept in the index.  The index
+    also keeps the size and the last use of every blob: once the quota is
+    exceeded the blobs used longest ago are evicted, with all their keys.
+
+    The cache can be shared by several processes.  The index is used in
+    WAL mode, so lookups read a snapshot of it without waiting for other
+    processes, and only the changes (that also touch the blobs) are
+    serialized with a lock file.  Hits are not: linkto() links the blob
+    and updates its last use without the lock.
+
+    """
+
+    # Default time to live of the cached files (seconds)
+    TTL = 14*24*60*60
+    # Minimal time between two runs of maintenance() (seconds)
+    MAINTENANCE_INTERVAL = 60*60
+    # Default quota of the cache, in bytes and in number of blobs (None
+    # for no limit)
+    QUOTA_BYTES = None
+    QUOTA_FILES = None
+    # Number of lookups in linkto() of a key whose blob is evicted
+    # meanwhile
+    LINK_RETRIES = 3
+
+    def __init__(self, basecachedir, force_clean=False, quota_bytes=None, quota_files=None):
         self.cachedir = os.path.join(basecachedir, 'pkgcache')
-        self.index_fn = os.path.join(self.cachedir, 'index.db')
+        self.index_fn = os.path.join(self.cachedir, 'index.sqlite')
+        self.quota_bytes = quota_bytes if quota_bytes is not None else self.QUOTA_BYTES
+        self.quota_files = quota_files if quota_files is not None else self.QUOTA_FILES
 
         if force_clean:
             try:
@@ -42,7 +128,64 @@ class PkgCache(DictMixin):
         if not os.path.exists(self.cachedir):
             os.makedirs(self.cachedir)
 
-        self._clean_cache()
+        _i = self._open_index()
+        _i.execute('PRAGMA journal_mode=WAL')
+        with _i:
+            _i.execute('CREATE TABLE IF NOT EXISTS pkgcache ('
+                       'key BLOB PRIMARY KEY, '
+                       'prefix BLOB NOT NULL, '
+                       'mtime INTEGER NOT NULL, '
+                       'md5 TEXT NOT NULL, '
+                       'filename TEXT NOT NULL)')
+            _i.execute('CREATE INDEX IF NOT EXISTS pkgcache_prefix ON pkgcache (prefix, mtime)')
+            _i.execute('CREATE INDEX IF NOT EXISTS pkgcache_mtime ON pkgcache (mtime)')
+            _i.execute('CREATE TABLE IF NOT EXISTS meta ('
+                       'name TEXT PRIMARY KEY, '
+                       'value NOT NULL)')
+            blobs = _i.execute("SELECT 1 FROM sqlite_master WHERE name = 'blobs'").fetchone()
+            _i.execute('CREATE TABLE IF NOT EXISTS blobs ('
+                       'md5 TEXT PRIMARY KEY, '
+                       'refcount INTEGER NOT NULL, '
+                       'size INTEGER NOT NULL, '
+                       'atime INTEGER NOT NULL)')
+            _i.execute('CREATE INDEX IF NOT EXISTS blobs_atime ON blobs (atime)')
+        self._migrate_index(_i)
+        if not blobs:
+            self._migrate_blobs(_i)
+        self._close_index(_i)
+
+    def _migrate_index(self, index):
+        """Import the entries of the shelve used as index by older versions."""
+        shelve_fn = os.path.join(self.cachedir, 'index.db')
+        if not whichdb(shelve_fn):
+            return
+        old = shelve.open(shelve_fn, protocol=-1, flag='r')
+        with index:
+            for key in old:
+                md5, filename = pickle.loads(old[key])
+                self._insert(pickle.loads(key), md5, filename, index)
+        old.close()
+        # Depending on the dbm module the shelve uses several files.
+        for filename in glob.glob(shelve_fn + '*'):
+            os.unlink(filename)
+
+    def _migrate_blobs(self, index):
+        """Count the references of every blob, that older versions kept
+        as numbered hard links (<md5>-NNN) to the blob.  The size is taken
+        from the blob and the time of the last use from the index.
+
+        """
+        with index:
+            for md5, refcount, atime in index.execute('SELECT md5, COUNT(*), MAX(mtime) '
+                                                      'FROM pkgcache GROUP BY md5').fetchall():
+                try:
+                    size = os.path.getsize(self._blob(md5))
+                except OSError:
+                    size = 0
+                index.execute('INSERT INTO blobs (md5, refcount, size, atime) VALUES (?, ?, ?, ?)',
+                              (md5, refcount, size, atime))
+        for filename in glob.glob(os.path.join(self.cachedir, '??', '*-[0-9][0-9][0-9]')):
+            os.unlink(filename)
 
     def _lock(self, filename):
         """Get a lock for the index file."""
@@ -55,10 +198,14 @@ class PkgCache(DictMixin):
         fcntl.flock(lckfile.fileno(), fcntl.LOCK_UN)
         lckfile.close()
 
-    def _open_index(self):
-        """Open the index file for the cache / container."""
-        lckfile = self._lock(self.index_fn)
-        index = shelve.open(self.index_fn, protocol=-1)
+    def _open_index(self, lock=True):
+        """Open the index file for the cache / container.  Without 'lock'
+        the index is only read.
+
+        """
+        lckfile = self._lock(self.index_fn) if lock else None
+        index = sqlite3.connect(self.index_fn, timeout=60, factory=Index)
+        index.text_factory = str
         # Store a reference to the lckfile to avoid to be closed by gc
         index.lckfile = lckfile
         return index
@@ -66,9 +213,96 @@ class PkgCache(DictMixin):
     def _close_index(self, index):
         """Close the index file for the cache / container."""
         index.close()
-        self._unlock(index.lckfile)
+        if index.lckfile:
+            self._unlock(index.lckfile)
+
+    def _key(self, key):
+        """Serialize a key (or its prefix) for the index."""
+        # Pickle do not guarantee that the same object is serialized
+        # always in the same string, so go through a round trip.
+        key = pickle.dumps(key, protocol=-1)
+        return sqlite3.Binary(pickle.dumps(pickle.loads(key), protocol=-1))
+
+    def _insert(self, key, md5, filename, index):
+        index.execute('INSERT OR REPLACE INTO pkgcache (key, prefix, mtime, md5, filename) '
+                      'VALUES (?, ?, ?, ?, ?)',
+                      (self._key(key), self._key(key[:-1]), int(key[-1]), md5, filename))
+
+    def _blob(self, md5):
+        """Return the path of the blob with the given digest."""
+        return os.path.join(self.cachedir, md5[:2], md5[2:])
 
-    def _clean_cache(self, ttl=14*24*60*60, index=None):
+    def _decref(self, md5s, index):
+        """Remove one reference to the blob of every digest in 'md5s', and
+        the blobs left unreferenced.
+
+        """
+        index.executemany('UPDATE blobs SET refcount = refcount - 1 WHERE md5 = ?',
+                          ((md5,) for md5 in md5s))
+        # Only the blobs just decremented can be left unreferenced.
+        digests = list(set(md5s))
+        unreferenced = []
+        for i in range(0, len(digests), QUERY_DIGESTS):
+            chunk = digests[i:i + QUERY_DIGESTS]
+            unreferenced.extend(md5 for md5, in index.execute(
+                'SELECT md5 FROM blobs WHERE md5 IN (%s) AND refcount <= 0' % ', '.join('?' * len(chunk)),
+                chunk))
+        index.executemany('DELETE FROM blobs WHERE md5 = ?', ((md5,) for md5 in unreferenced))
+        self._unlink(unreferenced)
+
+    def _unlink(self, md5s):
+        """Remove the blobs of every digest in 'md5s'."""
+        dirnames = set()
+        for md5 in md5s:
+            cache_fn = self._blob(md5)
+            try:
+                os.unlink(cache_fn)
+            except OSError:
+                pass
+            dirnames.add(os.path.dirname(cache_fn))
+        self._rmdirs(dirnames)
+
+    def _rmdirs(self, dirnames):
+        for dirname in dirnames:
+            try:
+                os.rmdir(dirname)
+            except OSError:
+                # Not empty
+                pass
+
+    def _count(self, name, value, index):
+        """Add 'value' to one of the counters of the cache."""
+        index.execute("INSERT OR IGNORE INTO meta (name, value) VALUES (?, 0)", (name,))
+        index.execute('UPDATE meta SET value = value + ? WHERE name = ?', (value, name))
+
+    def _evict(self, quota_bytes, quota_files, index, keep=None):
+        """Remove the blobs used longest ago, and their keys, until the
+        cache is within the quota.  The blob of 'keep' is never removed.
+
+        """
+        if quota_bytes is None and quota_files is None:
+            return
+        files, size = index.execute('SELECT COUNT(*), TOTAL(size) FROM blobs').fetchone()
+        over_files = files - quota_files if quota_files is not None else 0
+        over_bytes = size - quota_bytes if quota_bytes is not None else 0
+        if over_files <= 0 and over_bytes <= 0:
+            return
+
+        evicted = []
+        for md5, size in index.execute('SELECT md5, size FROM blobs ORDER BY atime'):
+            if over_files <= 0 and over_bytes <= 0:
+                break
+            if md5 == keep:
+                continue
+            evicted.append((md5,))
+            over_files -= 1
+            over_bytes -= size
+        index.executemany('DELETE FROM pkgcache WHERE md5 = ?', evicted)
+        index.executemany('DELETE FROM blobs WHERE md5 = ?', evicted)
+        self._count('evicted', len(evicted), index)
+        self._unlink(md5 for md5, in evicted)
+
+    def _clean_cache(self, ttl=TTL, index=None):
         """Remove elements in the cache that share the same prefix of the key
         (all except the mtime), and keep the latest one.  Also remove
         old entries based on the TTL.
@@ -76,110 +310,149 @@ class PkgCache(DictMixin):
         """
         _i = self._open_index() if index is None else index
 
-        # Ugly hack to assure that the key is serialized always with
-        # the same pickle format.  Pickle do not guarantee that the
-        # same object is serialized always in the same string.
-        skeys = {pickle.loads(key): key for key in _i}
-        keys = sorted(skeys)
-
         now = int(time.time())
-        last = None
-        for key in keys:
-            if last and last[:-1] == key[:-1]:
-                self.__delitem__(key=skeys[last], skey=True, index=_i)
-                last = key
-            elif now - int(key[-1]) >= ttl:
-                self.__delitem__(key=skeys[key], skey=True, index=_i)
-            else:
-                last = key
+        with _i:
+            rows = _i.execute('SELECT key, md5 FROM pkgcache AS p WHERE mtime <= ? OR EXISTS '
+                              '(SELECT 1 FROM pkgcache AS q WHERE q.prefix = p.prefix AND q.mtime > p.mtime)',
+                              (now - ttl,)).fetchall()
+            _i.executemany('DELETE FROM pkgcache WHERE key = ?', ((key,) for key, _ in rows))
+            self._decref([md5 for _, md5 in rows], _i)
 
         if index is None:
             self._close_index(_i)
 
-    def __getitem__(self, key, index=None):
-        """Get a element in the cache.
+    def maintenance(self, ttl=TTL, interval=MAINTENANCE_INTERVAL):
+        """Clean the cache if it was not cleaned in the last 'interval'
+        seconds.  Return True if the cache was cleaned.
 
-        For the container perspective, the key is a tuple like this:
-        (project, repository, arch, package, filename, mtime)
+        """
+        _i = self._open_index()
+
+        now = int(time.time())
+        last = _i.execute("SELECT value FROM meta WHERE name = 'maintenance'").fetchone()
+        cleaned = False
+        if not last or now - last[0] >= interval:
+            self._clean_cache(ttl, index=_i)
+            with _i:
+                self._evict(self.quota_bytes, self.quota_files, _i)
+                _i.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('maintenance', ?)", (now,))
+            cleaned = True
+
+        self._close_index(_i)
+        return cleaned
+
+    def stats(self, index=None):
+        """Return the number of blobs and bytes in the cache, and the
+        counters of bytes 'downloaded' (added to the cache), 'dedup_saved'
+        (added with a content already in the cache), 'hit' (linked from
+        the cache) and of blobs 'evicted' to keep the quota.
 
         """
-        _i = self._open_index() if index is None else index
+        _i = self._open_index(lock=False) if index is None else index
 
-        key = pickle.dumps(key, protocol=-1)
-        value = pickle.loads(_i[key])
+        stats = dict.fromkeys(('downloaded', 'dedup_saved', 'hit', 'evicted'), 0)
+        stats.update(_i.execute('SELECT name, value FROM meta WHERE name IN (?, ?, ?, ?)', tuple(stats)))
+        stats['files'], stats['bytes'] = _i.execute('SELECT COUNT(*), TOTAL(size) FROM blobs').fetchone()
 
         if index is None:
             self._close_index(_i)
 
-        return value
-
-    def __setitem__(self, key, value, index=None):
-        """Add a new file in the cache. 'value' is expected to contains the
-        path of file.
-
-        """
-        _i = self._open_index() if index is None else index
+        return stats
 
-        key = pickle.dumps(key, protocol=-1)
+    def __contains__(self, key, index=None):
+        _i = self._open_index(lock=False) if index is None else index
 
-        original_value = value
-
-        md5 = hashlib.md5(open(value, 'rb').read()).hexdigest()
-        filename = os.path.basename(value)
-        value = (md5, filename)
-        value = pickle.dumps(value, protocol=-1)
-        _i[key] = value
-
-        # Move the file into the container using a hard link
-        cache_fn = os.path.join(self.cachedir, md5[:2], md5[2:])
-        if os.path.exists(cache_fn):
-            # Manage collisions using hard links and refcount
-            collisions = sorted(glob.glob(cache_fn + '-*'))
-            next_refcount = 1
-            if collisions:
-                next_refcount = int(collisions[-1][-3:]) + 1
-            next_cache_fn = cache_fn + '-%03d' % next_refcount
-            os.link(cache_fn, next_cache_fn)
-        else:
-            dirname = os.path.dirname(cache_fn)
-            if not os.path.exists(dirname):
-                os.makedirs(dirname)
-            os.link(original_value, cache_fn)
+        row = _i.execute('SELECT 1 FROM pkgcache WHERE key = ?', (self._key(key),)).fetchone()
 
         if index is None:
             self._close_index(_i)
 
-    def __delitem__(self, key, skey=False, index=None):
-        """Remove a file from the cache."""
-        _i = self._open_index() if index is None else index
+        return row is not None
 
-        key = pickle.dumps(key, protocol=-1) if not skey else key
-        value = pickle.loads(_i[key])
+    def __getitem__(self, key, index=None):
+        """Get a element in the cache.
 
-        md5, _ = value
+        For the container perspective, the key is a tuple like this:
+        (project, repository, arch, package, filename, mtime)
 
-        # Remove the file (taking care of collision) and the directory
-        # if it is empty
-        cache_fn = os.path.join(self.cachedir, md5[:2], md5[2:])
-        collisions = sorted(glob.glob(cache_fn + '-*'))
-        if collisions:
-            os.unlink(collisions[-1])
-        else:
-            os.unlink(cache_fn)
+        """
+        _i = self._open_index(lock=False) if index is None else index
+        try:
+            row = _i.execute('SELECT md5, filename FROM pkgcache WHERE key = ?', (self._key(key),)).fetchone()
+        finally:
+            if index is None:
+                self._close_index(_i)
 
-        dirname = os.path.dirname(cache_fn)
-        if not os.listdir(dirname):
-            os.rmdir(dirname)
+        if row is None:
+            raise KeyError(key)
+        return row
 
-        del _i[key]
+    def __setitem__(self, key, value, index=None):
+        """Add a new file in the cache. 'value' is expected to contains the
+        path of file.
 
-        if index is None:
-            self._close_index(_i)
+        """
+        self.add(key, value, index=index)
 
-    def keys(self, index=None):
+    def add(self, key, value, md5=None, index=None):
+        """Add a new file in the cache.  If known, 'md5' is the digest of
+        the file, that otherwise is read to compute it.
+
+        """
         _i = self._open_index() if index is None else index
+        try:
+            if md5 is None:
+                md5 = md5sum(value)
+            filename = os.path.basename(value)
+            size = os.path.getsize(value)
+            now = int(time.time())
+
+            with _i:
+                self._count('downloaded', size, _i)
+                old = _i.execute('SELECT md5 FROM pkgcache WHERE key = ?', (self._key(key),)).fetchone()
+                if old and old[0] == md5:
+                    self._insert(key, md5, filename, _i)
+                    _i.execute('UPDATE blobs SET atime = ? WHERE md5 = ?', (now, md5))
+                else:
+                    # Move the file into the container using a hard link, if
+                    # the content is not there already
+                    if _i.execute('UPDATE blobs SET refcount = refcount + 1, atime = ? WHERE md5 = ?',
+                                  (now, md5)).rowcount:
+                        self._count('dedup_saved', size, _i)
+                    else:
+                        cache_fn = self._blob(md5)
+                        dirname = os.path.dirname(cache_fn)
+                        if not os.path.exists(dirname):
+                            os.makedirs(dirname)
+                        if not os.path.exists(cache_fn):
+                            os.link(value, cache_fn)
+                        _i.execute('INSERT INTO blobs (md5, refcount, size, atime) VALUES (?, 1, ?, ?)',
+                                   (md5, size, now))
+                    self._insert(key, md5, filename, _i)
+                    if old:
+                        self._decref([old[0]], _i)
+                self._evict(self.quota_bytes, self.quota_files, _i, keep=md5)
+        finally:
+            if index is None:
+                self._close_index(_i)
+
+    def __delitem__(self, key, index=None):
+        """Remove a file from the cache."""
+        _i = self._open_index() if index is None else index
+        try:
+            md5, _ = self.__getitem__(key, index=_i)
+
+            with _i:
+                _i.execute('DELETE FROM pkgcache WHERE key = ?', (self._key(key),))
+                self._decref([md5], _i)
+        finally:
+            if index is None:
+                self._close_index(_i)
 
-        keys = [pickle.loads(key) for key in _i]
+    def keys(self, index=None):
+        _i = self._open_index(lock=False) if index is None else index
+
+        keys = [pickle.loads(str(key)) for key, in _i.execute('SELECT key FROM pkgcache')]
 
         if index is None:
             self._close_index(_i)
@@ -187,15 +460,35 @@ class PkgCache(DictMixin):
         return keys
 
     def linkto(self, key, target, index=None):
-        """Create a link between the cached object and the target"""
-        _i = self._open_index() if index is None else index
+        """Create a link between the cached object and the target.
 
-        md5, filename = self.__getitem__(key, index=_i)
-        if filename != target:
-            pass
-            # print 'Warning. The target name (%s) is different from the original name (%s)' % (target, filename)
-        cache_fn = os.path.join(self.cachedir, md5[:2], md5[2:])
-        os.link(cache_fn, target)
+        Without 'index' the lock is not taken: the blob is linked and its
+        last use updated with plain writes to the index.  If the blob was
+        evicted between the lookup and the link, the key is looked up
+        again, and KeyError is raised once it is gone or after
+        LINK_RETRIES attempts.
 
-        if index is None:
-            self._close_index(_i)
+        """
+        _i = self._open_index(lock=False) if index is None else index
+        try:
+            for _ in range(self.LINK_RETRIES):
+                md5, filename = self.__getitem__(key, index=_i)
+                if filename != target:
+                    pass
+                    # print 'Warning. The target name (%s) is different from the original name (%s)' % (target, filename)
+                try:
+                    os.link(self._blob(md5), target)
+                    break
+                except OSError as e:
+                    if e.errno != errno.ENOENT or os.path.exists(self._blob(md5)):
+                        raise
+            else:
+                # The blob is gone while the key is still in the index.
+                raise KeyError(key)
+
+            with _i:
+                _i.execute('UPDATE blobs SET atime = ? WHERE md5 = ?', (int(time.time()), md5))
+                self._count('hit', os.path.getsize(target), _i)
+        finally:
+            if index is None:
+                self._close_index(_i)
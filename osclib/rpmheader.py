@@ -0,0 +1,187 @@
+# Copyright (C) 2016 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Read the headers of RPM packages without the rpm tools.
+
+Only the lead, the signature and the main header are read, so it works
+with complete RPMs and with the entries of view=cpioheaders.
+
+"""
+
+import struct
+
+LEAD_MAGIC = '\xed\xab\xee\xdb'
+HEADER_MAGIC = '\x8e\xad\xe8\x01'
+
+# Tags of the main header
+NAME = 1000
+VERSION = 1001
+RELEASE = 1002
+EPOCH = 1003
+ARCH = 1022
+OLDFILENAMES = 1027
+SOURCERPM = 1044
+REQUIREFLAGS = 1048
+REQUIRENAME = 1049
+REQUIREVERSION = 1050
+PROVIDENAME = 1047
+PROVIDEFLAGS = 1112
+PROVIDEVERSION = 1113
+DIRINDEXES = 1116
+BASENAMES = 1117
+DIRNAMES = 1118
+DISTURL = 1123
+PAYLOADCOMPRESSOR = 1125
+
+# Types of the tags
+INT8 = 2
+INT16 = 3
+INT32 = 4
+INT64 = 5
+STRING = 6
+BIN = 7
+STRING_ARRAY = 8
+I18NSTRING = 9
+
+INTEGERS = {
+    INT8: 'B',
+    INT16: 'H',
+    INT32: 'I',
+    INT64: 'Q',
+}
+
+
+def _read(fh, size):
+    """Read exactly 'size' bytes from 'fh'."""
+    chunks = []
+    while size > 0:
+        chunk = fh.read(size)
+        if not chunk:
+            raise ValueError('truncated rpm header')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
+
+
+class Header(object):
+    """Header structure of a RPM, with the values decoded on access."""
+
+    def __init__(self, index, store):
+        self.index = index
+        self.store = store
+
+    @classmethod
+    def read(cls, fh):
+        magic, nindex, hsize = struct.unpack('>8sII', _read(fh, 16))
+        if magic[:4] != HEADER_MAGIC:
+            raise ValueError('invalid rpm header')
+        entries = _read(fh, 16 * nindex)
+        index = {}
+        for i in range(nindex):
+            tag, type_, offset, count = struct.unpack_from('>IIII', entries, 16 * i)
+            index[tag] = (type_, offset, count)
+        return cls(index, _read(fh, hsize))
+
+    def __contains__(self, tag):
+        return tag in self.index
+
+    def __getitem__(self, tag):
+        """Return the value of 'tag': a string, a list of strings or
+        integers, or bytes for binary tags.
+
+        """
+        type_, offset, count = self.index[tag]
+        store = self.store
+        if type_ in (STRING, I18NSTRING):
+            # Only the first translation of I18NSTRING
+            return store[offset:store.index('\0', offset)]
+        if type_ == STRING_ARRAY:
+            values = []
+            for _ in range(count):
+                end = store.index('\0', offset)
+                values.append(store[offset:end])
+                offset = end + 1
+            return values
+        if type_ == BIN:
+            return store[offset:offset + count]
+        if type_ in INTEGERS:
+            return list(struct.unpack_from('>%d%s' % (count, INTEGERS[type_]), store, offset))
+        raise ValueError('unsupported type %d of tag %d' % (type_, tag))
+
+    def get(self, tag, default=None):
+        return self[tag] if tag in self else default
+
+
+class Package(object):
+    """Main header of a RPM, with the usual tags as attributes."""
+
+    def __init__(self, header):
+        self.header = header
+
+    @classmethod
+    def read(cls, fh):
+        """Read the lead and the headers from the beginning of 'fh'.  The
+        file object is left at the beginning of the payload.
+
+        """
+        lead = _read(fh, 96)
+        if lead[:4] != LEAD_MAGIC:
+            raise ValueError('not a rpm')
+        signature = Header.read(fh)
+        # The signature is padded to 8 bytes.
+        _read(fh, -len(signature.store) % 8)
+        return cls(Header.read(fh))
+
+    @classmethod
+    def open(cls, filename):
+        with open(filename, 'rb') as fh:
+            return cls.read(fh)
+
+    @property
+    def name(self):
+        return self.header[NAME]
+
+    @property
+    def disturl(self):
+        return self.header.get(DISTURL)
+
+    @property
+    def payloadcompressor(self):
+        return self.header.get(PAYLOADCOMPRESSOR, 'gzip')
+
+    def _dependencies(self, name, flags, version):
+        names = self.header.get(name, [])
+        return zip(names,
+                   self.header.get(flags, [0] * len(names)),
+                   self.header.get(version, [''] * len(names)))
+
+    @property
+    def provides(self):
+        """List of (name, flags, version) provided."""
+        return self._dependencies(PROVIDENAME, PROVIDEFLAGS, PROVIDEVERSION)
+
+    @property
+    def requires(self):
+        """List of (name, flags, version) required."""
+        return self._dependencies(REQUIRENAME, REQUIREFLAGS, REQUIREVERSION)
+
+    @property
+    def filenames(self):
+        if BASENAMES in self.header:
+            dirnames = self.header[DIRNAMES]
+            return [dirnames[i] + basename for i, basename
+                    in zip(self.header[DIRINDEXES], self.header[BASENAMES])]
+        return self.header.get(OLDFILENAMES, [])
@@ -79,7 +79,7 @@ class StagingAPI(object):
         else:
             self.rings = []
 
-        Cache.init()
+        Cache.init(conf.config[project].get('cache-backend'))
 
 
     @property
@@ -0,0 +1,102 @@
+# Copyright (C) 2016 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from mock import MagicMock
+from mock import patch
+
+from osclib import builddepinfo
+from osclib import depsnapshot
+from osclib.builddepinfo import BuildDepInfo
+from osclib.cleanup_rings import CleanupRings
+from osclib.cycle import CycleDetector
+
+
+BUILDDEPINFO = """<builddepinfo>
+  <package name="glibc">
+    <source>glibc</source>
+    <pkgdep>gcc</pkgdep>
+    <subpkg>glibc</subpkg>
+    <subpkg>glibc-devel</subpkg>
+  </package>
+  <package name="gcc">
+    <source>gcc</source>
+    <pkgdep>glibc-devel</pkgdep>
+    <subpkg>gcc</subpkg>
+  </package>
+  <package name="glibc:i686">
+    <source>glibc</source>
+    <pkgdep>gcc</pkgdep>
+    <subpkg>glibc</subpkg>
+    <subpkg>glibc-32bit</subpkg>
+  </package>
+  <package name="preinstallimage-base">
+    <source>preinstallimage-base</source>
+    <pkgdep>glibc</pkgdep>
+    <subpkg>preinstallimage-base</subpkg>
+  </package>
+  <cycle>
+    <package>gcc</package>
+    <package>glibc</package>
+  </cycle>
+</builddepinfo>
+"""
+
+
+class TestBuildDepInfo(unittest.TestCase):
+
+    def test_iterparse(self):
+        cycles = []
+        packages = list(builddepinfo.iterparse(StringIO(BUILDDEPINFO), cycles))
+        self.assertEqual([p.name for p in packages],
+                         ['glibc', 'gcc', 'glibc:i686', 'preinstallimage-base'])
+        self.assertEqual(packages[0], ('glibc', 'glibc', ['gcc'], ['glibc', 'glibc-devel']))
+        self.assertEqual(cycles, [frozenset(('gcc', 'glibc'))])
+
+    def test_builddepinfo(self):
+        info = BuildDepInfo(BUILDDEPINFO, ignore=lambda name: name.startswith('preinstallimage-'))
+        self.assertEqual([p.name for p in info], ['glibc', 'gcc', 'glibc:i686'])
+        self.assertTrue('gcc' in info)
+        self.assertFalse('preinstallimage-base' in info)
+        self.assertEqual(info['glibc:i686'].subs, ['glibc', 'glibc-32bit'])
+        # The first package with a subpackage is kept.
+        self.assertEqual(info.subpkgs, {'glibc': 'glibc', 'glibc-devel': 'glibc',
+                                        'gcc': 'gcc', 'glibc-32bit': 'glibc:i686'})
+        self.assertEqual(info.cycles, [frozenset(('gcc', 'glibc'))])
+
+    def test_cleanup_rings(self):
+        snapshotdir = depsnapshot.SNAPSHOTDIR
+        depsnapshot.SNAPSHOTDIR = tempfile.mkdtemp(prefix='depsnapshot-')
+        try:
+            with patch.object(CycleDetector, '_builddepinfo_current', MagicMock(return_value=BUILDDEPINFO)):
+                cleanup = CleanupRings(MagicMock(apiurl='http://localhost'))
+                cleanup.fill_pkgdeps('openSUSE:Factory:Rings:0-Bootstrap', 'standard', 'x86_64')
+        finally:
+            shutil.rmtree(depsnapshot.SNAPSHOTDIR)
+            depsnapshot.SNAPSHOTDIR = snapshotdir
+            depsnapshot._snapshots.clear()
+        self.assertEqual(cleanup.sources, set(('glibc', 'gcc')))
+        self.assertEqual(cleanup.bin2src, {'glibc': 'glibc', 'glibc-devel': 'glibc',
+                                           'gcc': 'gcc', 'glibc-32bit': 'glibc'})
+        self.assertEqual(cleanup.pkgdeps, {'gcc': 'glibc', 'glibc': 'preinstallimage-base'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,253 @@
+# Copyright (C) 2016 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import datetime
+import os
+import tempfile
+import threading
+import time as _time
+import traceback
+import unittest
+import urlparse
+from StringIO import StringIO
+from time import time
+
+from mock import MagicMock
+from mock import patch
+
+import osclib.cache
+from osclib.cache import Cache
+
+
+APIURL = 'http://localhost'
+URL_META = APIURL + '/source/openSUSE:Factory/_meta'
+URL_SOURCE = APIURL + '/source'
+
+
+class TestCache(unittest.TestCase):
+    BACKEND = 'file'
+
+    def setUp(self):
+        """Initialize the environment."""
+        self._cache_dir = Cache.CACHE_DIR
+        self._backend = Cache.BACKEND
+        Cache.CACHE_DIR = tempfile.mkdtemp(prefix='osclib-cache-')
+        Cache.init(self.BACKEND)
+        Cache.last_updated[APIURL] = {'__oldest': '2016-12-18T11:49:37Z'}
+        self.stats = dict(Cache.stats)
+
+    def tearDown(self):
+        """Clean the environment."""
+        Cache.delete_all()
+        Cache.CACHE_DIR = self._cache_dir
+        Cache.BACKEND = self._backend
+        del Cache.last_updated[APIURL]
+
+    def test_put_get(self):
+        self.assertEqual(Cache.get(URL_SOURCE), None)
+        self.assertEqual(Cache.put(URL_SOURCE, StringIO('<directory/>')).read(), '<directory/>')
+        self.assertEqual(Cache.get(URL_SOURCE).read(), '<directory/>')
+
+        Cache.put(URL_META, StringIO('<project/>'))
+        self.assertEqual(Cache.get(URL_META).read(), '<project/>')
+
+    def test_delete(self):
+        Cache.put(URL_SOURCE, StringIO('<directory/>'))
+        Cache.delete(URL_SOURCE)
+        self.assertEqual(Cache.get(URL_SOURCE), None)
+
+    def test_delete_project(self):
+        Cache.put(URL_SOURCE, StringIO('<directory/>'))
+        Cache.put(URL_META, StringIO('<project/>'))
+        Cache.delete_project(APIURL, 'openSUSE:Factory')
+        self.assertEqual(Cache.get(URL_META), None)
+        self.assertEqual(Cache.get(URL_SOURCE).read(), '<directory/>')
+
+    def test_memory(self):
+        Cache.put(URL_META, StringIO('<project/>'))
+        Cache.store().delete(URL_META, 'openSUSE:Factory')
+        self.assertEqual(Cache.get(URL_META).read(), '<project/>')
+
+        # Non-GET requests invalidate the memory tier as well.
+        Cache.delete(URL_META)
+        self.assertEqual(Cache.get(URL_META), None)
+
+    def test_memory_init(self):
+        Cache.put(URL_META, StringIO('<project/>'))
+        Cache.store().delete(URL_META, 'openSUSE:Factory')
+
+        # Every new StagingAPI initializes the cache again.
+        Cache.init()
+        self.assertEqual(Cache.get(URL_META).read(), '<project/>')
+
+        with patch.object(Cache, 'MEMORY_ENTRIES', 0):
+            Cache.init()
+        self.assertEqual(Cache.get(URL_META), None)
+        Cache.init()
+
+    def test_revalidate(self):
+        response = StringIO('<directory/>')
+        response.info = MagicMock()
+        response.info.return_value.getheader = {'ETag': '"abc"', 'Last-Modified': None}.get
+        Cache.put(URL_SOURCE, response)
+        self.assertEqual(Cache.validators(URL_SOURCE), {'If-None-Match': '"abc"'})
+
+        now = osclib.cache.time()
+        osclib.cache.time = MagicMock(return_value=now + Cache.TTL_LONG + 1)
+        try:
+            self.assertEqual(Cache.get(URL_SOURCE), None)
+            osclib.cache.time.return_value = now
+            self.assertEqual(Cache.revalidated(URL_SOURCE).read(), '<directory/>')
+            osclib.cache.time.return_value = now + Cache.TTL_LONG - 1
+            self.assertEqual(Cache.get(URL_SOURCE).read(), '<directory/>')
+        finally:
+            osclib.cache.time = time
+
+        self.assertEqual(Cache.stats['revalidate_bytes'] - self.stats['revalidate_bytes'], len('<directory/>'))
+
+    def test_revalidate_project_mtime(self):
+        # Both backends count a revalidation as a change of the project.
+        Cache.put(URL_META, StringIO('<project/>'))
+        now = osclib.cache.time()
+        osclib.cache.time = MagicMock(return_value=now + 100)
+        try:
+            Cache.revalidated(URL_META)
+        finally:
+            osclib.cache.time = time
+        self.assertEqual(int(Cache.store().project_mtime(APIURL, 'openSUSE:Factory')), int(now + 100))
+
+    def test_last_updated(self):
+        def timestamp(minutes):
+            updated = datetime.datetime.utcnow() - datetime.timedelta(minutes=minutes)
+            return updated.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+        # Newest first, as returned by OBS.
+        updates = [('openSUSE:Factory', timestamp(10)),
+                   ('openSUSE:Leap:42.3', timestamp(20)),
+                   ('openSUSE:Factory', timestamp(30))]
+
+        def http_GET(url):
+            limit = int(urlparse.parse_qs(urlparse.urlsplit(url).query)['limit'][0])
+            return StringIO('<latest_updated>%s</latest_updated>' % ''.join(
+                '<project name="%s" updated="%s"/>' % update for update in updates[:limit]))
+
+        http_GET_orig = osclib.cache.osc.core.http_GET
+        osclib.cache.osc.core.http_GET = MagicMock(side_effect=http_GET)
+        try:
+            del Cache.last_updated[APIURL]
+            Cache.last_updated_load(APIURL)
+            self.assertEqual(Cache.last_updated[APIURL]['openSUSE:Factory'], updates[0][1])
+            self.assertEqual(Cache.last_updated[APIURL]['__oldest'], updates[-1][1])
+
+            # A new process merges only the newer entries into the stored map.
+            updates.insert(0, ('openSUSE:Leap:42.3', timestamp(5)))
+            with patch.object(Cache, 'TTL_SHORT', -1), patch.object(Cache, 'LATEST_UPDATED_STEP', 2):
+                del Cache.last_updated[APIURL]
+                Cache.last_updated_load(APIURL)
+            self.assertTrue('limit=2' in osclib.cache.osc.core.http_GET.call_args[0][0])
+            self.assertEqual(Cache.last_updated[APIURL]['openSUSE:Leap:42.3'], updates[0][1])
+            self.assertEqual(Cache.last_updated[APIURL]['__oldest'], updates[-1][1])
+        finally:
+            osclib.cache.osc.core.http_GET = http_GET_orig
+
+    def test_stale(self):
+        Cache.put(URL_SOURCE, StringIO('<directory/>'))
+        http_request_orig = osclib.cache.osc.core._http_request
+        osclib.cache.osc.core._http_request = MagicMock(return_value=StringIO('<directory count="1"/>'))
+        osclib.cache.time = MagicMock(return_value=time() + Cache.TTL_LONG + 1)
+        Cache.STALE = 60
+        try:
+            # Served expired and refreshed in the background.
+            self.assertEqual(osclib.cache.http_request('GET', URL_SOURCE).read(), '<directory/>')
+            while Cache.refreshing:
+                _time.sleep(0.01)
+            self.assertEqual(osclib.cache.http_request('GET', URL_SOURCE).read(), '<directory count="1"/>')
+
+            # Never for paths that only avoid duplicate requests.
+            url = APIURL + "/search/project/id?match=starts-with(@name,'openSUSE:Factory:')"
+            Cache.put(url, StringIO('<collection/>'))
+            osclib.cache.time.return_value += Cache.TTL_DUPLICATE + 1
+            self.assertEqual(Cache.stale(url), None)
+
+            # Nor for the statistics used to expire projects.
+            url = APIURL + '/statistics/latest_updated?limit=100'
+            Cache.put(url, StringIO('<latest_updated/>'))
+            osclib.cache.time.return_value += Cache.TTL_SHORT + 1
+            self.assertEqual(Cache.stale(url), None)
+        finally:
+            Cache.STALE = 0
+            osclib.cache.time = time
+            osclib.cache.osc.core._http_request = http_request_orig
+
+    def test_flight(self):
+        def _http_request(*args):
+            _time.sleep(0.1)
+            return StringIO('<directory/>')
+
+        http_request_orig = osclib.cache.osc.core._http_request
+        osclib.cache.osc.core._http_request = MagicMock(side_effect=_http_request)
+        try:
+            threads = [threading.Thread(target=osclib.cache.http_request, args=('GET', URL_SOURCE))
+                       for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(osclib.cache.osc.core._http_request.call_count, 1)
+            self.assertEqual(Cache.flights, {})
+        finally:
+            osclib.cache.osc.core._http_request = http_request_orig
+
+    def test_flight_process(self):
+        # This process only holds an expired copy in memory.
+        Cache.memory.put(URL_SOURCE, APIURL, None, (time() - Cache.TTL_LONG - 1, '<directory/>', (None, None)))
+
+        locked_r, locked_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                # Fill the store while holding the lock of the url.
+                Cache._store = None
+                with Cache.flight(URL_SOURCE):
+                    os.write(locked_w, 'x')
+                    _time.sleep(0.2)
+                    Cache.put(URL_SOURCE, StringIO('<directory count="1"/>'))
+            except Exception:
+                traceback.print_exc()
+                status = 1
+            os._exit(status)
+
+        http_request_orig = osclib.cache.osc.core._http_request
+        osclib.cache.osc.core._http_request = MagicMock(return_value=StringIO('<directory count="2"/>'))
+        try:
+            os.read(locked_r, 1)
+            ret = osclib.cache.http_request('GET', URL_SOURCE)
+            self.assertEqual(os.waitpid(pid, 0)[1], 0)
+            self.assertEqual(ret.read(), '<directory count="1"/>')
+            self.assertEqual(osclib.cache.osc.core._http_request.call_count, 0)
+        finally:
+            osclib.cache.osc.core._http_request = http_request_orig
+            os.close(locked_r)
+            os.close(locked_w)
+
+
+class TestCacheSQLite(TestCache):
+    BACKEND = 'sqlite'
+
+
+if __name__ == '__main__':
+    unittest.main()
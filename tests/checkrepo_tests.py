@@ -14,12 +14,25 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import os
+import shutil
+import tempfile
+import time
 import unittest
+from collections import defaultdict
+from StringIO import StringIO
+
+from mock import MagicMock
 
 from obs import APIURL
 from obs import OBS
+import osclib.checkrepo
 from osclib.checkrepo import CheckRepo
+from osclib.checkrepo import Request
 from osclib.conf import Config
+from rpmbuilder import TAGS
+from rpmbuilder import archive
+from rpmbuilder import rpm
 
 
 class TestCheckRepoCalls(unittest.TestCase):
@@ -73,3 +86,77 @@ class TestCheckRepoCalls(unittest.TestCase):
             request_and_specs = self.checkrepo.check_specs(request=request)
             for rq_or_spec in request_and_specs:
                 print self.checkrepo.repositories_to_check(rq_or_spec)
+
+
+class TestCheckRepoDownload(unittest.TestCase):
+    """Tests for the parallel downloads of check repo."""
+
+    def setUp(self):
+        """Initialize the environment."""
+        self._downloads = osclib.checkrepo.DOWNLOADS
+        osclib.checkrepo.DOWNLOADS = tempfile.mkdtemp(prefix='checkrepo-')
+        self.checkrepo = CheckRepo.__new__(CheckRepo)
+
+        def _get_binary_file(project, repository, arch, package, filename, target, mtime):
+            # The first files take longer, to be finished out of order.
+            time.sleep(0.01 * (4 - int(mtime)))
+            with open(target, 'w') as f:
+                f.write(filename)
+            return True
+
+        self.checkrepo._get_binary_file = MagicMock(side_effect=_get_binary_file)
+        self.checkrepo._disturl = lambda filename: 'obs://build/%s-pkg' % os.path.basename(filename)[0]
+
+    def tearDown(self):
+        """Clean the environment."""
+        shutil.rmtree(osclib.checkrepo.DOWNLOADS)
+        osclib.checkrepo.DOWNLOADS = self._downloads
+
+    def test_download(self):
+        request = Request(request_id=1000, src_package='pkg')
+        request.downloads = defaultdict(list)
+        todownload = [
+            ('openSUSE:Factory', 'standard', 'x86_64', 'rpmlint.log', '0'),
+            ('openSUSE:Factory', 'standard', 'x86_64', 'a.rpm', '1'),
+            ('openSUSE:Factory', 'standard', 'x86_64', 'b.rpm', '2'),
+        ]
+        self.checkrepo._download(request, todownload)
+
+        self.assertEqual(self.checkrepo._get_binary_file.call_count, 3)
+        repodir = os.path.join(osclib.checkrepo.DOWNLOADS, 'pkg', 'openSUSE:Factory', 'standard')
+        self.assertEqual(dict(request.downloads), {
+            ('openSUSE:Factory', 'standard', 'a'): [os.path.join(repodir, 'a', 'a.rpm')],
+            # Files other than RPMs go with the last RPM.
+            ('openSUSE:Factory', 'standard', 'b'): [os.path.join(repodir, 'b', 'b.rpm'),
+                                                    os.path.join(repodir, 'b', 'rpmlint.log')],
+        })
+        self.assertEqual(open(os.path.join(repodir, 'b', 'rpmlint.log')).read(), 'rpmlint.log')
+
+    def test_download_headers(self):
+        header = rpm(TAGS)
+        cpioheaders = archive([('a.rpm-' + '0' * 32, header), ('.errors', '')])
+        http_GET_orig = osclib.checkrepo.http_GET
+        http_GET = osclib.checkrepo.http_GET = MagicMock(return_value=StringIO(cpioheaders))
+        self.checkrepo.apiurl = APIURL
+        self.checkrepo.headers_only = True
+        try:
+            request = Request(request_id=1000, src_package='pkg')
+            request.downloads = defaultdict(list)
+            todownload = [
+                ('openSUSE:Factory', 'standard', 'x86_64', 'rpmlint.log', '0'),
+                ('openSUSE:Factory', 'standard', 'x86_64', 'a.rpm', '1'),
+            ]
+            self.checkrepo._download(request, todownload)
+        finally:
+            osclib.checkrepo.http_GET = http_GET_orig
+
+        # One request for all the headers, and rpmlint.log downloaded.
+        self.assertTrue('view=cpioheaders' in http_GET.call_args[0][0])
+        self.assertEqual(self.checkrepo._get_binary_file.call_count, 1)
+        repodir = os.path.join(osclib.checkrepo.DOWNLOADS, 'pkg', 'openSUSE:Factory', 'standard')
+        self.assertEqual(open(os.path.join(repodir, 'a', 'a.rpm')).read(), header)
+        self.assertEqual(open(os.path.join(repodir, 'a', 'rpmlint.log')).read(), 'rpmlint.log')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# Copyright (C) 2016 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Compare walking the payload of a RPM with many small entries through
+osclib.cpio.rpm_payload() and from the already decompressed archive.  Both
+should take about the same time, growing linearly with the entries.
+
+Run from the top directory:
+
+    python -m tests.cpio_benchmark [entries]
+
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from StringIO import StringIO
+
+from osclib.cpio import extract
+from osclib.cpio import rpm_payload
+from tests.rpmbuilder import archive
+from tests.rpmbuilder import write_rpm
+
+
+def benchmark(function):
+    start = time.time()
+    function()
+    return time.time() - start
+
+
+def main(entries):
+    tmpdir = tempfile.mkdtemp(prefix='cpio-')
+    try:
+        buf = archive([('./%d' % i, os.urandom(i % 1024)) for i in range(entries)])
+        filename = os.path.join(tmpdir, 'payload.rpm')
+        write_rpm(filename, buf, 'gzip')
+
+        def payload():
+            with rpm_payload(filename) as fh:
+                extract(fh, tmpdir, match=lambda name: False)
+
+        print '%-14s %12s' % ('method', 'total (ms)')
+        print '%-14s %12.3f' % ('decompressed', benchmark(
+            lambda: extract(StringIO(buf), tmpdir, match=lambda name: False)) * 1000)
+        print '%-14s %12.3f' % ('rpm_payload', benchmark(payload) * 1000)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 32000)
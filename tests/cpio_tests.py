@@ -0,0 +1,125 @@
+# Copyright (C) 2016 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import osclib.cpio
+from osclib.cpio import Cpio
+from osclib.cpio import extract
+from osclib.cpio import rpm_payload
+from osclib.cpio import stream
+from rpmbuilder import archive
+from rpmbuilder import write_rpm
+
+
+FILES = [
+    ('a', 'first file\n'),
+    ('dir/b', ''),
+    ('dir/c.so', '\x7fELF' + '\0' * 13),
+]
+
+
+class ChunkedIO(StringIO):
+    """Non seekable file object returning a few bytes per read."""
+
+    def read(self, size=-1):
+        return StringIO.read(self, min(size, 5))
+
+    def seek(self, *args):
+        raise IOError('not seekable')
+
+
+class TestCpio(unittest.TestCase):
+    def setUp(self):
+        """Initialize the environment."""
+        self.buf = archive(FILES)
+
+    def entries(self, cpio):
+        entries = []
+        for f in cpio:
+            payload = f.payload()
+            # A buffer for mmaps in Python 2
+            entries.append((f.name, payload.tobytes() if isinstance(payload, memoryview) else str(payload)))
+        return entries
+
+    def test_buffer(self):
+        self.assertEqual(self.entries(Cpio(self.buf)), FILES)
+        self.assertEqual([f.header() for f in Cpio(self.buf)], [payload for _, payload in FILES])
+
+    def test_mmap(self):
+        fd, filename = tempfile.mkstemp(prefix='cpio-')
+        try:
+            os.write(fd, self.buf)
+            os.close(fd)
+            with Cpio.open(filename) as cpio:
+                self.assertEqual(self.entries(cpio), FILES)
+            with open(filename, 'rb') as fh:
+                with Cpio.open(fh) as cpio:
+                    self.assertEqual(self.entries(cpio), FILES)
+        finally:
+            os.unlink(filename)
+
+    def test_stream(self):
+        self.assertEqual(self.entries(stream(ChunkedIO(self.buf))), FILES)
+        self.assertRaises(Exception, list, stream(StringIO(self.buf[:-20])))
+
+    def test_crc(self):
+        buf = self.buf.replace('070701', '070702')
+        self.assertEqual(self.entries(Cpio(buf)), FILES)
+
+    def test_extract(self):
+        dest = tempfile.mkdtemp(prefix='cpio-')
+        try:
+            extracted = extract(ChunkedIO(archive([('./' + name, payload) for name, payload in FILES])),
+                                dest, lambda name: name.startswith('/dir/'))
+            self.assertEqual(extracted, ['/dir/b', '/dir/c.so'])
+            self.assertEqual(sorted(os.listdir(dest)), ['dir'])
+            self.assertEqual(open(os.path.join(dest, 'dir/c.so')).read(), FILES[2][1])
+        finally:
+            shutil.rmtree(dest)
+
+    def test_rpm_payload(self):
+        fd, filename = tempfile.mkstemp(prefix='cpio-', suffix='.rpm')
+        os.close(fd)
+        try:
+            for compressor in ('gzip', 'xz'):
+                write_rpm(filename, self.buf, compressor)
+                with rpm_payload(filename) as payload:
+                    self.assertEqual(self.entries(stream(payload)), FILES)
+        finally:
+            os.unlink(filename)
+
+    def test_rpm_payload_entries(self):
+        # Many entries per decompressed block, read across block boundaries.
+        files = [('%d' % i, os.urandom(i % 7)) for i in range(5000)]
+        fd, filename = tempfile.mkstemp(prefix='cpio-', suffix='.rpm')
+        os.close(fd)
+        blocksize, osclib.cpio.BLOCKSIZE = osclib.cpio.BLOCKSIZE, 4096
+        try:
+            write_rpm(filename, archive(files), 'gzip')
+            with rpm_payload(filename) as payload:
+                self.assertEqual(self.entries(stream(payload)), files)
+        finally:
+            osclib.cpio.BLOCKSIZE = blocksize
+            os.unlink(filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
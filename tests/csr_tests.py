@@ -0,0 +1,118 @@
+# Copyright (C) 2016 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import tempfile
+import unittest
+
+from osclib.csr import CSRGraph
+from osclib.cycle import Graph
+
+
+EDGES = [('a', 'b'), ('b', 'c'), ('c', 'a'), ('a', 'd'), ('a', 'b')]
+
+
+class TestCSRGraph(unittest.TestCase):
+
+    def test_build(self):
+        graph = CSRGraph.build('abcde', EDGES)
+        self.assertEqual(len(graph), 5)
+        self.assertTrue('e' in graph)
+        self.assertEqual(graph.edges('a'), ['b', 'd'])
+        self.assertEqual(graph.edges('e'), [])
+        self.assertEqual(graph.edges_to('a'), ['c'])
+        self.assertEqual(graph.edges_to('b'), ['a'])
+        self.assertEqual(list(graph.predecessors(graph.index['d'])), [graph.index['a']])
+
+    def test_save_load(self):
+        for names, edges in (('abcde', EDGES), ('', [])):
+            graph = CSRGraph.build(names, edges)
+            with tempfile.TemporaryFile() as f:
+                graph.save(f)
+                f.seek(0)
+                loaded = CSRGraph.load(f)
+            self.assertEqual(loaded.names, graph.names)
+            for name in names:
+                self.assertEqual(loaded.edges(name), graph.edges(name))
+                self.assertEqual(loaded.edges_to(name), graph.edges_to(name))
+
+        # Graphs sharing their names.
+        graph = CSRGraph.build('abcde', EDGES)
+        other = CSRGraph.build(graph.names, [('e', 'a')], graph.index)
+        with tempfile.TemporaryFile() as f:
+            graph.save(f)
+            other.save(f, names=False)
+            f.seek(0)
+            loaded = CSRGraph.load(f)
+            loaded_other = CSRGraph.load(f, loaded.names, loaded.index)
+        self.assertEqual(loaded_other.edges('e'), ['a'])
+        self.assertTrue(loaded_other.index is loaded.index)
+
+        with tempfile.TemporaryFile() as f:
+            f.write('graph' * 10)
+            f.seek(0)
+            self.assertRaises(ValueError, CSRGraph.load, f)
+
+        with tempfile.TemporaryFile() as f:
+            graph.save(f)
+            f.truncate(f.tell() - 1)
+            f.seek(0)
+            self.assertRaises(ValueError, CSRGraph.load, f)
+
+
+class TestGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = Graph()
+        self.graph.add_nodes_from((name, None) for name in 'abcde')
+        self.graph.add_edges_from(EDGES)
+
+    def test_compact(self):
+        self.graph.compact([('e', 'a')])
+        self.assertEqual(self.graph.adj, {})
+        self.assertEqual(self.graph.edges('a'), ['b', 'd'])
+        self.assertEqual(self.graph.edges_to('a'), ['c', 'e'])
+        self.assertEqual(self.graph.cycles(), frozenset([frozenset('abc')]))
+
+        self.graph.remove_edge('c', 'a')
+        self.graph.add_edge('d', 'a')
+        self.assertEqual(self.graph.edges('c'), [])
+        self.assertEqual(self.graph.edges_to('a'), ['d', 'e'])
+        self.assertEqual(self.graph.cycles(), frozenset([frozenset('ad')]))
+
+        # Compacting again keeps the changes.
+        self.graph.add_node('f', None)
+        self.graph.add_edge('f', 'a')
+        self.graph.compact()
+        self.assertEqual(self.graph.edges_to('a'), ['d', 'e', 'f'])
+        self.assertEqual(self.graph.edges('c'), [])
+
+    def test_copy(self):
+        self.graph.compact()
+        graph = self.graph.copy()
+        graph.remove_edge('a', 'b')
+        graph.add_edge('b', 'd')
+        self.assertEqual(graph.edges('a'), ['d'])
+        self.assertEqual(self.graph.edges('a'), ['b', 'd'])
+        self.assertEqual(self.graph.edges('b'), ['c'])
+
+        copy = graph.copy()
+        copy.add_edge('b', 'e')
+        self.assertEqual(graph.edges('b'), ['c', 'd'])
+        self.assertEqual(copy.edges('b'), ['c', 'd', 'e'])
+
+
+if __name__ == '__main__':
+    unittest.main()
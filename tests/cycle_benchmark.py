@@ -0,0 +1,100 @@
+# Copyright (C) 2016 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Measure the cycle detection of osclib.cycle on a _builddepinfo.
+
+Run from the top directory, with a _builddepinfo captured with
+`osc api /build/openSUSE:Factory/standard/x86_64/_builddepinfo`:
+
+    python -m tests.cycle_benchmark [_builddepinfo.xml]
+
+Without a file, a random one of the size of Factory is used.
+
+"""
+
+from hashlib import md5
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from osclib import depsnapshot
+from osclib.checkrepo import Request
+from osclib.cycle import CycleDetector
+from osclib.cycle import Package
+from tests.cycle_tests import builddepinfo
+from tests.cycle_tests import reference_cycles
+
+
+def random_builddepinfo(size, degree):
+    """Mostly layered, as the real dependencies, with a few cycles."""
+    rnd = random.Random(0)
+    names = ['package%d' % i for i in range(size)]
+    return builddepinfo(dict(
+        (name, set(rnd.choice(names[:i] if i and rnd.random() < 0.995 else names) + '-devel'
+                   for _ in range(degree)))
+        for i, name in enumerate(names)))
+
+
+def measure(label, function, *args):
+    start = time.time()
+    result = function(*args)
+    print '%-28s %10.1f' % (label, (time.time() - start) * 1000)
+    return result
+
+
+def main(xml):
+    detector = CycleDetector(api=None)
+    detector._builddepinfo = lambda project, repository, arch: xml
+
+    print '%-28s %10s' % ('step', 'time (ms)')
+    measure('snapshot (parse)', depsnapshot.Snapshot.parse, xml)
+    measure('snapshot (get)', depsnapshot.get, 'Factory', 'standard', 'x86_64', xml)
+    filename = depsnapshot.path('Factory', 'standard', 'x86_64', md5(xml).hexdigest())
+    measure('snapshot (load)', depsnapshot.Snapshot.load, filename)
+    graph = measure('graph', detector._get_builddepinfo_graph, 'Factory', 'standard', 'x86_64')
+    cycles = measure('cycles', graph.cycles)
+
+    adj = dict((u, graph.successors(u)) for u in graph)
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(len(graph) + 1000)
+    try:
+        assert measure('cycles (recursive)', reference_cycles, adj) == cycles
+    except RuntimeError:
+        print '%-28s %10s' % ('cycles (recursive)', 'too deep')
+    finally:
+        sys.setrecursionlimit(limit)
+
+    # A request for a package in the middle of the graph.
+    package = sorted(graph)[len(graph) // 2]
+    measure('project graph', detector._get_project_graph, 'Factory', 'standard', 'x86_64')
+    snapshot = depsnapshot.get('Factory', 'standard', 'x86_64', xml)
+    detector._get_builddepinfo = lambda project, repository, arch, name: Package(info=snapshot[name])
+    request = Request(request_id=1, src_project='home:user', src_package=package,
+                      shadow_src_project='home:user', goodrepos=[('home:user', 'standard')])
+    measure('request', lambda: list(detector.cycles([request], project='Factory')))
+
+
+if __name__ == '__main__':
+    depsnapshot.SNAPSHOTDIR = tempfile.mkdtemp(prefix='depsnapshot-')
+    try:
+        if len(sys.argv) > 1:
+            main(open(sys.argv[1]).read())
+        else:
+            main(random_builddepinfo(13000, 12))
+    finally:
+        shutil.rmtree(depsnapshot.SNAPSHOTDIR)
@@ -0,0 +1,210 @@
+# Copyright (C) 2016 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import random
+import shutil
+import tempfile
+import unittest
+
+from osclib import depsnapshot
+from osclib.checkrepo import Request
+from osclib.cycle import CycleDetector
+from osclib.cycle import Graph
+from osclib.cycle import Package
+
+
+def builddepinfo(packages):
+    """Return a _builddepinfo document for 'packages', a dictionary of
+    package: dependencies.  Every package has a subpackage with the
+    same name and a -devel one.
+
+    """
+    xml = '<builddepinfo>'
+    for package, deps in sorted(packages.items()):
+        xml += '<package name="%s"><source>%s</source>' % (package, package)
+        xml += ''.join('<pkgdep>%s</pkgdep>' % dep for dep in sorted(deps))
+        xml += '<subpkg>%s</subpkg><subpkg>%s-devel</subpkg>' % (package, package)
+        xml += '</package>'
+    return xml + '</builddepinfo>'
+
+
+def random_packages(rnd, size, degree):
+    names = ['p%d' % i for i in range(size)]
+    return dict((name, set(rnd.choice(names) + rnd.choice(('', '-devel'))
+                           for _ in range(rnd.randint(0, degree))))
+                for name in names)
+
+
+def reference_cycles(adj):
+    """Cycles of the graph 'adj', a dictionary of node: successors, by
+    the recursive Tarjan algorithm Graph.cycles() used before.
+
+    """
+    index = [0]
+    path = []
+    cycles = []
+
+    v_index = {}
+    v_lowlink = {}
+
+    def scc(v):
+        v_index[v], v_lowlink[v] = index[0], index[0]
+        index[0] += 1
+        path.append(v)
+
+        for w in adj.get(v, []):
+            if w not in v_index:
+                scc(w)
+                v_lowlink[v] = min(v_lowlink[v], v_lowlink[w])
+            elif w in path:
+                v_lowlink[v] = min(v_lowlink[v], v_index[w])
+
+        if v_index[v] == v_lowlink[v]:
+            i = path.index(v)
+            path[:], cycle = path[:i], frozenset(path[i:])
+            if len(cycle) > 1:
+                cycles.append(cycle)
+
+    for v in sorted(adj):
+        if v not in v_index:
+            scc(v)
+    return frozenset(cycles)
+
+
+def random_graph(rnd, size, edges):
+    adj = dict(('p%d' % v, set()) for v in range(size))
+    for _ in range(edges):
+        adj['p%d' % rnd.randrange(size)].add('p%d' % rnd.randrange(size))
+    graph = Graph()
+    graph.add_nodes_from((v, None) for v in adj)
+    graph.add_edges_from((u, v) for u in adj for v in adj[u])
+    return adj, graph
+
+
+class TestGraphCycles(unittest.TestCase):
+
+    def test_fuzz(self):
+        rnd = random.Random(42)
+        for _ in range(500):
+            size = rnd.randint(1, 40)
+            adj, graph = random_graph(rnd, size, rnd.randint(0, 3 * size))
+            expected = reference_cycles(adj)
+            self.assertEqual(graph.cycles(), expected)
+
+            # Only the cycles reachable from some nodes.
+            nodes = rnd.sample(sorted(adj), rnd.randint(1, size))
+            reachable, pending = set(nodes), list(nodes)
+            while pending:
+                for w in adj[pending.pop()] - reachable:
+                    reachable.add(w)
+                    pending.append(w)
+            subset = frozenset(cycle for cycle in expected if cycle <= reachable)
+            self.assertEqual(graph.cycles(nodes), subset)
+
+            graph.compact()
+            self.assertEqual(graph.cycles(), expected)
+            self.assertEqual(graph.cycles(nodes), subset)
+
+    def test_deep(self):
+        # Deeper than the recursion limit.
+        names = ['p%d' % v for v in range(10000)]
+        graph = Graph()
+        graph.add_nodes_from((name, None) for name in names)
+        graph.compact(zip(names, names[1:]))
+        self.assertEqual(graph.cycles(), frozenset())
+        graph.add_edge(names[-1], names[-3])
+        graph.add_edge(names[1], names[0])
+        self.assertEqual(graph.cycles(), frozenset([frozenset(names[:2]), frozenset(names[-3:])]))
+
+
+class TestCycleDetector(unittest.TestCase):
+
+    def setUp(self):
+        CycleDetector._get_project_graph.cache.clear()
+        self._snapshotdir = depsnapshot.SNAPSHOTDIR
+        depsnapshot.SNAPSHOTDIR = tempfile.mkdtemp(prefix='depsnapshot-')
+
+    def tearDown(self):
+        shutil.rmtree(depsnapshot.SNAPSHOTDIR)
+        depsnapshot.SNAPSHOTDIR = self._snapshotdir
+        depsnapshot._snapshots.clear()
+
+    def detector(self, project, requests):
+        """Return a CycleDetector for the 'project' packages, where the
+        packages of 'requests' have other dependencies.
+
+        """
+        detector = CycleDetector(api=None)
+        detector._builddepinfo = lambda project_, repository, arch: builddepinfo(project)
+        detector._get_builddepinfo = lambda project_, repository, arch, package: Package(
+            pkg=package, src=package, deps=requests[package], subs=set((package, package + '-devel')))
+        return detector
+
+    def test_get_builddepinfo(self):
+        detector = CycleDetector(api=None)
+        detector._builddepinfo = lambda project, repository, arch: builddepinfo({'a': set(['b-devel'])})
+        package = detector._get_builddepinfo('home:user', 'standard', 'x86_64', 'a')
+        self.assertEqual((package.pkg, package.deps, package.subs), ('a', set(['b-devel']), set(['a', 'a-devel'])))
+        self.assertEqual(detector._get_builddepinfo('home:user', 'standard', 'x86_64', 'b'), None)
+
+    def check(self, project, requests):
+        """Return the cycles of CycleDetector.cycles() and the new cycles
+        of the full graph, built with the packages of the requests.
+
+        """
+        rqs = [Request(request_id=i, src_project='home:user', src_package=package,
+                       shadow_src_project='home:user', goodrepos=[('home:user', 'standard')])
+               for i, package in enumerate(sorted(requests))]
+        detector = self.detector(project, requests)
+        project_graph, _, _ = detector._get_project_graph('openSUSE:Factory', 'standard', 'x86_64')
+        edges = dict((u, project_graph.edges(u)) for u in project_graph)
+        cycles = list(detector.cycles(rqs, project='openSUSE:Factory'))
+        # The graph of the project is not modified.
+        self.assertEqual(dict((u, project_graph.edges(u)) for u in project_graph), edges)
+
+        current = dict(project, **requests)
+        full = self.detector(current, {})._get_builddepinfo_graph('openSUSE:Factory', 'standard', 'x86_64')
+        expected = full.cycles() - project_graph.cycles()
+        return cycles, expected
+
+    def test_cycles(self):
+        project = {'a': set(['b']), 'b': set(['a-devel']), 'c': set()}
+        cycles, expected = self.check(project, {'b': set(['c']), 'c': set(['a', 'b-devel'])})
+        self.assertEqual(cycles, [(frozenset('abc'), [('b', 'c'), ('c', 'a'), ('c', 'b')], True)])
+        self.assertEqual(set(cycle for cycle, _, _ in cycles), expected)
+
+        # A new edge, but in a cycle of the project.
+        cycles, expected = self.check(project, {'a': set(['b', 'b-devel'])})
+        self.assertEqual(cycles, [])
+
+        # The cycle of the project is broken.
+        cycles, expected = self.check(project, {'b': set()})
+        self.assertEqual(cycles, [])
+
+    def test_cycles_random(self):
+        rnd = random.Random(42)
+        for _ in range(50):
+            CycleDetector._get_project_graph.cache.clear()
+            project = random_packages(rnd, 30, 2)
+            changed = random_packages(rnd, 30, 2)
+            requests = dict((name, changed[name]) for name in rnd.sample(sorted(project), 3))
+            cycles, expected = self.check(project, requests)
+            self.assertEqual(set(cycle for cycle, _, _ in cycles), expected)
+            self.assertEqual(len(cycles), len(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+# Copyright (C) 2016 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+from hashlib import md5
+
+from mock import MagicMock
+from mock import patch
+
+from osclib import depsnapshot
+from osclib.checkrepo import CheckRepo
+from osclib.cycle import CycleDetector
+from osclib.depsnapshot import Snapshot
+from tests.builddepinfo_tests import BUILDDEPINFO
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self._snapshotdir = depsnapshot.SNAPSHOTDIR
+        depsnapshot.SNAPSHOTDIR = tempfile.mkdtemp(prefix='depsnapshot-')
+
+    def tearDown(self):
+        shutil.rmtree(depsnapshot.SNAPSHOTDIR)
+        depsnapshot.SNAPSHOTDIR = self._snapshotdir
+        depsnapshot._snapshots.clear()
+
+    def check(self, snapshot):
+        self.assertEqual([p.name for p in snapshot], ['glibc', 'gcc', 'glibc:i686', 'preinstallimage-base'])
+        self.assertTrue('glibc:i686' in snapshot)
+        self.assertFalse('glibc-devel' in snapshot)
+        self.assertEqual(snapshot['gcc'], ('gcc', 'gcc', ['glibc-devel'], ['gcc']))
+        self.assertRaises(KeyError, snapshot.__getitem__, 'glibc-devel')
+        self.assertEqual(snapshot.source('glibc:i686'), 'glibc')
+        self.assertEqual(snapshot.pkgdeps('gcc'), ['glibc-devel'])
+        self.assertEqual(snapshot.pkgdeps('glibc-devel'), [])
+        self.assertEqual(snapshot.subpkgs('glibc'), ['glibc', 'glibc-devel'])
+        self.assertEqual(sorted(snapshot.whatdependson('gcc')), ['glibc', 'glibc:i686'])
+        self.assertEqual(snapshot.whatdependson('unknown'), [])
+        self.assertEqual(snapshot.cycles, [frozenset(('gcc', 'glibc'))])
+
+        info = snapshot.builddepinfo(ignore=lambda name: name.startswith('preinstallimage-'))
+        self.assertEqual(info.names, ['glibc', 'gcc', 'glibc:i686'])
+        self.assertEqual(info['glibc:i686'].subs, ['glibc', 'glibc-32bit'])
+        self.assertEqual(info.subpkgs['glibc-32bit'], 'glibc:i686')
+
+    def test_parse(self):
+        self.check(Snapshot.parse(BUILDDEPINFO))
+
+    def test_save_load(self):
+        filename = os.path.join(depsnapshot.SNAPSHOTDIR, 'test.snapshot')
+        Snapshot.parse(BUILDDEPINFO).save(filename)
+        self.check(Snapshot.load(filename))
+        self.assertEqual(os.listdir(depsnapshot.SNAPSHOTDIR), ['test.snapshot'])
+
+        Snapshot.parse('<builddepinfo/>').save(filename)
+        self.assertEqual(list(Snapshot.load(filename)), [])
+
+    def test_load_invalid(self):
+        filename = os.path.join(depsnapshot.SNAPSHOTDIR, 'test.snapshot')
+        Snapshot.parse(BUILDDEPINFO).save(filename)
+        with open(filename, 'rb') as fh:
+            data = fh.read()
+        for invalid in ('x' + data[1:], data[:len(data) // 2]):
+            with open(filename, 'wb') as fh:
+                fh.write(invalid)
+            self.assertRaises(ValueError, Snapshot.load, filename)
+
+    def test_get(self):
+        snapshot = depsnapshot.get('openSUSE:Factory', 'standard', 'x86_64', BUILDDEPINFO)
+        self.check(snapshot)
+        self.assertTrue(depsnapshot.get('openSUSE:Factory', 'standard', 'x86_64', BUILDDEPINFO) is snapshot)
+        directory = os.path.join(depsnapshot.SNAPSHOTDIR, 'openSUSE:Factory', 'standard', 'x86_64')
+        filenames = os.listdir(directory)
+        self.assertEqual(len(filenames), 1)
+
+        # Loaded from the file in a new process.
+        depsnapshot._snapshots.clear()
+        parse_orig = Snapshot.__dict__['parse']
+        Snapshot.parse = parse = MagicMock()
+        try:
+            self.check(depsnapshot.get('openSUSE:Factory', 'standard', 'x86_64', BUILDDEPINFO))
+        finally:
+            Snapshot.parse = parse_orig
+        self.assertEqual(parse.call_count, 0)
+
+        # A new state replaces the snapshot of the repository only, but
+        # not the files being written by other processes.
+        depsnapshot.get('openSUSE:Factory', 'standard', 'i586', BUILDDEPINFO)
+        open(os.path.join(directory, 'other.snapshot.1.part'), 'w').close()
+        snapshot = depsnapshot.get('openSUSE:Factory', 'standard', 'x86_64', '<builddepinfo/>')
+        self.assertEqual(list(snapshot), [])
+        self.assertEqual(len(os.listdir(directory)), 2)
+        self.assertFalse(filenames[0] in os.listdir(directory))
+        self.assertTrue('other.snapshot.1.part' in os.listdir(directory))
+        self.assertEqual(len(os.listdir(os.path.join(depsnapshot.SNAPSHOTDIR, 'openSUSE:Factory', 'standard', 'i586'))), 1)
+
+    def test_get_keys(self):
+        # Names with '_' do not share their snapshots.
+        depsnapshot.get('home:a_b', 'c', 'x86_64', BUILDDEPINFO)
+        depsnapshot.get('home:a', 'b_c', 'x86_64', '<builddepinfo/>')
+        self.assertTrue(os.path.exists(depsnapshot.path('home:a_b', 'c', 'x86_64', md5(BUILDDEPINFO).hexdigest())))
+        self.assertTrue(os.path.exists(depsnapshot.path('home:a', 'b_c', 'x86_64', md5('<builddepinfo/>').hexdigest())))
+
+    def test_checkrepo(self):
+        builddepinfo = MagicMock(return_value=BUILDDEPINFO)
+        CheckRepo._snapshot.cache.clear()
+        try:
+            with patch.object(CycleDetector, '_builddepinfo_current', builddepinfo):
+                checkrepo = CheckRepo.__new__(CheckRepo)
+                checkrepo.staging = MagicMock(apiurl='http://localhost')
+                request = MagicMock(tgt_project='openSUSE:Factory', tgt_package='gcc')
+                self.assertEqual(checkrepo._whatdependson(request), set(('glibc', 'glibc:i686')))
+                self.assertEqual(checkrepo._builddepinfo('openSUSE:Factory', 'gcc'), set(('glibc-devel',)))
+            # The current _builddepinfo of every arch, read once.
+            self.assertEqual(builddepinfo.call_count, 2)
+        finally:
+            CheckRepo._snapshot.cache.clear()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# Copyright (C) 2016 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Compare the persistent backends of osclib.memoize.
+
+Run from the top directory:
+
+    python -m tests.memoize_benchmark [calls]
+
+"""
+
+import shutil
+import sys
+import tempfile
+import time
+
+import osclib.memoize
+from osclib.memoize import memoize
+
+
+def benchmark(backend, calls):
+    osclib.memoize.BACKEND = backend
+
+    @memoize()
+    def function(self, i):
+        return '<package name="%d"/>' % i * 16
+
+    start = time.time()
+    for i in range(calls):
+        function(None, i)
+    miss = time.time() - start
+
+    start = time.time()
+    for i in range(calls):
+        function(None, i)
+    hit = time.time() - start
+
+    return miss / calls, hit / calls
+
+
+def main(calls):
+    cachedir = osclib.memoize.CACHEDIR
+    print '%-8s %12s %12s' % ('backend', 'miss (ms)', 'hit (ms)')
+    for backend in sorted(osclib.memoize.BACKENDS):
+        osclib.memoize.CACHEDIR = tempfile.mkdtemp(prefix='memoize-')
+        try:
+            results = benchmark(backend, calls)
+        finally:
+            shutil.rmtree(osclib.memoize.CACHEDIR)
+        print '%-8s %12.3f %12.3f' % ((backend,) + tuple(r * 1000 for r in results))
+    osclib.memoize.CACHEDIR = cachedir
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,162 @@
+# Copyright (C) 2016 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+
+import osclib.memoize
+from osclib.memoize import memoize
+
+
+class TestMemoize(unittest.TestCase):
+    BACKEND = 'sqlite'
+
+    def setUp(self):
+        """Initialize the environment."""
+        self._cachedir = osclib.memoize.CACHEDIR
+        self._backend = osclib.memoize.BACKEND
+        osclib.memoize.CACHEDIR = tempfile.mkdtemp(prefix='memoize-')
+        osclib.memoize.BACKEND = self.BACKEND
+        self.calls = []
+
+    def tearDown(self):
+        """Clean the environment."""
+        shutil.rmtree(osclib.memoize.CACHEDIR)
+        osclib.memoize.CACHEDIR = self._cachedir
+        osclib.memoize.BACKEND = self._backend
+
+    def memoized(self, **kwargs):
+        @memoize(**kwargs)
+        def function(_self, value):
+            self.calls.append(value)
+            return {'value': value}
+        return function
+
+    def test_cache(self):
+        function = self.memoized()
+        self.assertEqual(function(self, 1), {'value': 1})
+        self.assertEqual(function(self, 1), {'value': 1})
+        self.assertEqual(function(self, 2), {'value': 2})
+        self.assertEqual(self.calls, [1, 2])
+
+        # Persistent caches are shared by the same function name.
+        function = self.memoized()
+        self.assertEqual(function(self, 1), {'value': 1})
+        self.assertEqual(self.calls, [1, 2])
+
+    def test_invalidate(self):
+        function = self.memoized(add_invalidate=True)
+        function(self, 1)
+        function(self, 2)
+        self._invalidate_function(1)
+        function(self, 1)
+        function(self, 2)
+        self.assertEqual(self.calls, [1, 2, 1])
+
+        self._invalidate_all()
+        function(self, 2)
+        self.assertEqual(self.calls, [1, 2, 1, 2])
+
+    def test_stats(self):
+        function = self.memoized()
+        function(self, 1)
+        function(self, 1)
+        function(self, 2)
+        stats = function.stats()
+        self.assertEqual((stats['hit'], stats['miss'], stats['entries']), (1, 2, 2))
+
+    def test_slots(self):
+        function = self.memoized(slots=8)
+        for i in range(8):
+            function(self, i)
+        # A quarter of the slots is freed when the limit is reached.
+        self.assertEqual(function.stats()['entries'], 6)
+        self.assertEqual(function.stats()['eviction'], 2)
+        function(self, 7)
+        self.assertEqual(self.calls, range(8))
+
+    def test_size(self):
+        function = self.memoized(size=1024)
+        for i in range(64):
+            function(self, 'x' * 64 + str(i))
+        stats = function.stats()
+        self.assertTrue(stats['bytes'] <= 1024)
+        self.assertEqual(stats['entries'] + stats['eviction'], 64)
+
+    def test_lru(self):
+        function = self.memoized(slots=8, policy='lru')
+        for i in range(7):
+            function(self, i)
+            # Keep the first entry in use.
+            function(self, 0)
+        function(self, 7)
+        del self.calls[:]
+        function(self, 0)
+        function(self, 1)
+        self.assertEqual(self.calls, [1])
+
+    def test_compress(self):
+        function = self.memoized(compress='zlib')
+        value = '<package name="osc"/>' * 1024
+        self.assertEqual(function(self, value), {'value': value})
+        self.assertEqual(function(self, value), {'value': value})
+        self.assertEqual(function(self, 1), {'value': 1})
+        self.assertEqual(function(self, 1), {'value': 1})
+        self.assertEqual(self.calls, [value, 1])
+        self.assertTrue(function.stats()['ratio'] > 10)
+
+    def test_refresh(self):
+        class later(datetime):
+            @classmethod
+            def now(cls):
+                return datetime.now() + timedelta(seconds=45)
+
+        function = self.memoized(ttl=60, refresh=0.5)
+        function(self, 1)
+        osclib.memoize.datetime = later
+        try:
+            # Served from the cache and recomputed in the background.
+            self.assertEqual(function(self, 1), {'value': 1})
+            for thread in threading.enumerate():
+                if thread is not threading.current_thread():
+                    self.assertTrue(thread.daemon)
+                    thread.join()
+        finally:
+            osclib.memoize.datetime = datetime
+        self.assertEqual(self.calls, [1, 1])
+        self.assertEqual(function.stats()['refresh'], 1)
+
+    def test_prune(self):
+        function = self.memoized(ttl=60)
+        function(self, 1)
+        filename = function.cache.filename
+        self.assertEqual(osclib.memoize.prune(filename), 0)
+        self.assertEqual(osclib.memoize.prune(filename, ttl=-1), 1)
+        self.assertEqual(function.stats()['entries'], 0)
+
+
+class TestMemoizeShelve(TestMemoize):
+    BACKEND = 'shelve'
+
+    # Sizes, access times and pruning are only kept by the sqlite backend.
+    test_size = test_lru = test_refresh = test_prune = None
+
+
+if __name__ == '__main__':
+    unittest.main()
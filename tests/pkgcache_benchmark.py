@@ -0,0 +1,80 @@
+# Copyright (C) 2016 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Measure the start-up time of osclib.pkgcache against the cache size.
+
+Run from the top directory:
+
+    python -m tests.pkgcache_benchmark [entries ...]
+
+"""
+
+import hashlib
+import shutil
+import sys
+import tempfile
+import time
+
+from osclib.pkgcache import PkgCache
+
+
+def populate(cache, entries):
+    index = cache._open_index()
+    with index:
+        for i in range(entries):
+            key = ('openSUSE:Factory', 'standard', 'x86_64', 'package%d' % i,
+                   'package%d-1.0-1.1.x86_64.rpm' % i, int(time.time()))
+            cache._insert(key, hashlib.md5(str(i)).hexdigest(), key[-2], index)
+    cache._close_index(index)
+    return key
+
+
+def benchmark(entries):
+    basecachedir = tempfile.mkdtemp(prefix='pkgcache-')
+    try:
+        key = populate(PkgCache(basecachedir), entries)
+
+        start = time.time()
+        cache = PkgCache(basecachedir)
+        init = time.time() - start
+
+        start = time.time()
+        cache.maintenance()
+        clean = time.time() - start
+
+        start = time.time()
+        cache.maintenance()
+        throttled = time.time() - start
+
+        start = time.time()
+        for _ in range(100):
+            key in cache
+        contains = (time.time() - start) / 100
+    finally:
+        shutil.rmtree(basecachedir)
+
+    return init, clean, throttled, contains
+
+
+def main(sizes):
+    print '%-8s %10s %12s %15s %10s' % ('entries', 'init (ms)', 'clean (ms)', 'throttled (ms)', 'in (ms)')
+    for entries in sizes:
+        results = benchmark(entries)
+        print '%-8d %10.3f %12.3f %15.3f %10.3f' % ((entries,) + tuple(r * 1000 for r in results))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 50000])
@@ -0,0 +1,137 @@
+# Copyright (C) 2016 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Share an osclib.pkgcache between several processes adding, linking and
+removing files at the same time, and check the cache is consistent.
+
+Run from the top directory:
+
+    python -m tests.pkgcache_stress [processes] [operations]
+
+"""
+
+import glob
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+
+from osclib.pkgcache import PkgCache
+
+
+# Number of different contents and keys used by the workers
+CONTENTS = 8
+PACKAGES = 32
+
+
+def worker(basecachedir, worker, operations):
+    random.seed(worker)
+    cache = PkgCache(basecachedir, quota_files=CONTENTS - 2)
+    target = os.path.join(basecachedir, 'target-%d' % worker)
+    for _ in range(operations):
+        package = random.randrange(PACKAGES)
+        key = ('openSUSE:Factory', 'standard', 'x86_64', 'package%d' % package,
+               'package%d.rpm' % package, random.randrange(2))
+        action = random.random()
+        if action < 0.1:
+            try:
+                del cache[key]
+            except KeyError:
+                pass
+        elif key in cache:
+            if os.path.exists(target):
+                os.unlink(target)
+            try:
+                cache.linkto(key, target)
+            except KeyError:
+                # Evicted or removed after the lookup.
+                continue
+            assert os.path.exists(target)
+        else:
+            cache[key] = os.path.join(basecachedir, 'content-%d' % (package % CONTENTS))
+
+
+def check(basecachedir):
+    """Return the inconsistencies between the index and the blobs."""
+    errors = []
+    cache = PkgCache(basecachedir)
+    index = cache._open_index()
+    refcounts = dict(index.execute('SELECT md5, COUNT(*) FROM pkgcache GROUP BY md5'))
+    blobs = dict(index.execute('SELECT md5, refcount FROM blobs'))
+    cache._close_index(index)
+
+    if refcounts != blobs:
+        errors.append('reference counts %s do not match the keys %s' % (blobs, refcounts))
+    files = set(os.path.relpath(path, cache.cachedir).replace('/', '')
+                for path in glob.glob(os.path.join(cache.cachedir, '??', '*')))
+    if files != set(blobs):
+        errors.append('blobs %s do not match the index %s' % (sorted(files), sorted(blobs)))
+    return errors
+
+
+def stress(basecachedir, processes, operations):
+    """Run 'processes' workers with 'operations' each on a cache in
+    'basecachedir'.  Return the list of errors found.
+
+    """
+    PkgCache(basecachedir)
+    for i in range(CONTENTS):
+        with open(os.path.join(basecachedir, 'content-%d' % i), 'w') as f:
+            f.write('content %d\n' % i)
+
+    errors = []
+    pids = []
+    for i in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                worker(basecachedir, i, operations)
+            except Exception:
+                traceback.print_exc()
+                status = 1
+            os._exit(status)
+        pids.append(pid)
+    for pid in pids:
+        _, status = os.waitpid(pid, 0)
+        if status:
+            errors.append('worker %d failed' % pid)
+
+    return errors + check(basecachedir)
+
+
+def main(processes, operations):
+    basecachedir = tempfile.mkdtemp(prefix='pkgcache-')
+    try:
+        start = time.time()
+        errors = stress(basecachedir, processes, operations)
+        elapsed = time.time() - start
+    finally:
+        shutil.rmtree(basecachedir)
+
+    print '%d processes, %d operations: %.3f ms per operation' % (
+        processes, operations, elapsed * 1000 / (processes * operations))
+    for error in errors:
+        print error
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    sys.exit(main(*(args + [8, 500][len(args):])))
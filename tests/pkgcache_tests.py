@@ -14,8 +14,13 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import glob
 import os
+import pickle
+import shelve
 import shutil
+import tempfile
+import time
 import unittest
 
 from mock import MagicMock
@@ -23,6 +28,8 @@ from mock import MagicMock
 import osclib.pkgcache
 from osclib.pkgcache import PkgCache
 
+from . import pkgcache_stress
+
 
 class TestPkgCache(unittest.TestCase):
     def setUp(self):
@@ -80,28 +87,42 @@ class TestPkgCache(unittest.TestCase):
         self.assertFalse(os.path.exists('/tmp/cache/pkgcache/22'))
         self.assertTrue(os.path.exists('/tmp/cache/pkgcache'))
 
+    def refcount(self, md5):
+        index = self.cache._open_index()
+        row = index.execute('SELECT refcount FROM blobs WHERE md5 = ?', (md5,)).fetchone()
+        self.cache._close_index(index)
+        return row[0] if row else 0
+
     def test_collision(self):
         self.cache[('file_a', 1)] = '/tmp/file_a'
         self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a'))
         self.cache[('file_a', 2)] = '/tmp/file_a'
-        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-001'))
         self.cache[('file_a', 3)] = '/tmp/file_a'
-        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-002'))
+        self.assertEqual(os.listdir('/tmp/cache/pkgcache/c7'), ['f33375edf32d8fb62d4b505c74519a'])
+        self.assertEqual(self.refcount('c7f33375edf32d8fb62d4b505c74519a'), 3)
 
-        del self.cache[('file_a', 2)]
-        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a'))
-        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-001'))
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-002'))
+        # Adding the same key again does not add a reference.
+        self.cache[('file_a', 3)] = '/tmp/file_a'
+        self.assertEqual(self.refcount('c7f33375edf32d8fb62d4b505c74519a'), 3)
 
+        del self.cache[('file_a', 2)]
+        self.assertEqual(self.refcount('c7f33375edf32d8fb62d4b505c74519a'), 2)
+        self.assertEqual(self.cache.stats()['bytes'], 7)
         del self.cache[('file_a', 1)]
         self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a'))
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-001'))
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-002'))
+        self.assertEqual(self.refcount('c7f33375edf32d8fb62d4b505c74519a'), 1)
 
         del self.cache[('file_a', 3)]
         self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a'))
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-001'))
-        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-002'))
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7'))
+        self.assertEqual(self.refcount('c7f33375edf32d8fb62d4b505c74519a'), 0)
+
+    def test_replace(self):
+        self.cache[('file_a', 1)] = '/tmp/file_a'
+        self.cache[('file_a', 1)] = '/tmp/file_b'
+        self.assertEqual(self.cache[('file_a', 1)], ('a7004efbb89078ebcc8f21d55354e2f3', 'file_b'))
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7'))
+        self.assertEqual(self.refcount('a7004efbb89078ebcc8f21d55354e2f3'), 1)
 
     def test_linkto(self):
         self.cache[('file_a', 1)] = '/tmp/file_a'
@@ -111,6 +132,23 @@ class TestPkgCache(unittest.TestCase):
         os.unlink('/tmp/file_a_')
         self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a'))
 
+    def test_linkto_evicted(self):
+        self.cache[('file_a', 1)] = '/tmp/file_a'
+
+        # Evicted by another writer between the lookup and the link, which
+        # can only happen as linkto() does not hold the lock.
+        link = os.link
+        def evict(source, target):
+            del self.cache[('file_a', 1)]
+            link(source, target)
+
+        osclib.pkgcache.os.link = MagicMock(side_effect=evict)
+        try:
+            self.assertRaises(KeyError, self.cache.linkto, ('file_a', 1), '/tmp/file_a_')
+        finally:
+            osclib.pkgcache.os.link = link
+        self.assertFalse(os.path.exists('/tmp/file_a_'))
+
     def test_clean(self):
         self.cache[('file_a', 1)] = '/tmp/file_a'
         self.cache[('file_a', 2)] = '/tmp/file_a'
@@ -120,12 +158,137 @@ class TestPkgCache(unittest.TestCase):
         self.cache[('file_c', 1)] = '/tmp/file_c'
 
         osclib.pkgcache.time.time = MagicMock(return_value=3)
-        self.cache._clean_cache(ttl=2)
+        # Look up the unreferenced blobs in several queries.
+        osclib.pkgcache.QUERY_DIGESTS, query_digests = 1, osclib.pkgcache.QUERY_DIGESTS
+        try:
+            self.cache._clean_cache(ttl=2)
+        finally:
+            osclib.pkgcache.QUERY_DIGESTS = query_digests
         self.assertFalse(('file_a', 1) in self.cache)
         self.assertFalse(('file_a', 2) in self.cache)
         self.assertTrue(('file_a', 3) in self.cache)
         self.assertFalse(('file_b', 1) in self.cache)
         self.assertFalse(('file_c', 1) in self.cache)
+        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a'))
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/a7/004efbb89078ebcc8f21d55354e2f3'))
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/22/ee05516c08f3672cb25e03ce7f045f'))
+
+    def test_maintenance(self):
+        self.cache[('file_a', 1)] = '/tmp/file_a'
+        self.cache[('file_a', 2)] = '/tmp/file_a'
+
+        osclib.pkgcache.time = MagicMock()
+        osclib.pkgcache.time.time.return_value = 3
+        try:
+            self.assertTrue(self.cache.maintenance(ttl=10, interval=60))
+            self.assertEqual(self.cache.keys(), [('file_a', 2)])
+
+            # Throttled until the interval is over.
+            self.cache[('file_a', 3)] = '/tmp/file_a'
+            self.assertFalse(self.cache.maintenance(ttl=10, interval=60))
+            self.assertEqual(len(self.cache.keys()), 2)
+            osclib.pkgcache.time.time.return_value = 63
+            self.assertTrue(self.cache.maintenance(ttl=100, interval=60))
+            self.assertEqual(self.cache.keys(), [('file_a', 3)])
+        finally:
+            osclib.pkgcache.time = time
+
+        self.assertTrue(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a'))
+        self.assertFalse(os.path.exists('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-001'))
+
+    def test_quota(self):
+        self.cache.quota_files = 2
+        osclib.pkgcache.time = MagicMock()
+        try:
+            for now, fn in enumerate(('file_a', 'file_b')):
+                osclib.pkgcache.time.time.return_value = now
+                self.cache[(fn, 1)] = '/tmp/' + fn
+
+            # The least recently used blob is evicted, with its keys.
+            osclib.pkgcache.time.time.return_value = 2
+            self.cache.linkto(('file_a', 1), '/tmp/file_a_')
+            os.unlink('/tmp/file_a_')
+            osclib.pkgcache.time.time.return_value = 3
+            self.cache[('file_c', 1)] = '/tmp/file_c'
+            self.assertEqual(sorted(self.cache.keys()), [('file_a', 1), ('file_c', 1)])
+            self.assertFalse(os.path.exists('/tmp/cache/pkgcache/a7'))
+
+            self.cache.quota_files = None
+            self.cache.quota_bytes = len('file_c\n')
+            self.assertTrue(self.cache.maintenance())
+            self.assertEqual(self.cache.keys(), [('file_c', 1)])
+        finally:
+            osclib.pkgcache.time = time
+
+    def test_stats(self):
+        self.cache[('file_a', 1)] = '/tmp/file_a'
+        self.cache[('file_a', 2)] = '/tmp/file_a'
+        self.cache[('file_b', 1)] = '/tmp/file_b'
+        self.cache.linkto(('file_b', 1), '/tmp/file_b_')
+        os.unlink('/tmp/file_b_')
+        self.assertEqual(self.cache.stats(), {
+            'files': 2,
+            'bytes': 14,
+            'downloaded': 21,
+            'dedup_saved': 7,
+            'hit': 7,
+            'evicted': 0,
+        })
+
+    def test_get_binary_file(self):
+        http_GET = osclib.pkgcache.osc.core.http_GET
+        osclib.pkgcache.osc.core.http_GET = MagicMock(return_value=open('/tmp/file_a', 'rb'))
+        osclib.pkgcache.BLOCKSIZE, blocksize = 2, osclib.pkgcache.BLOCKSIZE
+        try:
+            md5 = osclib.pkgcache.get_binary_file('http://localhost', 'openSUSE:Factory', 'standard',
+                                                  'x86_64', 'file_a', target_filename='/tmp/file_a_')
+        finally:
+            osclib.pkgcache.osc.core.http_GET = http_GET
+            osclib.pkgcache.BLOCKSIZE = blocksize
+        self.assertEqual(md5, 'c7f33375edf32d8fb62d4b505c74519a')
+        self.assertEqual(osclib.pkgcache.md5sum('/tmp/file_a_'), md5)
+
+        self.cache.add(('file_a', 1), '/tmp/file_a_', md5)
+        os.unlink('/tmp/file_a_')
+        self.assertEqual(open('/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a').read(), 'file_a\n')
+
+    def test_get_binary_file_error(self):
+        http_GET = osclib.pkgcache.osc.core.http_GET
+        f = MagicMock()
+        f.read.side_effect = ['fi', IOError('connection reset')]
+        osclib.pkgcache.osc.core.http_GET = MagicMock(return_value=f)
+        try:
+            self.assertRaises(IOError, osclib.pkgcache.get_binary_file, 'http://localhost', 'openSUSE:Factory',
+                              'standard', 'x86_64', 'file_a', target_filename='/tmp/file_a_')
+        finally:
+            osclib.pkgcache.osc.core.http_GET = http_GET
+        self.assertFalse(os.path.exists('/tmp/file_a_.part'))
+        self.assertFalse(os.path.exists('/tmp/file_a_'))
+
+    def test_concurrency(self):
+        basecachedir = tempfile.mkdtemp(prefix='pkgcache-')
+        try:
+            self.assertEqual(pkgcache_stress.stress(basecachedir, 4, 100), [])
+        finally:
+            shutil.rmtree(basecachedir)
+
+    def test_migrate(self):
+        shutil.rmtree('/tmp/cache')
+        os.makedirs('/tmp/cache/pkgcache/c7')
+        os.link('/tmp/file_a', '/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a')
+        os.link('/tmp/file_a', '/tmp/cache/pkgcache/c7/f33375edf32d8fb62d4b505c74519a-001')
+        index = shelve.open('/tmp/cache/pkgcache/index.db', protocol=-1)
+        for mtime in (1, 2):
+            index[pickle.dumps(('file_a', mtime), protocol=-1)] = pickle.dumps(
+                ('c7f33375edf32d8fb62d4b505c74519a', 'file_a'), protocol=-1)
+        index.close()
+
+        self.cache = PkgCache('/tmp/cache')
+        self.assertEqual(self.cache[('file_a', 1)], ('c7f33375edf32d8fb62d4b505c74519a', 'file_a'))
+        self.assertEqual(glob.glob('/tmp/cache/pkgcache/index.db*'), [])
+        self.assertEqual(os.listdir('/tmp/cache/pkgcache/c7'), ['f33375edf32d8fb62d4b505c74519a'])
+        self.assertEqual(self.refcount('c7f33375edf32d8fb62d4b505c74519a'), 2)
+        self.assertEqual(self.cache.stats()['bytes'], 7)
 
 if __name__ == '__main__':
     unittest.main()
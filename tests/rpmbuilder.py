@@ -0,0 +1,90 @@
+# Copyright (C) 2016 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Build minimal RPMs and cpio archives for the tests and benchmarks."""
+
+import gzip
+import struct
+import subprocess
+
+from osclib import rpmheader
+
+
+TAGS = [
+    (rpmheader.NAME, rpmheader.STRING, 'libfoo1'),
+    (rpmheader.EPOCH, rpmheader.INT32, [1]),
+    (rpmheader.DISTURL, rpmheader.STRING,
+     'obs://build.opensuse.org/openSUSE:Factory/standard/0123456789abcdef-foo'),
+    (rpmheader.PROVIDENAME, rpmheader.STRING_ARRAY, ['libfoo.so.1()(64bit)', 'libfoo1']),
+    (rpmheader.REQUIRENAME, rpmheader.STRING_ARRAY, ['/sbin/ldconfig', 'glibc']),
+    (rpmheader.REQUIREFLAGS, rpmheader.INT32, [0, 12]),
+    (rpmheader.PROVIDEFLAGS, rpmheader.INT32, [0, 8]),
+    (rpmheader.REQUIREVERSION, rpmheader.STRING_ARRAY, ['', '2.26']),
+    (rpmheader.PROVIDEVERSION, rpmheader.STRING_ARRAY, ['', '1.0-1.1']),
+    (rpmheader.DIRINDEXES, rpmheader.INT32, [0, 1]),
+    (rpmheader.BASENAMES, rpmheader.STRING_ARRAY, ['libfoo.so.1', 'README']),
+    (rpmheader.DIRNAMES, rpmheader.STRING_ARRAY, ['/usr/lib64/', '/usr/share/doc/foo/']),
+    (rpmheader.PAYLOADCOMPRESSOR, rpmheader.STRING, 'xz'),
+]
+
+
+def header(tags):
+    """Return a header structure with 'tags', a list of (tag, type, value)."""
+    index = store = ''
+    for tag, type_, value in tags:
+        if type_ == rpmheader.INT32:
+            store += '\0' * (-len(store) % 4)
+            data, count = struct.pack('>%dI' % len(value), *value), len(value)
+        elif type_ == rpmheader.STRING_ARRAY:
+            data, count = ''.join(v + '\0' for v in value), len(value)
+        else:
+            data, count = value + '\0', 1
+        index += struct.pack('>IIII', tag, type_, len(store), count)
+        store += data
+    return struct.pack('>8sII', rpmheader.HEADER_MAGIC, len(tags), len(store)) + index + store
+
+
+def rpm(tags, payload=''):
+    """Return a RPM with the main header 'tags'."""
+    signature = header([(1000, rpmheader.STRING, 'size')])
+    return (rpmheader.LEAD_MAGIC.ljust(96, '\0') +
+            signature + '\0' * (-len(signature) % 8) + header(tags) + payload)
+
+
+def write_rpm(filename, payload, compressor):
+    """Write a minimal RPM with 'payload' compressed by 'compressor'."""
+    with open(filename, 'wb') as f:
+        f.write(rpm([(rpmheader.NAME, rpmheader.STRING, 'name'),
+                     (rpmheader.PAYLOADCOMPRESSOR, rpmheader.STRING, compressor)]))
+        if compressor == 'gzip':
+            gz = gzip.GzipFile(fileobj=f, mode='wb')
+            gz.write(payload)
+            gz.close()
+        else:
+            f.flush()
+            process = subprocess.Popen(['xz', '-c'], stdin=subprocess.PIPE, stdout=f)
+            process.communicate(payload)
+
+
+def archive(files):
+    """Return an archive in the "new ASCII" format with 'files'."""
+    buf = ''
+    for ino, (name, payload) in enumerate(files + [('TRAILER!!!', '')]):
+        fields = (ino, 0100644, 0, 0, 1, 0, len(payload), 0, 0, 0, 0, len(name) + 1, 0)
+        buf += '070701' + ''.join('%08x' % field for field in fields) + name + '\0'
+        buf += '\0' * (-len(buf) % 4) + payload
+        buf += '\0' * (-len(buf) % 4)
+    return buf
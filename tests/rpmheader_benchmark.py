@@ -0,0 +1,75 @@
+# Copyright (C) 2016 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Compare reading the DISTURL of a RPM with osclib.rpmheader and with
+`rpm -qp` (when installed).
+
+Run from the top directory:
+
+    python -m tests.rpmheader_benchmark [files]
+
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from osclib.rpmheader import Package
+from tests.rpmbuilder import TAGS
+from tests.rpmbuilder import rpm
+
+
+def native(filename):
+    return Package.open(filename).disturl
+
+
+def command(filename):
+    return subprocess.check_output(
+        ('rpm', '--nosignature', '--queryformat', '%{DISTURL}', '-qp', filename))
+
+
+def benchmark(function, filenames):
+    start = time.time()
+    for filename in filenames:
+        function(filename)
+    return (time.time() - start) / len(filenames)
+
+
+def main(files):
+    tmpdir = tempfile.mkdtemp(prefix='rpmheader-')
+    try:
+        filenames = []
+        for i in range(files):
+            filename = os.path.join(tmpdir, '%d.rpm' % i)
+            with open(filename, 'wb') as f:
+                f.write(rpm(TAGS, '\0' * 4096))
+            filenames.append(filename)
+
+        print '%-10s %12s' % ('method', 'file (ms)')
+        print '%-10s %12.3f' % ('rpmheader', benchmark(native, filenames) * 1000)
+        try:
+            print '%-10s %12.3f' % ('rpm -qp', benchmark(command, filenames) * 1000)
+        except OSError:
+            print '%-10s %12s' % ('rpm -qp', 'not installed')
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,69 @@
+# Copyright (C) 2016 SUSE Linux GmbH
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import os
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from osclib import rpmheader
+from osclib.rpmheader import Package
+from rpmbuilder import TAGS
+from rpmbuilder import rpm
+
+
+class TestRpmHeader(unittest.TestCase):
+
+    def test_read(self):
+        fh = StringIO(rpm(TAGS, 'payload'))
+        package = Package.read(fh)
+        self.assertEqual(fh.read(), 'payload')
+
+        self.assertEqual(package.name, 'libfoo1')
+        self.assertEqual(package.header[rpmheader.EPOCH], [1])
+        self.assertEqual(package.disturl, TAGS[2][2])
+        self.assertEqual(package.payloadcompressor, 'xz')
+        self.assertEqual(package.provides, [('libfoo.so.1()(64bit)', 0, ''), ('libfoo1', 8, '1.0-1.1')])
+        self.assertEqual(package.requires, [('/sbin/ldconfig', 0, ''), ('glibc', 12, '2.26')])
+        self.assertEqual(package.filenames, ['/usr/lib64/libfoo.so.1', '/usr/share/doc/foo/README'])
+
+    def test_defaults(self):
+        package = Package.read(StringIO(rpm(TAGS[:1])))
+        self.assertEqual(package.disturl, None)
+        self.assertEqual(package.payloadcompressor, 'gzip')
+        self.assertEqual(package.provides, [])
+        self.assertEqual(package.filenames, [])
+
+        package = Package.read(StringIO(rpm(TAGS[:1] + [
+            (rpmheader.OLDFILENAMES, rpmheader.STRING_ARRAY, ['/etc/foo.conf'])])))
+        self.assertEqual(package.filenames, ['/etc/foo.conf'])
+
+    def test_open(self):
+        fd, filename = tempfile.mkstemp(prefix='rpmheader-', suffix='.rpm')
+        try:
+            os.write(fd, rpm(TAGS))
+            os.close(fd)
+            self.assertEqual(Package.open(filename).name, 'libfoo1')
+        finally:
+            os.unlink(filename)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, Package.read, StringIO('\0' * 200))
+        self.assertRaises(ValueError, Package.read, StringIO(rpm(TAGS)[:200]))
+
+
+if __name__ == '__main__':
+    unittest.main()